@@ -0,0 +1,102 @@
+# Throughput of each token counter backend on the same synthetic pages.
+#
+#   python -m benchmarks.bench_counters --pages 2000 --model en_core_web_sm
+#   python -m benchmarks.bench_counters --hf /models/llama3/tokenizer.json --sentencepiece /models/mistral.model
+#
+# Without --hf/--sentencepiece, tiny BPE and SentencePiece models are trained on the synthetic
+# text, so the numbers show tokenizer overhead rather than real vocabularies. Backends whose
+# package (or tiktoken encoding file) isn't available are skipped. Finally every counter runs
+# together through process_document_bytes to check the extra columns.
+import argparse
+import io
+import random
+import tempfile
+import time
+
+from benchmarks.synthetic import make_document_bytes, make_page_text
+from sum_from_S3 import process_document_bytes
+from token_counters import init_counters, make_counter
+
+
+def train_bpe(texts: list[str], path: str, vocab_size: int) -> str:
+    from tokenizers import Tokenizer, models, pre_tokenizers, trainers
+
+    tokenizer = Tokenizer(models.BPE(unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=["[UNK]"])
+    tokenizer.train_from_iterator(texts, trainer)
+    tokenizer.save(path)
+    return path
+
+
+def train_sentencepiece(texts: list[str], path: str, vocab_size: int) -> str:
+    import sentencepiece
+
+    model = io.BytesIO()
+    sentencepiece.SentencePieceTrainer.train(
+        sentence_iterator=iter(texts), model_writer=model, vocab_size=vocab_size, minloglevel=2
+    )
+    with open(path, "wb") as f:
+        f.write(model.getvalue())
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=300)
+    parser.add_argument("--model", default="en_core_web_sm")
+    parser.add_argument("--hf", help="tokenizer.json to use instead of a locally trained BPE")
+    parser.add_argument("--sentencepiece", help=".model file to use instead of a locally trained one")
+    parser.add_argument("--tiktoken", default="cl100k_base")
+    parser.add_argument("--vocab-size", type=int, default=500)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    texts = [make_page_text(rng, args.words) for _ in range(args.pages)]
+    workdir = tempfile.mkdtemp()
+
+    specs = ["regex", "whitespace", f"spacy:{args.model}"]
+    try:
+        specs.append(f"hf:{args.hf or train_bpe(texts[:200], f'{workdir}/bpe.json', args.vocab_size)}")
+    except ImportError:
+        print("skipping hf: tokenizers is not installed")
+    try:
+        model = args.sentencepiece or train_sentencepiece(texts[:200], f"{workdir}/sp.model", args.vocab_size)
+        specs.append(f"sentencepiece:{model}")
+    except ImportError:
+        print("skipping sentencepiece: sentencepiece is not installed")
+    specs.append(f"tiktoken:{args.tiktoken}")
+
+    chars = sum(len(text) for text in texts)
+    print(f"{args.pages} pages, {chars / 1e6:.1f}M characters")
+    available = []
+    for spec in specs:
+        try:
+            counter = make_counter(spec)
+            counter.count(["Warm up the tokenizer."])
+        except Exception as e:
+            print(f"skipping {spec}: {e}")
+            continue
+        start = time.perf_counter()
+        counts = counter.count(texts)
+        secs = time.perf_counter() - start
+        available.append(spec)
+        print(
+            f"{counter.name:<14} {args.pages / secs:10.0f} pages/sec {sum(counts) / secs:12.0f} tokens/sec"
+            f"  {sum(counts) / args.pages:7.1f} tokens/page"
+        )
+
+    body = make_document_bytes(1, 50, args.words, rng)
+    init_counters(available[:1])
+    single = process_document_bytes(body)
+    init_counters(available)
+    doc_stats, page_stats = process_document_bytes(body)
+    assert doc_stats["token_total"] == single[0]["token_total"], "extra counters changed the primary counts"
+    extra = sorted(key for key in doc_stats if key.startswith("token_total_"))
+    assert len(extra) == len(available) - 1 and all(len(row) == 3 + len(extra) for row in page_stats)
+    print(f"process_document_bytes with {len(available)} counters: columns {', '.join(extra)}")
+
+
+if __name__ == "__main__":
+    main()
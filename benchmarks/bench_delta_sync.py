@@ -0,0 +1,90 @@
+# Full listing versus incremental delta sync against a local fake DocumentCloud and moto S3.
+#
+#   python -m benchmarks.bench_delta_sync --docs 300 --new 20 --changed 10
+#
+# The first export lists the whole project; the second, after adding and reprocessing a few
+# documents, only asks DocumentCloud for what changed and re-exports the reprocessed documents.
+# Both build text URLs from the listing metadata rather than asking the API for each document.
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+from datetime import timedelta
+
+import boto3
+
+from benchmarks.fake_documentcloud import FakeDocumentCloud
+from benchmarks.local_s3 import start_local_s3
+from benchmarks.synthetic import make_page_text
+from codec import decode_body
+from dc_to_s3 import dc_to_s3
+
+BUCKET = "obd-sum-stats"
+
+
+async def export(fake: FakeDocumentCloud, ledger_path: str, max_documents: int) -> tuple[dict, float]:
+    fake.requests.clear()
+    exporter = dc_to_s3(
+        project_id=fake.project_id,
+        max_documents=max_documents,
+        num_consumers=8,
+        ledger_path=ledger_path,
+        listing_max_age=timedelta(days=7),
+        incremental=True,
+    )
+    start = time.perf_counter()
+    await exporter.export_with_queue()
+    return dict(fake.requests), time.perf_counter() - start
+
+
+async def run(args):
+    rng = random.Random(0)
+    fake = FakeDocumentCloud(project_id=216694)
+    for doc_id in range(1, args.docs + 1):
+        fake.add_document(doc_id, [make_page_text(rng, 50) for _ in range(rng.randint(1, 5))])
+    ledger_path = f"{tempfile.mkdtemp()}/ledger.sqlite3"
+
+    async with fake.serve(args.port):
+        requests, secs = await export(fake, ledger_path, args.docs * 2)
+        print(f"full listing:  {secs:6.2f}s  requests={requests}")
+
+        for doc_id in range(args.docs + 1, args.docs + args.new + 1):
+            fake.add_document(doc_id, [make_page_text(rng, 50)])
+        changed = rng.sample(range(1, args.docs + 1), args.changed)
+        for doc_id in changed:
+            fake.update_text(doc_id, ["reprocessed " + make_page_text(rng, 50)])
+
+        requests, secs = await export(fake, ledger_path, args.docs * 2)
+        print(f"delta sync:    {secs:6.2f}s  requests={requests}")
+
+    client = boto3.client("s3", region_name="us-east-1")
+    for doc_id in changed:
+        body = client.get_object(Bucket=BUCKET, Key=f"{doc_id}.json")["Body"].read()
+        pages = json.loads(decode_body(body))["text_json"]["pages"]
+        assert pages[0]["contents"].startswith("reprocessed"), f"{doc_id} was not re-exported"
+    exported = requests.get("text", 0)
+    assert exported == args.new + args.changed, f"expected {args.new + args.changed} exports, saw {exported}"
+    assert "document_meta" not in requests, "exports should reuse listing metadata"
+    print(f"delta sync exported exactly the {args.new} new and {args.changed} reprocessed documents")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=300)
+    parser.add_argument("--new", type=int, default=20)
+    parser.add_argument("--changed", type=int, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--s3-port", type=int, default=5055)
+    args = parser.parse_args()
+
+    server = start_local_s3([BUCKET], port=args.s3_port)
+    try:
+        asyncio.run(run(args))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
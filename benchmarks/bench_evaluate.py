@@ -0,0 +1,155 @@
+# Summary evaluation throughput on a large synthetic output/ground_truth CSV.
+#
+#   python -m benchmarks.bench_evaluate --rows 1000000 --workers 8
+#
+# References are drawn from a Zipfian vocabulary and each output is its reference with words
+# dropped, substituted and inserted, so scores cover the whole range. A sample of rows is also
+# scored by a straightforward implementation that tokenizes and counts n-grams separately for
+# every metric and fills the full LCS table; the two must agree, and both are timed per row.
+import argparse
+import math
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+from evaluate import METRICS, evaluate_csv, score_pair, tokenize
+
+
+def synthetic_csv(path: str, rows: int, words: int, vocab: int, seed: int):
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f"w{i}" for i in range(vocab)], dtype=object)
+    chunk = 50000
+    with pacsv.CSVWriter(path, pa.schema([("output", pa.string()), ("ground_truth", pa.string())])) as writer:
+        for start in range(0, rows, chunk):
+            n = min(chunk, rows - start)
+            lengths = rng.integers(words // 2, words * 3 // 2, n)
+            outputs, references = [], []
+            for length in lengths:
+                reference = vocabulary[np.minimum(rng.zipf(1.3, length), vocab) - 1]
+                keep = rng.random(length) > 0.2
+                output = reference[keep].copy()
+                swap = rng.random(len(output)) < 0.2
+                output[swap] = vocabulary[rng.integers(0, vocab, swap.sum())]
+                references.append(" ".join(reference))
+                outputs.append(" ".join(output))
+            writer.write_table(pa.table({"output": outputs, "ground_truth": references}))
+
+
+def naive_scores(candidate_text: str, reference_text: str) -> list[float]:
+    def grams(text, n):
+        words = tokenize(text)
+        return Counter(tuple(words[i:i + n]) for i in range(len(words) - n + 1))
+
+    def rouge_n(n):
+        c, r = grams(candidate_text, n), grams(reference_text, n)
+        matches = sum((c & r).values())
+        p = matches / max(1, sum(c.values()))
+        q = matches / max(1, sum(r.values()))
+        return 2 * p * q / (p + q) if matches else 0.0
+
+    def rouge_l():
+        a, b = tokenize(candidate_text), tokenize(reference_text)
+        table = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+        for i, x in enumerate(a):
+            for j, y in enumerate(b):
+                table[i + 1][j + 1] = table[i][j] + 1 if x == y else max(table[i][j + 1], table[i + 1][j])
+        lcs = table[-1][-1]
+        return 2 * lcs / (len(a) + len(b)) if lcs else 0.0
+
+    def bleu():
+        c, r = tokenize(candidate_text), tokenize(reference_text)
+        if not c:
+            return 0.0
+        logs = []
+        for n in range(1, 5):
+            cg, rg = grams(candidate_text, n), grams(reference_text, n)
+            matches, total = sum((cg & rg).values()), sum(cg.values())
+            if n == 1:
+                if not matches:
+                    return 0.0
+                logs.append(math.log(matches / total))
+            else:
+                logs.append(math.log((matches + 1) / (total + 1)))
+        return math.exp(min(0.0, 1 - len(r) / len(c)) + sum(logs) / 4)
+
+    def meteor():
+        c, r = tokenize(candidate_text), tokenize(reference_text)
+        used = [False] * len(r)
+        aligned = []
+        for word in c:
+            for j, other in enumerate(r):
+                if not used[j] and other == word:
+                    used[j] = True
+                    aligned.append(j)
+                    break
+            else:
+                aligned.append(None)
+        m = sum(a is not None for a in aligned)
+        if not m:
+            return 0.0
+        chunks = sum(
+            1 for i, a in enumerate(aligned)
+            if a is not None and (i == 0 or aligned[i - 1] is None or aligned[i - 1] != a - 1)
+        )
+        p, q = m / len(c), m / len(r)
+        return 10 * p * q / (q + 9 * p) * (1 - 0.5 * (chunks / m) ** 3)
+
+    return [rouge_n(1), rouge_n(2), rouge_l(), bleu(), meteor()]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--words", type=int, default=60)
+    parser.add_argument("--vocab", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-rows", type=int, default=5000)
+    parser.add_argument("--resamples", type=int, default=200)
+    parser.add_argument("--check-rows", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    csv_path = f"{workdir}/simulated.csv"
+    start = time.perf_counter()
+    synthetic_csv(csv_path, args.rows, args.words, args.vocab, args.seed)
+    print(f"{args.rows} rows written in {time.perf_counter() - start:.1f}s")
+
+    sample = pd.read_csv(csv_path, nrows=args.check_rows, dtype=str, keep_default_na=False)
+    pairs = list(zip(sample["output"], sample["ground_truth"]))
+    start = time.perf_counter()
+    fast = np.array([score_pair(c, r)[:len(METRICS)] for c, r in pairs])
+    fast_secs = time.perf_counter() - start
+    start = time.perf_counter()
+    naive = np.array([naive_scores(c, r) for c, r in pairs])
+    naive_secs = time.perf_counter() - start
+    assert np.allclose(fast, naive), "shared n-gram scores differ from the per-metric implementation"
+    print(f"per row: shared n-grams {fast_secs / len(pairs) * 1e6:.0f}us, "
+          f"per-metric {naive_secs / len(pairs) * 1e6:.0f}us ({naive_secs / fast_secs:.1f}x)")
+
+    start = time.perf_counter()
+    summary = evaluate_csv(
+        csv_path,
+        f"{workdir}/scores.parquet",
+        f"{workdir}/summary.parquet",
+        workers=args.workers,
+        batch_rows=args.batch_rows,
+        resamples=args.resamples,
+        seed=args.seed,
+    )
+    secs = time.perf_counter() - start
+    scores = pd.read_parquet(f"{workdir}/scores.parquet")
+    assert len(scores) == args.rows and (scores["row"].to_numpy() == np.arange(args.rows)).all()
+    assert np.allclose(scores[list(METRICS)].head(len(pairs)).to_numpy(), fast, atol=1e-6)
+    assert np.allclose(summary["value"].head(len(METRICS)), scores[list(METRICS)].mean().to_numpy(), atol=1e-6)
+    print(f"evaluated {args.rows} rows in {secs:.1f}s ({args.rows / secs:,.0f} rows/sec)")
+    print(summary.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
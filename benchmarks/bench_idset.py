@@ -0,0 +1,106 @@
+# Done-id sets as Python sets of strs versus IdSet (sorted uint64 arrays, memory-mapped .npy),
+# and JobLedger.filter_not_done with chunked IN queries versus its IdSet lookup.
+#
+#   python -m benchmarks.bench_idset --ids 5000000 --ledger-ids 1000000
+#
+# Ids are random DocumentCloud-sized integers; half of the queried ids are in the set.
+import argparse
+import gc
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+from idset import IdSet
+from ledger import STATS_STAGE, JobLedger
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def traced(fn):
+    gc.collect()
+    tracemalloc.start()
+    result, secs = timed(fn)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, secs, size / 2 ** 20
+
+
+def sample(rng, query: int, ids: np.ndarray) -> np.ndarray:
+    return np.concatenate([rng.choice(ids, query // 2), rng.integers(30_000_000, 40_000_000, query - query // 2)])
+
+
+def compare_sets(args, workdir: Path, rng):
+    ids = rng.choice(30_000_000, args.ids, replace=False).astype(np.uint64)
+    query = sample(rng, args.query, ids)
+    strs = [str(i) for i in ids.tolist()]
+    query_strs = [str(i) for i in query.tolist()]
+
+    # Including the strs themselves, as a set loaded from a file holds them
+    str_set, build, mb = traced(lambda: {str(i) for i in ids.tolist()})
+    _, diff = timed(lambda: [q for q in query_strs if q not in str_set])
+    print(f"set[str]: {len(str_set)} ids, {mb:.0f} MB, built in {build:.2f}s, difference of {args.query} in {diff:.3f}s")
+    del str_set
+    path = workdir / "ids.npy"
+    with open(workdir / "ids.txt", "w") as f:
+        f.write("\n".join(strs))
+    _, load = timed(lambda: {line.rstrip("\n") for line in open(workdir / "ids.txt")})
+    print(f"          reloading the newline-delimited file: {load:.2f}s")
+
+    id_set, build, mb = traced(lambda: IdSet.from_ids(ids))
+    _, diff = timed(lambda: id_set.difference(query))
+    _, save = timed(lambda: id_set.save(path))
+    print(f"IdSet:    {len(id_set)} ids, {mb:.0f} MB, built in {build:.2f}s, difference of {args.query} in {diff:.3f}s, "
+          f"saved in {save:.2f}s")
+    reopened, load = timed(lambda: IdSet.open(path))
+    _, diff = timed(lambda: reopened.difference(query))
+    _, add = timed(lambda: [reopened.add(rng.integers(40_000_000, 50_000_000, 1000)) for _ in range(100)])
+    print(f"          reopened (mmap) in {load * 1000:.1f}ms, first difference {diff:.3f}s, "
+          f"100 appends of 1000 in {add:.3f}s")
+    assert set(IdSet.open(path).to_array().tolist()) == set(reopened.to_array().tolist())
+    assert np.array_equal(reopened.difference(query), query[~np.isin(query, reopened.to_array())])
+
+
+def compare_ledger(args, workdir: Path, rng):
+    ids = rng.choice(30_000_000, args.ledger_ids, replace=False)
+    query = [str(i) for i in sample(rng, args.query, ids).tolist()]
+    ledger = JobLedger(workdir / "ledger.sqlite3", batch_size=100_000)
+    ledger.record_many(ids.tolist(), STATS_STAGE, "tokenized")
+    ledger.flush()
+
+    # Force the chunked-query fallback
+    ledger._id_sets[STATS_STAGE] = (ledger._stage_version(STATS_STAGE), None)
+    expected, sql = timed(lambda: ledger.filter_not_done(query, STATS_STAGE))
+    del ledger._id_sets[STATS_STAGE]
+    _, cold = timed(lambda: ledger.done_ids(STATS_STAGE))
+    got, warm = timed(lambda: ledger.filter_not_done(query, STATS_STAGE))
+    assert got == expected
+    ledger.close()
+    ledger = JobLedger(workdir / "ledger.sqlite3")
+    got, reopened = timed(lambda: ledger.filter_not_done(query, STATS_STAGE))
+    assert got == expected
+    print(f"ledger with {args.ledger_ids} done, filter_not_done of {args.query}: chunked queries {sql:.2f}s, "
+          f"IdSet {warm:.2f}s (+{cold:.2f}s to build it once), after reopening {reopened:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ids", type=int, default=5_000_000)
+    parser.add_argument("--ledger-ids", type=int, default=1_000_000)
+    parser.add_argument("--query", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    workdir = Path(tempfile.mkdtemp())
+    rng = np.random.default_rng(args.seed)
+    compare_sets(args, workdir, rng)
+    compare_ledger(args, workdir, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# Listing a bucket of {doc_id}.json objects: one sequential list_objects_v2 paginator versus
+# concurrent key ranges (s3_listing.py), first cut at leading digits, then at the manifest's
+# quantiles, and a run that finds the manifest fresh and doesn't list at all.
+#
+#   python -m benchmarks.bench_listing --objects 1000000 --latency 0.05
+#
+# The bucket is an in-memory stand-in answering list_objects_v2 pages of up to 1000 keys (with
+# Prefix and StartAfter, in S3's key order) after `latency` seconds, the S3 round trip. moto
+# can't stand in here: it scans every key per page, so it measures its own CPU rather than
+# request concurrency.
+import argparse
+import asyncio
+import bisect
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from s3_listing import S3Manifest
+
+BUCKET = "obd-sum-stats"
+
+
+class _FakePaginator:
+    def __init__(self, bucket: "FakeBucket"):
+        self._bucket = bucket
+
+    async def paginate(self, Bucket: str, Prefix: str = "", StartAfter: str = ""):
+        keys = self._bucket.keys
+        position = bisect.bisect_right(keys, max(StartAfter, Prefix)) if StartAfter else bisect.bisect_left(keys, Prefix)
+        while True:
+            self._bucket.requests += 1
+            await asyncio.sleep(self._bucket.latency)
+            page = [key for key in keys[position:position + 1000] if key.startswith(Prefix)]
+            yield {"Contents": [{"Key": key, "Size": 2, "ETag": '"99914b932bd37a50b983c5e7c90ae93b"'} for key in page]}
+            position += 1000
+            if len(page) < 1000 or position >= len(keys):
+                return
+
+
+class FakeBucket:
+    def __init__(self, keys: list[str], latency: float):
+        self.keys = sorted(keys)
+        self.latency = latency
+        self.requests = 0
+
+    def get_paginator(self, name: str):
+        assert name == "list_objects_v2"
+        return _FakePaginator(self)
+
+
+async def sequential(s3) -> list[str]:
+    keys = []
+    async for page in s3.get_paginator("list_objects_v2").paginate(Bucket=BUCKET, Prefix=""):
+        keys.extend(obj["Key"] for obj in page.get("Contents", []))
+    return keys
+
+
+async def run(args):
+    rng = np.random.default_rng(args.seed)
+    bucket = FakeBucket([f"{doc_id}.json" for doc_id in rng.choice(30_000_000, args.objects, replace=False).tolist()],
+                        args.latency)
+    workdir = Path(tempfile.mkdtemp())
+    for name, max_age in (
+        ("sequential paginator", None),
+        ("ranges, first listing", 0),
+        ("ranges from manifest", 0),
+        ("fresh manifest", 3600),
+    ):
+        bucket.requests = 0
+        start = time.perf_counter()
+        if max_age is None:
+            keys = await sequential(bucket)
+        else:
+            manifest = S3Manifest(BUCKET, path=workdir / "manifest.parquet")
+            await manifest.refresh(bucket, max_age, concurrency=args.concurrency)
+            keys = manifest.keys()
+        secs = time.perf_counter() - start
+        assert keys == bucket.keys, f"{name}: {len(keys)} keys, expected {len(bucket.keys)}"
+        print(f"{name:<22} {secs:7.2f}s  {bucket.requests:5} list requests")
+    print(f"manifest: {(workdir / 'manifest.parquet').stat().st_size / 2 ** 20:.1f} MiB for {args.objects} keys")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--objects", type=int, default=1_000_000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Peak worker RSS when tokenizing one very large document: the old full json.loads path versus
+# the incremental parser that decodes and tokenizes one page at a time.
+#
+#   python -m benchmarks.bench_memory --pages 5000 --words 300 --model en_core_web_sm
+#
+# Each variant runs in a fresh process that loads the model and reads the body from disk first,
+# so the reported growth is what processing the document itself costs. Also times reading just
+# the doc_id, which stream_docs does on the event loop for every body.
+import argparse
+import json
+import random
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from benchmarks.synthetic import make_document_bytes
+from doc_stream import read_header
+from sum_from_S3 import process_document_bytes
+from token_engine import get_engine, init_worker
+
+
+# What process_document_bytes did before: decode everything, then sort all pages in memory
+def legacy_process(body: bytes) -> list[int]:
+    doc = json.loads(body)
+    pages = doc.get("text_json", {}).get("pages", [])
+    sorted_pages = sorted(pages, key=lambda x: x.get("page", 0))
+    texts = [page.get("contents", "") for page in sorted_pages]
+    return get_engine().count_tokens(texts)
+
+
+def incremental_process(body: bytes) -> list[int]:
+    return [row["tokens_per_page"] for row in process_document_bytes(body)[1]]
+
+
+VARIANTS = {"json.loads": legacy_process, "incremental": incremental_process}
+
+
+def measure(variant: str, path: str, model: str) -> tuple[int, int, float, list[int]]:
+    init_worker(model)
+    get_engine().count_tokens(["Warm up the pipeline."])
+    with open(path, "rb") as f:
+        body = f.read()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    counts = VARIANTS[variant](body)
+    secs = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return before, peak, secs, counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--words", type=int, default=300)
+    parser.add_argument("--model", default="en_core_web_sm")
+    args = parser.parse_args()
+
+    body = make_document_bytes(1, args.pages, args.words, random.Random(0))
+    path = f"{tempfile.mkdtemp()}/doc.json"
+    with open(path, "wb") as f:
+        f.write(body)
+    print(f"{args.pages} pages, {len(body) / 1e6:.1f} MB body")
+
+    results = {}
+    for variant in VARIANTS:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            before, peak, secs, counts = pool.submit(measure, variant, path, args.model).result()
+        results[variant] = counts
+        # ru_maxrss is in KB on Linux
+        print(f"{variant:<12} peak RSS +{(peak - before) / 1024:7.1f} MB over baseline ({peak / 1024:.0f} MB)  {secs:.2f}s")
+    assert results["json.loads"] == results["incremental"], "token counts differ"
+
+    start = time.perf_counter()
+    json.loads(body).get("doc_id")
+    full = time.perf_counter() - start
+    start = time.perf_counter()
+    read_header(body)
+    header = time.perf_counter() - start
+    print(f"doc_id lookup: json.loads {full * 1e3:.1f} ms, read_header {header * 1e3:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# Page cache hit rates and near-duplicate detection on a corpus full of repeated boilerplate.
+#
+#   python -m benchmarks.bench_page_cache --docs 300 --boilerplate 0.4 --model en_core_web_sm
+#
+# A share of pages are exact copies of a few boilerplate templates (cover letters, exemption
+# notices), some more are templates with a few words changed, and the rest are unique. The
+# corpus is tokenized through DocumentScheduler without the cache, with a cold cache and with a
+# warm one (a rerun), checking the counts never change; then MinHash/LSH flags are compared with
+# which pages really came from a template.
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.synthetic import make_page_text
+from near_dup import NearDuplicateIndex
+from page_cache import PageCache, report_stats
+from sum_from_S3 import DocumentScheduler, init_stats_worker, mark_near_duplicates
+
+
+def boilerplate_corpus(args, rng: random.Random):
+    templates = [make_page_text(rng, args.words) for _ in range(args.templates)]
+    corpus = []
+    # Ground truth per page key: True for template-derived pages after the template's first use
+    derived = {}
+    seen_templates = set()
+    for doc_id in range(1, args.docs + 1):
+        pages = []
+        for page in range(rng.randint(1, args.pages)):
+            roll = rng.random()
+            if roll < args.boilerplate + args.near:
+                t = rng.randrange(len(templates))
+                words = templates[t].split()
+                if roll >= args.boilerplate:
+                    for i in rng.sample(range(len(words)), max(1, len(words) // 20)):
+                        words[i] = str(rng.randint(1, 99999))
+                pages.append(" ".join(words))
+                derived[f"{doc_id}:{page}"] = t in seen_templates
+                seen_templates.add(t)
+            else:
+                pages.append(make_page_text(rng, args.words))
+                derived[f"{doc_id}:{page}"] = False
+        bundle = {
+            "doc_id": doc_id,
+            "metadata": {"title": f"Document {doc_id}", "page_count": len(pages)},
+            "text_json": {"pages": [{"page": i, "contents": text} for i, text in enumerate(pages)]},
+        }
+        corpus.append((doc_id, json.dumps(bundle).encode("utf-8")))
+    return corpus, derived
+
+
+async def iterate(corpus):
+    for item in corpus:
+        yield item
+
+
+async def tokenize(pool, corpus, workers: int) -> dict:
+    scheduler = DocumentScheduler(pool, workers=workers)
+    rows = {}
+    async for doc_id, result, error in scheduler.run(iterate(corpus)):
+        if error:
+            raise RuntimeError(f"{doc_id}: {error}")
+        rows[doc_id] = result
+    return rows
+
+
+def timed_run(corpus, args, cache_path=None, near_duplicates=False) -> tuple[dict, float]:
+    specs = [f"spacy:{args.model}"]
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=init_stats_worker,
+        initargs=(specs, 64, cache_path, args.cache_mb << 20, near_duplicates),
+    ) as pool:
+        # Load the models before timing
+        list(pool.map(abs, range(args.workers)))
+        start = time.perf_counter()
+        rows = asyncio.run(tokenize(pool, corpus, args.workers))
+        return rows, time.perf_counter() - start
+
+
+def page_counts(rows: dict) -> dict:
+    return {doc_id: [row["tokens_per_page"] for row in result[1]] for doc_id, result in rows.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=300)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--words", type=int, default=250)
+    parser.add_argument("--templates", type=int, default=15)
+    parser.add_argument("--boilerplate", type=float, default=0.4, help="share of exact template pages")
+    parser.add_argument("--near", type=float, default=0.1, help="share of lightly edited template pages")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--model", default="en_core_web_sm")
+    parser.add_argument("--cache-mb", type=int, default=256)
+    args = parser.parse_args()
+
+    corpus, derived = boilerplate_corpus(args, random.Random(0))
+    print(f"{args.docs} documents, {len(derived)} pages")
+    cache_path = f"{tempfile.mkdtemp()}/page_cache.sqlite3"
+
+    baseline, secs = timed_run(corpus, args)
+    print(f"no cache:   {secs:6.2f}s")
+    for label in ("cold cache", "warm cache"):
+        with PageCache(cache_path) as cache:
+            before = cache.stats()
+        rows, secs = timed_run(corpus, args, cache_path)
+        assert page_counts(rows) == page_counts(baseline), f"{label} changed token counts"
+        with PageCache(cache_path) as cache:
+            report = report_stats(before, cache.stats())
+            usage = cache.usage()
+        print(f"{label}: {secs:6.2f}s  " + "; ".join(report) + f"  ({usage / 1e6:.2f} MB cached)")
+
+    rows, _ = timed_run(corpus, args, near_duplicates=True)
+    index = NearDuplicateIndex()
+    flagged = {}
+    for doc_id in sorted(rows):
+        page_stats = rows[doc_id][1]
+        mark_near_duplicates(index, page_stats)
+        flagged.update((f"{row['doc_id']}:{row['page_number']}", bool(row["near_duplicate_of"])) for row in page_stats)
+    true_positive = sum(flagged[key] and derived[key] for key in derived)
+    precision = true_positive / max(1, sum(flagged.values()))
+    recall = true_positive / max(1, sum(derived.values()))
+    print(f"near duplicates: {sum(flagged.values())} pages flagged, precision {precision:.3f}, recall {recall:.3f}")
+
+
+if __name__ == "__main__":
+    main()
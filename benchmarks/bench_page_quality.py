@@ -0,0 +1,130 @@
+# Cost of scoring pages with page_quality.py against the tokenization it saves, on a synthetic
+# mix of prose, misread OCR of prose, tables of figures, blank scans and OCR symbol noise.
+#
+#   python -m benchmarks.bench_page_quality --pages 5000 --noise 0.15 --blank 0.1 --model en_core_web_sm
+#
+# Prints the scores and how many pages of each kind fall under --min-quality, the time per page
+# of scoring and of tokenizing, and then runs whole documents through process_document_bytes with
+# and without the scorer, checking the pages it keeps get the same counts.
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import make_page_text
+from page_quality import PageQualityScorer, _classes
+from sum_from_S3 import init_stats_worker, process_document_bytes
+from token_counters import make_counter
+
+_NOISE = "~|_=+*^#@%&<>{}[]\\/;:,.'\"`!ilIrnmce1°•■□►"
+_MISREAD = {"h": "li", "m": "rn", "e": "c", "n": "u", "w": "vv", "f": "t", "i": "1", "o": "0"}
+
+
+def make_noise_page(rng: random.Random, chars: int) -> str:
+    return "".join(rng.choice(_NOISE) if rng.random() < 0.8 else " " for _ in range(chars))
+
+
+def make_blank_page(rng: random.Random) -> str:
+    return rng.choice(["", " \n ", "\x0c", f"Page {rng.randint(1, 99)}", ". ,", "- 3 -"])
+
+
+# Prose with a share of letters swapped for look-alikes, as bad OCR of a clean page reads
+def make_misread_page(rng: random.Random, num_words: int, rate: float = 0.3) -> str:
+    return "".join(_MISREAD[c] if c in _MISREAD and rng.random() < rate else c for c in make_page_text(rng, num_words))
+
+
+def make_figures_page(rng: random.Random, rows: int) -> str:
+    lines = [f"{rng.choice(['Total', 'Budget', 'Cost', 'Q1', 'Q2'])} " if rng.random() < 0.3 else "" for _ in range(rows)]
+    return "\n".join(
+        line + " ".join(f"{rng.randint(0, 99999):,}.{rng.randint(0, 99):02d}" for _ in range(6)) for line in lines
+    )
+
+
+def make_pages(args, rng: random.Random) -> tuple[list[str], list[str]]:
+    kinds = rng.choices(
+        ["prose", "misread", "figures", "blank", "noise"],
+        weights=[1 - args.noise - args.blank - 0.15, 0.1, 0.05, args.blank, args.noise],
+        k=args.pages,
+    )
+    makers = {
+        "prose": lambda: make_page_text(rng, args.words),
+        "misread": lambda: make_misread_page(rng, args.words),
+        "figures": lambda: make_figures_page(rng, args.words // 8),
+        "blank": lambda: make_blank_page(rng),
+        "noise": lambda: make_noise_page(rng, args.words * 6),
+    }
+    return kinds, [makers[kind]() for kind in kinds]
+
+
+def per_page(seconds: float, pages: int) -> str:
+    return f"{seconds / max(pages, 1) * 1e6:7.1f} us/page"
+
+
+def compare_documents(args, texts: list[str]):
+    docs = []
+    for doc_id, first in enumerate(range(0, len(texts), args.pages_per_doc)):
+        pages = [{"page": i, "contents": text} for i, text in enumerate(texts[first:first + args.pages_per_doc])]
+        docs.append(json.dumps({"doc_id": doc_id, "metadata": {"id": doc_id}, "text_json": {"pages": pages}}).encode())
+    results = {}
+    for name, min_quality in (("without scorer", None), (f"skipping < {args.min_quality}", args.min_quality)):
+        init_stats_worker([f"spacy:{args.model}"], min_page_quality=min_quality)
+        process_document_bytes(docs[0])
+        start = time.perf_counter()
+        results[name] = [process_document_bytes(body)[1] for body in docs]
+        print(f"process_document_bytes {name:<16} {time.perf_counter() - start:6.2f}s for {len(docs)} documents")
+    plain, scored = results.values()
+    for plain_pages, scored_pages in zip(plain, scored):
+        for plain_row, row in zip(plain_pages, scored_pages):
+            assert row["quality"] < args.min_quality or row["tokens_per_page"] == plain_row["tokens_per_page"]
+    tokens = sum(row["tokens_per_page"] for pages in plain for row in pages)
+    kept = sum(row["tokens_per_page"] or 0 for pages in scored for row in pages)
+    print(f"tokens counted: {tokens} without the scorer, {kept} with it ({tokens - kept} on skipped pages)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--words", type=int, default=300)
+    parser.add_argument("--noise", type=float, default=0.15)
+    parser.add_argument("--blank", type=float, default=0.1)
+    parser.add_argument("--min-quality", type=float, default=0.3)
+    parser.add_argument("--pages-per-doc", type=int, default=50)
+    parser.add_argument("--model", default="en_core_web_sm")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    kinds, texts = make_pages(args, random.Random(args.seed))
+    kinds = np.array(kinds)
+    scorer = PageQualityScorer()
+    _classes()
+    start = time.perf_counter()
+    scores = np.concatenate([scorer.score(texts[i:i + 256]) for i in range(0, len(texts), 256)])
+    score_secs = time.perf_counter() - start
+    skip = scores < args.min_quality
+    print(f"{len(texts)} pages, {sum(map(len, texts)) / 1e6:.1f}M characters")
+    for kind in ("prose", "misread", "figures", "blank", "noise"):
+        of_kind = kinds == kind
+        if of_kind.any():
+            print(f"  {kind:<8} {of_kind.sum():5} pages, score {np.median(scores[of_kind]):.2f} median "
+                  f"({scores[of_kind].min():.2f}-{scores[of_kind].max():.2f}), {skip[of_kind].sum():5} skipped")
+
+    counter = make_counter(f"spacy:{args.model}")
+    counter.count(["Warm up the tokenizer."])
+    start = time.perf_counter()
+    counter.count(texts)
+    token_secs = time.perf_counter() - start
+    skipped = [text for text, low in zip(texts, skip) if low]
+    start = time.perf_counter()
+    counter.count(skipped)
+    saved_secs = time.perf_counter() - start
+    print(f"scoring      {per_page(score_secs, len(texts))}  {score_secs:6.2f}s for all pages")
+    print(f"tokenizing   {per_page(token_secs, len(texts))}  {token_secs:6.2f}s for all pages")
+    print(f"skipped      {per_page(saved_secs, len(skipped))}  {saved_secs:6.2f}s of tokenizing saved on "
+          f"{len(skipped)} pages, net {saved_secs - score_secs:+.2f}s")
+    compare_documents(args, texts)
+
+
+if __name__ == "__main__":
+    main()
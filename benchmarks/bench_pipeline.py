@@ -0,0 +1,363 @@
+# End-to-end export and stats throughput at several corpus sizes, against a local fake
+# DocumentCloud (with latency, random 429s and missing text) and moto S3.
+#
+#   python -m benchmarks.bench_pipeline --scales 100 1000 5000 --doc-stats data/document_stats.csv
+#
+# The corpus is sampled from a CorpusModel fitted to document_stats (page counts and tokens per
+# page), or the default model if there are no stats. For each scale, dc_to_s3 exports the corpus
+# into the S3 stand-in and then DocumentStatsCollector tokenizes it back out of S3, each in a
+# fresh process so peak memory is per pipeline. The fused pipeline (ingest.py) does both in one
+# pass against a fresh bucket, tokenizing documents as they are uploaded. Reported per pipeline: documents/sec, p50/p99
+# latency of each stage, and the process's peak RSS growth (plus the largest tokenizer worker).
+#
+#   export: api (DocumentCloud API calls), text (text asset download), upload (S3 PUT),
+#           document (one document end to end)
+#   fused:  the export stages, plus write (stats writer)
+#   stats:  s3_get (GET and body read), tokenize (from fetched to rows ready, queueing
+#           included), write (stats writer), document (GET start to rows written)
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from functools import wraps
+
+import numpy as np
+
+from benchmarks.fake_documentcloud import FakeDocumentCloud
+from benchmarks.local_s3 import empty_bucket, start_local_s3
+from benchmarks.synthetic import CorpusModel
+from codec import zstd_available
+
+BUCKET = "obd-sum-stats"
+
+
+class StageTimes:
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def add(self, stage: str, seconds: float):
+        self.samples[stage].append(seconds)
+
+    # Replace an async method on obj with a timed one
+    def wrap(self, obj, name: str, stage: str):
+        method = getattr(obj, name)
+
+        @wraps(method)
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+
+        setattr(obj, name, timed)
+
+    def summary(self) -> dict:
+        return {
+            stage: {
+                "count": len(values),
+                "p50_ms": float(np.percentile(values, 50)) * 1000,
+                "p99_ms": float(np.percentile(values, 99)) * 1000,
+            }
+            for stage, values in self.samples.items()
+        }
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def make_fake_documentcloud(args) -> tuple[FakeDocumentCloud, int]:
+    fake = FakeDocumentCloud(
+        latency=args.latency,
+        latency_sigma=args.latency_sigma,
+        throttle_rate=args.throttle_rate,
+        missing_rate=args.missing_rate,
+        seed=args.seed,
+    )
+    model = CorpusModel.fit_or_default(args.doc_stats, max_pages=args.max_pages)
+    pages = 0
+    for doc_id, texts in enumerate(model.sample_pages(args.one, np.random.default_rng(args.seed)), start=1):
+        fake.add_document(doc_id, texts)
+        pages += len(texts)
+    return fake, pages
+
+
+def make_exporter(args, fake: FakeDocumentCloud, times: StageTimes):
+    from dc_to_s3 import dc_to_s3
+
+    exporter = dc_to_s3(
+        project_id=fake.project_id,
+        max_documents=args.one,
+        num_consumers=args.consumers,
+        ledger_path="ledger.sqlite3",
+        compression=args.compression,
+        api_rate=args.api_rate,
+        api_max_rate=args.api_rate * 4,
+    )
+    times.wrap(exporter, "_api_get", "api")
+    times.wrap(exporter, "_get_text_json", "text")
+    times.wrap(exporter, "upload_document_to_s3", "upload")
+    times.wrap(exporter, "process_document", "document")
+    return exporter
+
+
+async def run_export(args, times: StageTimes) -> dict:
+    from ledger import EXPORT_STAGE
+
+    fake, pages = make_fake_documentcloud(args)
+    baseline = peak_rss_mb()
+
+    async with fake.serve(args.dc_port):
+        exporter = make_exporter(args, fake, times)
+        start = time.perf_counter()
+        await exporter.export_with_queue()
+        secs = time.perf_counter() - start
+    return {
+        "docs": exporter._ledger.count(EXPORT_STAGE, ("uploaded", "empty")),
+        "failed": exporter._ledger.count(EXPORT_STAGE, ("failed",)),
+        "pages": pages,
+        "seconds": secs,
+        "throttled": fake.requests["throttled"],
+        "missing_text": fake.requests["missing_text"],
+        "rss_growth_mb": peak_rss_mb() - baseline,
+    }
+
+
+# S3 client proxy that times get_object together with reading the body
+class _TimedS3:
+    def __init__(self, s3, times: StageTimes, started: dict):
+        self._s3 = s3
+        self._times = times
+        self._started = started
+
+    def __getattr__(self, name):
+        return getattr(self._s3, name)
+
+    async def get_object(self, **kwargs):
+        start = time.perf_counter()
+        response = await self._s3.get_object(**kwargs)
+        body = await response["Body"].read()
+        self._times.add("s3_get", time.perf_counter() - start)
+        self._started[kwargs["Key"].split(".")[0]] = start
+        return {**response, "Body": _Body(body)}
+
+
+class _Body:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    async def read(self):
+        return self._data
+
+
+async def run_stats(args, times: StageTimes) -> dict:
+    import sum_from_S3
+    from ledger import STATS_STAGE
+
+    baseline = peak_rss_mb()
+    collector = sum_from_S3.DocumentStatsCollector(
+        BUCKET, workers=args.workers, spacy_model=args.model, ledger_path="ledger.sqlite3"
+    )
+    started, fetched = {}, {}
+
+    fetch_keys = collector._fetch_keys
+
+    async def timed_fetch_keys(s3, key_queue, doc_queue):
+        await fetch_keys(_TimedS3(s3, times, started), key_queue, doc_queue)
+
+    collector._fetch_keys = timed_fetch_keys
+
+    stream_docs = collector.stream_docs
+
+    async def timed_stream_docs(*a, **kw):
+        async for doc_id, body in stream_docs(*a, **kw):
+            fetched[str(doc_id)] = time.perf_counter()
+            yield doc_id, body
+
+    collector.stream_docs = timed_stream_docs
+
+    open_stats_writer = sum_from_S3.open_stats_writer
+
+    def timed_open_stats_writer(*a, **kw):
+        writer = open_stats_writer(*a, **kw)
+        write = writer.write
+
+        def timed_write(doc_row, page_rows):
+            doc_id = str(doc_row["doc_id"])
+            start = time.perf_counter()
+            write(doc_row, page_rows)
+            end = time.perf_counter()
+            times.add("write", end - start)
+            if doc_id in fetched:
+                times.add("tokenize", start - fetched.pop(doc_id))
+            if doc_id in started:
+                times.add("document", end - started.pop(doc_id))
+
+        writer.write = timed_write
+        return writer
+
+    sum_from_S3.open_stats_writer = timed_open_stats_writer
+    start = time.perf_counter()
+    await collector.process_documents_async()
+    secs = time.perf_counter() - start
+    return {
+        "docs": collector._ledger.count(STATS_STAGE, ("tokenized",)),
+        "failed": collector._ledger.count(STATS_STAGE, ("failed",)),
+        "seconds": secs,
+        "rss_growth_mb": peak_rss_mb() - baseline,
+        "worker_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+async def run_fused(args, times: StageTimes) -> dict:
+    import sum_from_S3
+    from ingest import export_and_collect
+    from ledger import EXPORT_STAGE, STATS_STAGE
+
+    fake, pages = make_fake_documentcloud(args)
+    baseline = peak_rss_mb()
+
+    open_stats_writer = sum_from_S3.open_stats_writer
+
+    def timed_open_stats_writer(*a, **kw):
+        writer = open_stats_writer(*a, **kw)
+        write = writer.write
+
+        def timed_write(doc_row, page_rows):
+            start = time.perf_counter()
+            write(doc_row, page_rows)
+            times.add("write", time.perf_counter() - start)
+
+        writer.write = timed_write
+        return writer
+
+    sum_from_S3.open_stats_writer = timed_open_stats_writer
+    async with fake.serve(args.dc_port):
+        exporter = make_exporter(args, fake, times)
+        collector = sum_from_S3.DocumentStatsCollector(
+            BUCKET, workers=args.workers, spacy_model=args.model, ledger_path="ledger.sqlite3"
+        )
+        start = time.perf_counter()
+        await export_and_collect(exporter, collector)
+        secs = time.perf_counter() - start
+    return {
+        "docs": collector._ledger.count(STATS_STAGE, ("tokenized",)),
+        "failed": exporter._ledger.count(EXPORT_STAGE, ("failed",)) + collector._ledger.count(STATS_STAGE, ("failed",)),
+        "pages": pages,
+        "seconds": secs,
+        "throttled": fake.requests["throttled"],
+        "missing_text": fake.requests["missing_text"],
+        "rss_growth_mb": peak_rss_mb() - baseline,
+        "worker_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+# Child process: run one pipeline at one scale in the current directory, write the result JSON
+def run_one(args):
+    times = StageTimes()
+    pipeline = {"export": run_export, "stats": run_stats, "fused": run_fused}[args.pipeline]
+    result = asyncio.run(pipeline(args, times))
+    result["stages"] = times.summary()
+    with open(args.result, "w") as f:
+        json.dump(result, f)
+
+
+def child_args(args, scale: int, pipeline: str, result: str) -> list[str]:
+    argv = [sys.executable, "-m", "benchmarks.bench_pipeline", "--one", str(scale), "--pipeline", pipeline,
+            "--result", result]
+    for name in ("doc_stats", "max_pages", "latency", "latency_sigma", "throttle_rate", "missing_rate",
+                 "consumers", "api_rate", "compression", "workers", "model", "dc_port", "seed"):
+        value = getattr(args, name)
+        if value is not None:
+            argv += [f"--{name.replace('_', '-')}", str(value)]
+    return argv
+
+
+def print_result(scale: int, pipeline: str, result: dict):
+    extra = f", worker peak {result['worker_peak_rss_mb']:.0f} MB" if "worker_peak_rss_mb" in result else ""
+    if "throttled" in result:
+        extra += f", {result['throttled']} 429s, {result['missing_text']} missing texts"
+    print(f"{scale:>7} {pipeline:<6} {result['docs'] / result['seconds']:8.1f} docs/sec  "
+          f"({result['docs']} docs, {result['failed']} failed, {result['seconds']:.1f}s)  "
+          f"peak RSS +{result['rss_growth_mb']:.0f} MB{extra}")
+    for stage, stats in result["stages"].items():
+        print(f"{'':>15}{stage:<10} p50 {stats['p50_ms']:8.1f} ms  p99 {stats['p99_ms']:8.1f} ms  (n={stats['count']})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--pipelines", nargs="+", choices=("export", "stats", "fused"),
+                        default=["export", "stats", "fused"])
+    parser.add_argument("--doc-stats", default="data/document_stats.csv", help="fit the corpus to these stats")
+    parser.add_argument("--max-pages", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05, help="median DocumentCloud response time")
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--throttle-rate", type=float, default=0.01)
+    parser.add_argument("--missing-rate", type=float, default=0.01)
+    parser.add_argument("--consumers", type=int, default=16)
+    parser.add_argument("--api-rate", type=float, default=20.0)
+    parser.add_argument("--compression", choices=("gzip", "zstd"), default=None)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--model", default="en_core_web_sm")
+    parser.add_argument("--dc-port", type=int, default=8765)
+    parser.add_argument("--s3-port", type=int, default=5055)
+    parser.add_argument("--seed", type=int, default=0)
+    # Internal: run a single pipeline (set by the parent process)
+    parser.add_argument("--one", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--pipeline", choices=("export", "stats", "fused"), help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.compression == "zstd" and not zstd_available():
+        parser.error("--compression zstd needs Python 3.14+ or the zstandard package")
+
+    if args.one:
+        run_one(args)
+        return
+
+    args.doc_stats = os.path.abspath(args.doc_stats)
+    server = start_local_s3([BUCKET], port=args.s3_port)
+    try:
+        for scale in args.scales:
+            empty_bucket(BUCKET)
+            # Shared by the export and stats runs of this scale: ledger and stats output
+            workdir = tempfile.mkdtemp()
+            seconds = {}
+            for pipeline in args.pipelines:
+                if pipeline == "fused":
+                    # Starts over: exports the same corpus into an empty bucket with a new ledger
+                    empty_bucket(BUCKET)
+                    workdir = tempfile.mkdtemp()
+                result_path = f"{workdir}/{pipeline}.json"
+                proc = subprocess.run(
+                    child_args(args, scale, pipeline, result_path),
+                    cwd=workdir,
+                    env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE,
+                    text=True,
+                )
+                if proc.returncode:
+                    raise RuntimeError(f"{pipeline} at {scale} documents failed:\n{proc.stderr[-4000:]}")
+                with open(result_path) as f:
+                    result = json.load(f)
+                print_result(scale, pipeline, result)
+                seconds[pipeline] = result["seconds"]
+            if seconds.keys() >= {"export", "stats", "fused"}:
+                separate = seconds["export"] + seconds["stats"]
+                print(f"{scale:>7} export then stats {separate:.1f}s, fused {seconds['fused']:.1f}s "
+                      f"({separate / seconds['fused']:.2f}x)")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Chunk planning over a large synthetic page table for a dozen context sizes.
+#
+#   python -m benchmarks.bench_planner --docs 50000 --contexts 12
+#
+# Page counts and tokens per page are drawn from lognormals (a long tail of very long documents,
+# like the FOI corpus). The vectorized map_reduce plan is checked against a plain per-document
+# greedy loop on a sample of documents, which is also timed for comparison.
+import argparse
+import time
+
+import numpy as np
+
+from chunk_planner import STRATEGIES, PageTable, estimate_corpus, input_budget, plan_chunks, plan_documents
+
+
+def synthetic_table(docs: int, seed: int) -> PageTable:
+    rng = np.random.default_rng(seed)
+    pages = np.clip(rng.lognormal(2.3, 1.3, docs).astype(np.int64), 1, 5000)
+    doc_ids = np.repeat(np.arange(docs), pages)
+    page_numbers = np.arange(len(doc_ids)) - np.repeat(np.cumsum(pages) - pages, pages)
+    tokens = np.clip(rng.lognormal(5.3, 0.9, len(doc_ids)).astype(np.int64), 0, 20000)
+    return PageTable(doc_ids, page_numbers, tokens)
+
+
+# The straightforward per-document version of the map_reduce packing
+def loop_map_chunks(tokens: list[int], budget: int, overlap: int) -> list[tuple[int, int]]:
+    chunks = []
+    i = 0
+    step = budget
+    while i < len(tokens):
+        j, used = i, 0
+        while j < len(tokens) and used + tokens[j] <= step:
+            used += tokens[j]
+            j += 1
+        j = max(j, i + 1)
+        chunks.append((i, j))
+        i = j
+        step = budget - overlap
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=50000)
+    parser.add_argument("--contexts", type=int, default=12)
+    parser.add_argument("--overlap", type=int, default=128)
+    parser.add_argument("--check-docs", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    table = synthetic_table(args.docs, args.seed)
+    print(f"{table.num_docs} documents, {table.num_pages} pages, {int(table.cum[-1])} tokens "
+          f"(built in {time.perf_counter() - start:.2f}s)")
+    contexts = [2048 * 2 ** (i / 2) for i in range(args.contexts)]
+    contexts = [int(c) for c in contexts]
+
+    start = time.perf_counter()
+    estimate = estimate_corpus(table, contexts, STRATEGIES, overlap=args.overlap)
+    secs = time.perf_counter() - start
+    print(estimate.to_string(index=False))
+    plans = len(contexts) * len(STRATEGIES)
+    print(f"{plans} plans over {table.num_pages} pages in {secs:.2f}s "
+          f"({table.num_pages * plans / secs / 1e6:.1f}M page-plans/sec)")
+
+    # Check map_reduce chunk boundaries against the loop on a sample of documents
+    context = contexts[0]
+    budget = input_budget(context, 200, 300)
+    chunks = plan_chunks(table, "map_reduce", context, overlap=args.overlap)
+    sample = np.random.default_rng(args.seed).choice(table.num_docs, min(args.check_docs, table.num_docs), replace=False)
+    start = time.perf_counter()
+    expected = {}
+    for d in sample:
+        tokens = table.tokens[table.starts[d]:table.ends[d]].tolist()
+        pages = table.page_numbers[table.starts[d]:table.ends[d]]
+        expected[table.doc_ids[d]] = [(pages[i], pages[j - 1]) for i, j in loop_map_chunks(tokens, budget, args.overlap)]
+    loop_secs = time.perf_counter() - start
+    sampled = chunks[chunks["doc_id"].isin(expected)]
+    for doc_id, rows in sampled.groupby("doc_id"):
+        assert list(zip(rows["first_page"], rows["last_page"])) == expected[doc_id], f"chunks differ for {doc_id}"
+    print(f"map_reduce chunks match the per-document loop for {len(sample)} documents; the loop would take "
+          f"{loop_secs / len(sample) * table.num_docs * plans:.1f}s for all {plans} plans")
+
+    docs = plan_documents(table, "map_reduce", context, overlap=args.overlap)
+    assert docs["map_calls"].sum() >= len(chunks), "every chunk needs at least one call"
+
+
+if __name__ == "__main__":
+    main()
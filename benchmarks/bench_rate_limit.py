@@ -0,0 +1,79 @@
+# Export against a fake DocumentCloud that enforces a request rate with 429s and expires tokens.
+#
+#   python -m benchmarks.bench_rate_limit --docs 600 --allowed-rate 40 --consumers 32
+#
+# Checks that the shared AIMD limiter holds API throughput close to the allowed rate, that every
+# document is exported without errors, and that concurrent token expiry causes one refresh.
+import argparse
+import asyncio
+import tempfile
+import time
+
+from benchmarks.fake_documentcloud import FakeDocumentCloud
+from benchmarks.local_s3 import start_local_s3
+from dc_to_s3 import dc_to_s3
+from ledger import EXPORT_STAGE
+
+BUCKET = "obd-sum-stats"
+
+
+async def run(args):
+    # Bare-id listings, so every document needs its own metadata call and the API stays busy
+    fake = FakeDocumentCloud(
+        project_id=216694, rate_limit=args.allowed_rate, token_ttl=args.token_ttl, expand_listing=False
+    )
+    for doc_id in range(1, args.docs + 1):
+        fake.add_document(doc_id, [f"Page text for document {doc_id}."])
+
+    async with fake.serve(args.port):
+        exporter = dc_to_s3(
+            project_id=fake.project_id,
+            max_documents=args.docs,
+            num_consumers=args.consumers,
+            ledger_path=f"{tempfile.mkdtemp()}/ledger.sqlite3",
+            api_rate=args.start_rate,
+            api_max_rate=args.allowed_rate * 4,
+        )
+        start = time.perf_counter()
+        await exporter.export_with_queue()
+        secs = time.perf_counter() - start
+
+    # Measure steady state: skip the ramp-up from start_rate
+    successes = fake.api_successes
+    warm = successes[len(successes) // 5:]
+    achieved = (len(warm) - 1) / (warm[-1] - warm[0])
+    failed = exporter._ledger.count(EXPORT_STAGE, ("failed",))
+    exported = exporter._ledger.count(EXPORT_STAGE, ("uploaded", "empty"))
+    print(f"{args.docs} docs in {secs:.1f}s with {args.consumers} consumers")
+    print(f"API rate: {achieved:.1f} req/s achieved vs {args.allowed_rate:.1f} allowed ({achieved / args.allowed_rate:.0%})")
+    print(f"429s: {fake.requests['throttled']}, rejected tokens: {fake.requests['rejected_token']}, "
+          f"token requests: {fake.requests['token']}")
+    print(f"exported: {exported}, failed: {failed}")
+
+    expected_tokens = 1 + int(secs // args.token_ttl) if args.token_ttl else 1
+    assert failed == 0 and exported == args.docs, "some documents were not exported"
+    assert fake.requests["token"] <= expected_tokens + 1, "token refresh was not single-flight"
+    assert achieved >= args.allowed_rate * args.min_ratio, "throughput fell well below the allowed rate"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=600)
+    parser.add_argument("--allowed-rate", type=float, default=40.0)
+    parser.add_argument("--start-rate", type=float, default=5.0)
+    parser.add_argument("--consumers", type=int, default=32)
+    parser.add_argument("--token-ttl", type=float, default=5.0)
+    parser.add_argument("--min-ratio", type=float, default=0.75)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--s3-port", type=int, default=5055)
+    args = parser.parse_args()
+
+    server = start_local_s3([BUCKET], port=args.s3_port)
+    try:
+        asyncio.run(run(args))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# Compare one-document-at-a-time pool submission with DocumentScheduler on a skewed corpus.
+#
+#   python -m benchmarks.bench_scheduler --docs 300 --workers 8
+#
+# Page counts follow a lognormal distribution so a few documents dominate, and the scheduled
+# rows are checked against a serial run of process_document_bytes.
+import argparse
+import asyncio
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.synthetic import make_document_bytes
+from sum_from_S3 import DocumentScheduler, process_document_bytes
+from token_engine import init_worker
+
+
+def skewed_corpus(num_docs: int, words: int, seed: int) -> list[tuple[int, bytes]]:
+    rng = random.Random(seed)
+    corpus = []
+    for doc_id in range(1, num_docs + 1):
+        num_pages = max(1, min(int(rng.lognormvariate(1.5, 1.4)), 3000))
+        corpus.append((doc_id, make_document_bytes(doc_id, num_pages, words, rng)))
+    return corpus
+
+
+async def iterate(corpus):
+    for item in corpus:
+        yield item
+
+
+async def one_at_a_time(pool, corpus) -> dict:
+    loop = asyncio.get_running_loop()
+    rows = {}
+    for doc_id, body in corpus:
+        rows[doc_id] = await loop.run_in_executor(pool, process_document_bytes, body)
+    return rows
+
+
+async def scheduled(pool, corpus, args) -> dict:
+    scheduler = DocumentScheduler(
+        pool,
+        workers=args.workers,
+        max_in_flight=args.max_in_flight,
+        batch_bytes=args.batch_bytes,
+        split_bytes=args.split_bytes,
+        pages_per_task=args.pages_per_task,
+    )
+    rows = {}
+    async for doc_id, result, error in scheduler.run(iterate(corpus)):
+        if error:
+            raise RuntimeError(f"{doc_id}: {error}")
+        rows[doc_id] = result
+    return rows
+
+
+def timed_pool_run(run, args):
+    with ProcessPoolExecutor(
+        max_workers=args.workers, initializer=init_worker, initargs=(args.model, 64)
+    ) as pool:
+        # Spawn the workers (each loads the model) before the clock starts
+        list(pool.map(init_worker, [args.model] * args.workers))
+        start = time.perf_counter()
+        rows = asyncio.run(run(pool))
+        return rows, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=300)
+    parser.add_argument("--words", type=int, default=250)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--max-in-flight", type=int, default=None)
+    parser.add_argument("--batch-bytes", type=int, default=1 << 20)
+    parser.add_argument("--split-bytes", type=int, default=2 << 20)
+    parser.add_argument("--pages-per-task", type=int, default=128)
+    parser.add_argument("--model", default="en_core_web_sm")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = skewed_corpus(args.docs, args.words, args.seed)
+    pages = sum(body.count(b'"page":') for _, body in corpus)
+    print(f"{args.docs} docs, {pages} pages, {sum(len(b) for _, b in corpus) / 1e6:.1f} MB")
+
+    init_worker(args.model)
+    serial = {doc_id: process_document_bytes(body) for doc_id, body in corpus}
+
+    baseline, baseline_secs = timed_pool_run(lambda pool: one_at_a_time(pool, corpus), args)
+    print(f"one at a time: {args.docs / baseline_secs:8.2f} docs/sec ({baseline_secs:.2f}s)")
+    rows, scheduled_secs = timed_pool_run(lambda pool: scheduled(pool, corpus, args), args)
+    print(f"scheduled:     {args.docs / scheduled_secs:8.2f} docs/sec ({scheduled_secs:.2f}s)")
+    print(f"speedup: {baseline_secs / scheduled_secs:.1f}x with {args.workers} workers")
+
+    if rows != serial or baseline != serial:
+        raise SystemExit("Scheduled output differs from the serial run")
+    print("Scheduled output matches the serial run for every document")
+
+
+if __name__ == "__main__":
+    main()
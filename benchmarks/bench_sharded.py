@@ -0,0 +1,119 @@
+# Several exporter processes sharing one project through a lease store, against a local fake
+# DocumentCloud and moto S3.
+#
+#   python -m benchmarks.bench_sharded --docs 600 --nodes 3 --store sqlite
+#   python -m benchmarks.bench_sharded --docs 600 --nodes 3 --store s3 --kill-after 8
+#
+# Every document must end up in S3. Without --kill-after no document may be downloaded twice;
+# with it, one node is killed mid-run (after its ~5s rate-limited listing) and the others must
+# take over its bucket once its lease expires; only documents it had in flight are exported twice.
+import argparse
+import asyncio
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_documentcloud import FakeDocumentCloud
+from benchmarks.local_s3 import bucket_usage, start_local_s3
+from benchmarks.synthetic import make_page_text
+
+BUCKET = "obd-sum-stats"
+LEASE_BUCKET = "obd-sum-stats-leases"
+
+
+# Runs in each child process
+def run_node(args):
+    from dc_to_s3 import dc_to_s3
+    from leases import open_lease_store
+
+    exporter = dc_to_s3(
+        project_id=args.project_id,
+        max_documents=args.docs,
+        num_consumers=8,
+        ledger_path=args.ledger,
+    )
+    store = open_lease_store(args.lease_url)
+    asyncio.run(exporter.export_sharded(store, owner=args.node, num_buckets=args.buckets, lease_ttl=args.lease_ttl))
+
+
+async def run(args):
+    rng = random.Random(0)
+    fake = FakeDocumentCloud(project_id=216694, latency=args.latency)
+    for doc_id in range(1, args.docs + 1):
+        fake.add_document(doc_id, [make_page_text(rng, 50) for _ in range(rng.randint(1, 3))])
+
+    workdir = tempfile.mkdtemp()
+    if args.store == "sqlite":
+        lease_url = f"sqlite:///{workdir}/leases.sqlite3"
+    else:
+        lease_url = f"s3://{LEASE_BUCKET}/leases/"
+
+    async with fake.serve(args.port):
+        start = time.perf_counter()
+        nodes = []
+        for n in range(args.nodes):
+            log = open(f"{workdir}/node-{n}.log", "w")
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable, "-u", "-m", "benchmarks.bench_sharded",
+                "--node", f"node-{n}",
+                "--ledger", f"{workdir}/ledger-{n}.sqlite3",
+                "--lease-url", lease_url,
+                "--project-id", str(fake.project_id),
+                "--docs", str(args.docs),
+                "--buckets", str(args.buckets),
+                "--lease-ttl", str(args.lease_ttl),
+                stdout=log, stderr=log,
+            )
+            nodes.append(proc)
+
+        if args.kill_after:
+            await asyncio.sleep(args.kill_after)
+            nodes[0].kill()
+            print(f"killed node-0 after {args.kill_after}s")
+        codes = [await proc.wait() for proc in nodes]
+        secs = time.perf_counter() - start
+
+    exported, _ = bucket_usage(BUCKET)
+    duplicates = sum(count - 1 for count in fake.text_served.values() if count > 1)
+    print(f"{args.docs} docs with {args.nodes} nodes ({args.store} leases) in {secs:.1f}s")
+    print(f"objects in S3: {exported}, documents downloaded more than once: {duplicates}")
+    print(f"node exit codes: {codes}, logs in {workdir}")
+
+    assert exported == args.docs, "some documents were not exported"
+    assert all(code == 0 for code in codes[1 if args.kill_after else 0:]), "a node failed"
+    if not args.kill_after:
+        assert duplicates == 0, "two nodes exported the same document"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=600)
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--store", choices=("sqlite", "s3"), default="sqlite")
+    parser.add_argument("--buckets", type=int, default=16)
+    parser.add_argument("--lease-ttl", type=float, default=3.0)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--kill-after", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--s3-port", type=int, default=5055)
+    # Child process options
+    parser.add_argument("--node")
+    parser.add_argument("--ledger")
+    parser.add_argument("--lease-url")
+    parser.add_argument("--project-id", type=int)
+    args = parser.parse_args()
+
+    if args.node:
+        run_node(args)
+        return
+
+    server = start_local_s3([BUCKET, LEASE_BUCKET], port=args.s3_port)
+    try:
+        asyncio.run(run(args))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Read the corpus back one object per document versus from packed, indexed shards.
+#
+#   python -m benchmarks.bench_shards --docs 2000 --pages 2 --shard-mb 1
+#
+# Uploads small documents as {doc_id}.json objects (a mix of the legacy pretty-printed and the
+# newer compressed encodings), compacts them into shards, then streams the whole corpus through
+# DocumentStatsCollector.stream_docs in both layouts and times single-document Range reads.
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+
+import boto3
+
+from benchmarks.local_s3 import start_local_s3
+from benchmarks.synthetic import make_document
+from codec import encode_document
+from shards import compact_bucket, load_shard_index, open_s3_client, read_document
+from sum_from_S3 import DocumentStatsCollector
+
+BUCKET = "obd-sum-stats"
+
+
+async def read_corpus(layout: str, fetch_concurrency: int) -> tuple[dict, float]:
+    collector = DocumentStatsCollector(
+        bucket_name=BUCKET,
+        ledger_path=f"{tempfile.mkdtemp()}/ledger.sqlite3",
+        layout=layout,
+        fetch_concurrency=fetch_concurrency,
+    )
+    start = time.perf_counter()
+    docs = {str(doc_id): json.loads(body) async for doc_id, body in collector.stream_docs()}
+    return docs, time.perf_counter() - start
+
+
+async def random_reads(doc_ids: list[str], samples: int) -> tuple[dict, float]:
+    async with open_s3_client() as s3:
+        index = (await load_shard_index(s3, BUCKET)).set_index("doc_id")
+        start = time.perf_counter()
+        docs = {}
+        for doc_id in doc_ids[:samples]:
+            entry = index.loc[doc_id]
+            docs[doc_id] = json.loads(await read_document(s3, BUCKET, entry["shard"], entry["offset"], entry["length"]))
+        return docs, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--pages", type=int, default=2)
+    parser.add_argument("--words", type=int, default=150)
+    parser.add_argument("--shard-mb", type=int, default=1)
+    parser.add_argument("--fetch-concurrency", type=int, default=16)
+    parser.add_argument("--random-reads", type=int, default=200)
+    parser.add_argument("--port", type=int, default=5055)
+    args = parser.parse_args()
+
+    server = start_local_s3([BUCKET], port=args.port)
+    rng = random.Random(0)
+    client = boto3.client("s3", region_name="us-east-1")
+    expected = {}
+    for doc_id in range(1, args.docs + 1):
+        bundle = make_document(doc_id, rng.randint(1, args.pages), args.words, rng)
+        if doc_id % 3 == 0:
+            body = json.dumps(bundle, indent=2).encode("utf-8")
+        else:
+            body, _ = encode_document(bundle, ("gzip", "zstd")[doc_id % 3 - 1])
+        client.put_object(Bucket=BUCKET, Key=f"{doc_id}.json", Body=body)
+        expected[str(doc_id)] = bundle
+
+    try:
+        docs, secs = asyncio.run(read_corpus("objects", args.fetch_concurrency))
+        assert docs == expected, "per-object read changed the corpus"
+        print(f"objects: {args.docs / secs:8.1f} docs/sec ({args.docs} GETs)")
+
+        start = time.perf_counter()
+        asyncio.run(compact_bucket(BUCKET, shard_bytes=args.shard_mb << 20))
+        print(f"compaction took {time.perf_counter() - start:.2f}s")
+        assert asyncio.run(compact_bucket(BUCKET)) == 0, "a second compaction should find nothing new"
+
+        docs, secs = asyncio.run(read_corpus("shards", args.fetch_concurrency))
+        assert docs == expected, "shard read changed the corpus"
+        shards = client.list_objects_v2(Bucket=BUCKET, Prefix="shards/shard-")["KeyCount"]
+        print(f"shards:  {args.docs / secs:8.1f} docs/sec ({shards} shard GETs)")
+
+        sample = rng.sample(sorted(expected), min(args.random_reads, args.docs))
+        docs, secs = asyncio.run(random_reads(sample, args.random_reads))
+        assert all(docs[doc_id] == expected[doc_id] for doc_id in docs), "range read returned the wrong document"
+        print(f"range reads: {secs / len(docs) * 1e3:.2f} ms per document")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# Dashboard refresh from the full stats tables versus from the mergeable summaries.
+#
+#   python -m benchmarks.bench_stats_summary --docs 200000 --flush-docs 5000
+#
+# Synthetic doc and page rows (lognormal page counts and tokens, including dense pages past the
+# old int16 range) go through ParquetStatsWriter with a StatsSummary attached, as the collector
+# writes them. Then: loading the tables and recomputing describe/quantiles/groupby, refreshing
+# from the saved summary, rebuilding the summary from the files in chunks, and folding in one
+# new part. Counts, sums and per-page-number means must match the tables exactly; quantiles are
+# reported as rank errors.
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.synthetic import CorpusModel, DEFAULT_MODEL
+from stats_summary import QUANTILES, StatsSummary
+from stats_writer import ParquetStatsWriter
+from sum_stats import DocumentStatsAnalyzer
+
+
+def write_stats(workdir: Path, docs: int, flush_docs: int, seed: int, start_id: int = 0) -> StatsSummary:
+    model = CorpusModel(**{**DEFAULT_MODEL, "tokens_mu": 5.8, "tokens_sigma": 0.9}, max_pages=5000)
+    rng = np.random.default_rng(seed)
+    summary = StatsSummary.load_or_new(workdir / "stats_summary.npz")
+    # Size the flushes in documents rather than bytes
+    with ParquetStatsWriter(workdir / "document_stats", workdir / "page_token_counts", flush_bytes=1 << 62,
+                            summary=summary) as writer:
+        for i, tokens in enumerate(model.sample_page_tokens(docs, rng)):
+            doc_id = str(start_id + i)
+            writer.write(
+                {
+                    "doc_id": doc_id,
+                    "page_count": len(tokens),
+                    "token_total": int(tokens.sum()),
+                    "token_avg_per_page": float(tokens.mean()),
+                    "token_min": int(tokens.min()),
+                    "token_max": int(tokens.max()),
+                    "token_std_dev": float(tokens.std()),
+                },
+                [{"doc_id": doc_id, "page_number": p, "tokens_per_page": int(t)} for p, t in enumerate(tokens)],
+            )
+            if (i + 1) % flush_docs == 0:
+                writer.flush()
+                summary.save(workdir / "stats_summary.npz")
+    summary.save(workdir / "stats_summary.npz")
+    return summary
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=200000)
+    parser.add_argument("--flush-docs", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp())
+    _, secs = timed(lambda: write_stats(workdir, args.docs, args.flush_docs, args.seed))
+    doc_path, page_path = workdir / "document_stats", workdir / "page_token_counts"
+    print(f"wrote {args.docs} documents with summaries in {secs:.1f}s")
+
+    def full_refresh():
+        analyzer = DocumentStatsAnalyzer(doc_path, page_path)
+        analyzer.load_data(DocumentStatsAnalyzer.PLOT_DOC_COLUMNS, DocumentStatsAnalyzer.PLOT_PAGE_COLUMNS)
+        analyzer.doc_stats.describe()
+        analyzer.page_tokens["tokens_per_page"].describe()
+        analyzer.page_tokens["tokens_per_page"].quantile(list(QUANTILES))
+        analyzer.page_tokens.groupby("page_number")["tokens_per_page"].mean()
+        return analyzer
+
+    def summary_refresh(path):
+        analyzer = DocumentStatsAnalyzer(doc_path, page_path, summary_path=path)
+        summary = analyzer.load_summary()
+        summary.describe()
+        summary.tokens_by_page_number()
+        return analyzer
+
+    tables, full_secs = timed(full_refresh)
+    pages = tables.page_tokens
+    print(f"{len(tables.doc_stats)} documents, {len(pages)} pages, max tokens on a page {pages['tokens_per_page'].max()}")
+    print(f"full tables:       {full_secs * 1000:9.1f} ms")
+    _, warm_secs = timed(lambda: summary_refresh(workdir / "stats_summary.npz"))
+    print(f"saved summary:     {warm_secs * 1000:9.1f} ms")
+    rebuilt, cold_secs = timed(lambda: summary_refresh(workdir / "rebuilt_summary.npz"))
+    print(f"rebuilt in chunks: {cold_secs * 1000:9.1f} ms")
+
+    write_stats(workdir, args.flush_docs, args.flush_docs, args.seed + 1, start_id=args.docs)
+    (workdir / "stats_summary.npz").rename(workdir / "writer_summary.npz")
+    _, fold_secs = timed(lambda: summary_refresh(workdir / "rebuilt_summary.npz"))
+    print(f"one new part:      {fold_secs * 1000:9.1f} ms")
+
+    summary = StatsSummary.load(workdir / "rebuilt_summary.npz")
+    writer_summary = StatsSummary.load(workdir / "writer_summary.npz")
+    tables = full_refresh()
+    pages = tables.page_tokens
+    tokens = pages["tokens_per_page"].to_numpy(np.int64)
+    column = summary.columns["tokens_per_page"]
+    assert column.count == len(tokens) and column.total == tokens.sum(), "page counts or sums differ"
+    assert writer_summary.columns["tokens_per_page"].total == column.total, "writer and rebuilt summaries differ"
+    assert np.isclose(column.describe()["std"], tokens.std(ddof=1))
+    by_page = summary.tokens_by_page_number()
+    in_range = by_page["page_number"] < summary.max_page_number
+    exact = pages[pages["page_number"] < summary.max_page_number].groupby("page_number")["tokens_per_page"].mean()
+    assert np.allclose(by_page.loc[in_range, "tokens_per_page"].to_numpy(), exact.to_numpy())
+    sorted_tokens = np.sort(tokens)
+    estimates = column.sketch.quantiles(QUANTILES)
+    errors = [
+        abs((np.searchsorted(sorted_tokens, e, "left") + np.searchsorted(sorted_tokens, e, "right")) / 2 / len(tokens) - q)
+        for q, e in zip(QUANTILES, estimates)
+    ]
+    print(f"tokens_per_page quantile rank error: max {max(errors):.4f} over {QUANTILES}")
+
+    analyzer = DocumentStatsAnalyzer(doc_path, page_path, summary_path=workdir / "rebuilt_summary.npz")
+    analyzer.load_summary()
+    plots, plot_secs = timed(lambda: analyzer.plot_all(workdir / "plots"))
+    print(f"{len(plots)} plots from the summary in {plot_secs:.2f}s ({workdir / 'plots'})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# Summarization throughput against a fake LLM endpoint that only takes so many requests at once.
+#
+#   python -m benchmarks.bench_summarize --docs 200 --server-concurrency 24 --latency 0.2
+#
+# Uploads synthetic documents to a local S3 stand-in, then summarizes them with a fixed small
+# concurrency and with the adaptive limiter, reporting docs/sec, LLM calls and 429s. The adaptive
+# run is stopped halfway and resumed to check that no document is summarized twice, and the
+# number of calls is checked against chunk_planner's estimate for the same counts.
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+
+import boto3
+import pandas as pd
+
+from benchmarks.fake_llm import FakeLLM
+from benchmarks.local_s3 import start_local_s3
+from benchmarks.synthetic import make_document
+from chunk_planner import PageTable, plan_documents
+from codec import encode_document
+from summarize import Summarizer
+from token_counters import make_counter
+
+BUCKET = "obd-sum-stats"
+
+
+# One Summarizer per entry of runs (a max_documents limit or None), sharing output and ledger
+async def summarize(args, runs: list, output: str, ledger: str, initial: int, maximum: int) -> tuple[dict, FakeLLM]:
+    fake = FakeLLM(latency=args.latency, max_concurrency=args.server_concurrency, failure_rate=args.failure_rate)
+    async with fake.serve(args.llm_port):
+        totals = {"summarized": 0, "llm_calls": 0, "throttled": 0}
+        for max_documents in runs:
+            summarizer = Summarizer(
+                BUCKET,
+                endpoint=fake.base_url,
+                model="fake",
+                context=args.context,
+                initial_concurrency=initial,
+                max_concurrency=maximum,
+                output_path=output,
+                ledger_path=ledger,
+            )
+            counts = await summarizer.summarize_async(max_documents)
+            for key in totals:
+                totals[key] += counts[key]
+        return totals, fake
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=12)
+    parser.add_argument("--words", type=int, default=300)
+    parser.add_argument("--context", type=int, default=2048)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--server-concurrency", type=int, default=24)
+    parser.add_argument("--failure-rate", type=float, default=0.02)
+    parser.add_argument("--fixed-concurrency", type=int, default=4)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--llm-port", type=int, default=8766)
+    args = parser.parse_args()
+
+    server = start_local_s3([BUCKET], port=args.port)
+    rng = random.Random(0)
+    client = boto3.client("s3", region_name="us-east-1")
+    pages = {"doc_id": [], "page_number": [], "tokens": []}
+    counter = make_counter("regex")
+    for doc_id in range(1, args.docs + 1):
+        # Mostly short documents with a few long ones
+        num_pages = rng.randint(1, args.pages) if rng.random() > 0.05 else args.pages * 10
+        bundle = make_document(doc_id, num_pages, args.words, rng)
+        body, _ = encode_document(bundle, "zstd")
+        client.put_object(Bucket=BUCKET, Key=f"{doc_id}.json", Body=body)
+        texts = [page["contents"] for page in bundle["text_json"]["pages"]]
+        pages["doc_id"] += [doc_id] * num_pages
+        pages["page_number"] += list(range(num_pages))
+        pages["tokens"] += counter.count(texts)
+    table = PageTable(pages["doc_id"], pages["page_number"], pages["tokens"])
+    expected_calls = int(plan_documents(table, "map_reduce", args.context)["llm_calls"].sum())
+    print(f"{args.docs} documents, {table.num_pages} pages; chunk_planner expects {expected_calls} LLM calls")
+
+    try:
+        for label, initial, maximum, runs in (
+            (f"fixed {args.fixed_concurrency}", args.fixed_concurrency, args.fixed_concurrency, [None]),
+            ("adaptive (stopped and resumed)", 1, 128, [args.docs // 2, None]),
+        ):
+            workdir = tempfile.mkdtemp()
+            start = time.perf_counter()
+            totals, fake = asyncio.run(summarize(
+                args, runs, f"{workdir}/summaries", f"{workdir}/ledger.sqlite3", initial, maximum
+            ))
+            secs = time.perf_counter() - start
+            summaries = pd.read_parquet(f"{workdir}/summaries")
+            assert len(summaries) == summaries["doc_id"].nunique() == args.docs, "documents missing or summarized twice"
+            assert totals["llm_calls"] == expected_calls, f"{totals['llm_calls']} calls, planner said {expected_calls}"
+            assert fake.max_prompt_words <= args.context, "a request exceeded the context window"
+            print(
+                f"{label:<32} {args.docs / secs:7.1f} docs/sec {totals['llm_calls'] / secs:7.1f} calls/sec  "
+                f"429s {totals['throttled']:4d}  500s {fake.requests['failed']:3d}  "
+                f"peak in flight {fake.peak_in_flight} (server allows {args.server_concurrency})"
+            )
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# Compare the per-document spaCy path with the per-worker tokenization engine.
+#
+#   python -m benchmarks.bench_tokenize --docs 50 --pages 20
+#
+# Both paths run serially on the same synthetic documents so documents/sec is directly
+# comparable, and the per-page token counts are checked for equality.
+import argparse
+import json
+import random
+import time
+
+import spacy
+
+from benchmarks.synthetic import make_document_bytes
+from sum_from_S3 import process_document_bytes
+from token_engine import init_worker
+
+
+# The counting logic process_document_bytes used before the engine existed
+def legacy_token_counts(doc_bytes: bytes, model_name: str) -> list[int]:
+    nlp = spacy.load(model_name)
+    doc = json.loads(doc_bytes)
+    pages = doc.get("text_json", {}).get("pages", [])
+    sorted_pages = sorted(pages, key=lambda x: x.get("page", 0))
+    texts = [page.get("contents", "") for page in sorted_pages]
+    return [len(nlp(page)) for page in texts]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--words", type=int, default=300)
+    parser.add_argument("--model", default="en_core_web_sm")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = [make_document_bytes(i, args.pages, args.words, rng) for i in range(args.docs)]
+
+    start = time.perf_counter()
+    legacy = [legacy_token_counts(body, args.model) for body in corpus]
+    legacy_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    init_worker(args.model, args.batch_size)
+    engine = [[row["tokens_per_page"] for row in process_document_bytes(body)[1]] for body in corpus]
+    engine_secs = time.perf_counter() - start
+
+    mismatched = [i for i, (a, b) in enumerate(zip(legacy, engine)) if a != b]
+    total_pages = args.docs * args.pages
+    print(f"{args.docs} docs, {total_pages} pages, model={args.model}")
+    print(f"legacy: {args.docs / legacy_secs:8.2f} docs/sec ({legacy_secs:.2f}s)")
+    print(f"engine: {args.docs / engine_secs:8.2f} docs/sec ({engine_secs:.2f}s, includes one model load)")
+    print(f"speedup: {legacy_secs / engine_secs:.1f}x")
+    if mismatched:
+        raise SystemExit(f"Token counts differ for {len(mismatched)} documents, e.g. doc {mismatched[0]}")
+    print(f"Token counts identical across all {total_pages} pages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Compare the blocking indent=2 upload with the async, optionally compressed upload path.
+#
+#   python -m benchmarks.bench_upload --docs 300 --pages 20
+#
+# Runs against a local moto S3 server and reports uploads/sec and bytes stored per variant.
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+from io import BytesIO
+
+import boto3
+
+from benchmarks.local_s3 import bucket_usage, empty_bucket, start_local_s3
+from benchmarks.synthetic import make_document
+from codec import decode_body
+from dc_to_s3 import dc_to_s3
+
+BUCKET = "obd-sum-stats"
+
+
+# What upload_document_to_s3 did before: pretty-printed JSON through the blocking client
+async def legacy_upload(bundles: list[dict], num_consumers: int):
+    client = boto3.client("s3", region_name="us-east-1")
+    queue = asyncio.Queue()
+    for bundle in bundles:
+        queue.put_nowait(bundle)
+
+    async def consumer():
+        while not queue.empty():
+            bundle = queue.get_nowait()
+            buffer = BytesIO(json.dumps(bundle, indent=2).encode("utf-8"))
+            client.upload_fileobj(buffer, BUCKET, f"{bundle['doc_id']}.json")
+
+    await asyncio.gather(*(consumer() for _ in range(num_consumers)))
+
+
+async def async_upload(exporter: dc_to_s3, bundles: list[dict]):
+    async with exporter.open_async_s3():
+        await asyncio.gather(*(exporter.upload_document_to_s3(bundle) for bundle in bundles))
+
+
+def report(name: str, num_docs: int, secs: float):
+    count, size = bucket_usage(BUCKET)
+    print(f"{name:<14} {num_docs / secs:8.1f} uploads/sec  {size / 1e6:8.2f} MB stored ({count} objects)")
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=300)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--words", type=int, default=250)
+    parser.add_argument("--consumers", type=int, default=3)
+    parser.add_argument("--upload-concurrency", type=int, default=16)
+    parser.add_argument("--port", type=int, default=5055)
+    args = parser.parse_args()
+
+    server = start_local_s3([BUCKET], port=args.port)
+    rng = random.Random(0)
+    bundles = [make_document(i, args.pages, args.words, rng) for i in range(1, args.docs + 1)]
+    ledger_dir = tempfile.mkdtemp()
+
+    try:
+        start = time.perf_counter()
+        asyncio.run(legacy_upload(bundles, args.consumers))
+        baseline = report("legacy", args.docs, time.perf_counter() - start)
+        empty_bucket(BUCKET)
+
+        for compression in (None, "gzip", "zstd"):
+            try:
+                exporter = dc_to_s3(
+                    project_id=0,
+                    max_documents=args.docs,
+                    num_consumers=args.consumers,
+                    ledger_path=f"{ledger_dir}/ledger.sqlite3",
+                    upload_concurrency=args.upload_concurrency,
+                    compression=compression,
+                )
+                start = time.perf_counter()
+                asyncio.run(async_upload(exporter, bundles))
+            except ImportError as e:
+                print(f"{'async+' + compression:<14} skipped: {e}")
+                continue
+            size = report(f"async+{compression or 'plain'}", args.docs, time.perf_counter() - start)
+            print(f"{'':<14} {baseline / size:8.1f}x smaller than legacy")
+
+            body = boto3.client("s3", region_name="us-east-1").get_object(Bucket=BUCKET, Key="1.json")["Body"].read()
+            assert json.loads(decode_body(body)) == bundles[0], "round trip changed the document"
+            empty_bucket(BUCKET)
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import asyncio
+import os
+import random
+import time
+import zlib
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+
+
+class FakeDocumentCloud:
+    # The subset of the DocumentCloud and MuckRock accounts APIs that dc_to_s3 talks to:
+    # token auth, project listings (optionally expanded), filtered document search, per-document
+    # metadata and the static text JSON assets. Every request is counted per route.
+    # rate_limit caps API requests/sec with 429 + Retry-After, and token_ttl makes access tokens
+    # expire server-side (answered with 403) so clients have to refresh mid-run. With
+    # expand_listing off, project listings ignore ?expand=document and return bare ids. latency
+    # delays every response; with latency_sigma the delay is lognormal with that median instead,
+    # for a realistic tail. throttle_rate answers that share of API requests with a 429 at random
+    # (bursts of throttling the rate limit wouldn't produce), and missing_rate is the share of
+    # documents whose text asset is a 404 (the same documents every run). text_served counts
+    # text downloads per document. reject_status is what an invalid or expired token gets (403,
+    # or 401 as some deployments answer); throttle_next and expire_tokens inject 429s and token
+    # expiry at a chosen point.
+    def __init__(
+        self,
+        project_id: int = 1,
+        rate_limit: float | None = None,
+        token_ttl: float | None = None,
+        expand_listing: bool = True,
+        latency: float = 0.0,
+        latency_sigma: float = 0.0,
+        throttle_rate: float = 0.0,
+        missing_rate: float = 0.0,
+        reject_status: int = 403,
+        seed: int = 0,
+    ):
+        self.project_id = project_id
+        self.rate_limit = rate_limit
+        self.token_ttl = token_ttl
+        self.expand_listing = expand_listing
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.throttle_rate = throttle_rate
+        self.missing_rate = missing_rate
+        self.reject_status = reject_status
+        self._rng = random.Random(seed)
+        self.documents: dict[int, dict] = {}
+        self.texts: dict[int, dict] = {}
+        self.requests = Counter()
+        self.text_served = Counter()
+        self.api_successes = []
+        self.base_url = None
+        self._clock = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self._bucket = 1.0
+        self._bucket_updated = time.monotonic()
+        self._tokens_issued = {}
+        self._injected_throttles = []
+
+    def _tick(self) -> str:
+        self._clock += timedelta(seconds=1)
+        return self._clock.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+    def add_document(self, doc_id: int, pages: list[str], **metadata):
+        now = self._tick()
+        self.documents[doc_id] = {
+            "id": doc_id,
+            "title": f"Document {doc_id}",
+            "slug": f"document-{doc_id}",
+            "description": "",
+            "created_at": now,
+            "updated_at": now,
+            "page_count": len(pages),
+            "data": {},
+            **metadata,
+        }
+        self.texts[doc_id] = {"pages": [{"page": i, "contents": text} for i, text in enumerate(pages)]}
+
+    # Simulates DocumentCloud reprocessing a document: new text and a newer updated_at
+    def update_text(self, doc_id: int, pages: list[str]):
+        self.documents[doc_id]["updated_at"] = self._tick()
+        self.documents[doc_id]["page_count"] = len(pages)
+        self.texts[doc_id] = {"pages": [{"page": i, "contents": text} for i, text in enumerate(pages)]}
+
+    def _metadata(self, doc_id: int) -> dict:
+        return {**self.documents[doc_id], "asset_url": f"{self.base_url}/files/"}
+
+    def _paginate(self, request: web.Request, items: list) -> dict:
+        per_page = int(request.query.get("per_page", 25))
+        page = int(request.query.get("page", 1))
+        chunk = items[(page - 1) * per_page:page * per_page]
+        next_url = None
+        if page * per_page < len(items):
+            next_url = str(request.url.update_query(page=page + 1))
+        return {"count": len(items), "next": next_url, "results": chunk}
+
+    def _delay(self) -> float:
+        if self.latency and self.latency_sigma:
+            return self._rng.lognormvariate(0.0, self.latency_sigma) * self.latency
+        return self.latency
+
+    # The next `count` API requests with a valid token get a 429 with this Retry-After
+    def throttle_next(self, count: int, retry_after: str | None = "1"):
+        self._injected_throttles.extend([retry_after] * count)
+
+    # Every token issued so far stops being accepted
+    def expire_tokens(self):
+        self._tokens_issued = {token: float("-inf") for token in self._tokens_issued}
+
+    def is_missing(self, doc_id: int) -> bool:
+        return zlib.crc32(str(doc_id).encode()) / 0xFFFFFFFF < self.missing_rate
+
+    def _take_rate_token(self) -> bool:
+        now = time.monotonic()
+        self._bucket = min(1.0, self._bucket + (now - self._bucket_updated) * self.rate_limit)
+        self._bucket_updated = now
+        if self._bucket >= 1:
+            self._bucket -= 1
+            return True
+        return False
+
+    def _token_valid(self, authorization: str) -> bool:
+        issued = self._tokens_issued.get(authorization.removeprefix("Bearer "))
+        if issued is None or issued == float("-inf"):
+            return False
+        return self.token_ttl is None or time.monotonic() - issued < self.token_ttl
+
+    @web.middleware
+    async def _count_requests(self, request: web.Request, handler):
+        self.requests[request.match_info.route.name or request.path] += 1
+        delay = self._delay()
+        if delay:
+            await asyncio.sleep(delay)
+        if not request.path.startswith("/api/"):
+            return await handler(request)
+        if not self._token_valid(request.headers.get("Authorization", "")):
+            self.requests["rejected_token"] += 1
+            return web.json_response({"detail": "Invalid or expired token."}, status=self.reject_status)
+        if self._injected_throttles:
+            self.requests["throttled"] += 1
+            retry_after = self._injected_throttles.pop(0)
+            headers = {"Retry-After": retry_after} if retry_after is not None else {}
+            return web.json_response({"detail": "Request was throttled."}, status=429, headers=headers)
+        if self.throttle_rate and self._rng.random() < self.throttle_rate:
+            self.requests["throttled"] += 1
+            return web.json_response({"detail": "Request was throttled."}, status=429, headers={"Retry-After": "1"})
+        if self.rate_limit and not self._take_rate_token():
+            self.requests["throttled"] += 1
+            # Like DRF's throttles (which DocumentCloud uses): whole seconds until a slot frees up
+            retry_after = int((1 - self._bucket) / self.rate_limit)
+            return web.json_response(
+                {"detail": "Request was throttled."}, status=429, headers={"Retry-After": str(retry_after)}
+            )
+        response = await handler(request)
+        self.api_successes.append(time.monotonic())
+        return response
+
+    async def _token(self, request: web.Request):
+        access = f"fake-access-token-{len(self._tokens_issued)}"
+        self._tokens_issued[access] = time.monotonic()
+        return web.json_response({"access": access, "refresh": "fake-refresh-token"})
+
+    async def _project_documents(self, request: web.Request):
+        if int(request.match_info["project_id"]) != self.project_id:
+            return web.json_response({"detail": "Not found."}, status=404)
+        expand = self.expand_listing and request.query.get("expand") == "document"
+        entries = [
+            {"document": self._metadata(doc_id) if expand else doc_id, "edit_access": False}
+            for doc_id in sorted(self.documents)
+        ]
+        return web.json_response(self._paginate(request, entries))
+
+    async def _search_documents(self, request: web.Request):
+        since = request.query.get("updated_at__gt")
+        docs = [
+            self._metadata(doc_id)
+            for doc_id, doc in sorted(self.documents.items())
+            if since is None or doc["updated_at"] > since
+        ]
+        return web.json_response(self._paginate(request, docs))
+
+    async def _document(self, request: web.Request):
+        doc_id = int(request.match_info["doc_id"])
+        if doc_id not in self.documents:
+            return web.json_response({"detail": "Not found."}, status=404)
+        return web.json_response(self._metadata(doc_id))
+
+    async def _text(self, request: web.Request):
+        doc_id = int(request.match_info["doc_id"])
+        if doc_id not in self.texts or self.is_missing(doc_id):
+            self.requests["missing_text"] += 1
+            raise web.HTTPNotFound()
+        self.text_served[doc_id] += 1
+        return web.json_response(self.texts[doc_id])
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._count_requests])
+        app.router.add_post("/accounts/token/", self._token, name="token")
+        app.router.add_get("/api/projects/{project_id}/documents/", self._project_documents, name="project_list")
+        app.router.add_get("/api/documents/", self._search_documents, name="document_search")
+        app.router.add_get("/api/documents/{doc_id}/", self._document, name="document_meta")
+        app.router.add_get("/files/documents/{doc_id}/{slug}.txt.json", self._text, name="text")
+        return app
+
+    # Serve on the running event loop and point dc_to_s3 at it through the environment
+    @asynccontextmanager
+    async def serve(self, port: int = 8765):
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", port)
+        await site.start()
+        self.base_url = f"http://127.0.0.1:{port}"
+        os.environ.update(
+            DOCUMENTCLOUD_USERNAME="fake",
+            DOCUMENTCLOUD_PASSWORD="fake",
+            DOCUMENTCLOUD_API_URL=f"{self.base_url}/api/",
+            DOCUMENTCLOUD_AUTH_URL=f"{self.base_url}/accounts/token/",
+        )
+        try:
+            yield self
+        finally:
+            await runner.cleanup()
@@ -0,0 +1,101 @@
+import asyncio
+import random
+from collections import Counter
+from contextlib import asynccontextmanager
+
+from aiohttp import web
+
+
+class FakeLLM:
+    # An OpenAI-compatible /v1/chat/completions stand-in. Each request takes latency seconds plus
+    # latency_per_token per prompt word, and the "summary" is the last max_tokens words of the
+    # prompt. max_concurrency answers 429 to requests beyond that many in flight (no Retry-After,
+    # like most inference servers' queue-full response), rate_limit caps requests/sec with 429 +
+    # Retry-After, and failure_rate answers a random fraction of requests with 500.
+    def __init__(
+        self,
+        latency: float = 0.2,
+        latency_per_token: float = 0.0,
+        max_concurrency: int | None = None,
+        rate_limit: float | None = None,
+        failure_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.latency_per_token = latency_per_token
+        self.max_concurrency = max_concurrency
+        self.rate_limit = rate_limit
+        self.failure_rate = failure_rate
+        self.requests = Counter()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.max_prompt_words = 0
+        self.base_url = None
+        self._rng = random.Random(seed)
+        self._bucket = 1.0
+        self._bucket_updated = None
+
+    def _take_rate_token(self) -> bool:
+        now = asyncio.get_running_loop().time()
+        if self._bucket_updated is not None:
+            self._bucket = min(1.0, self._bucket + (now - self._bucket_updated) * self.rate_limit)
+        self._bucket_updated = now
+        if self._bucket >= 1:
+            self._bucket -= 1
+            return True
+        return False
+
+    async def _completions(self, request: web.Request):
+        if self.rate_limit and not self._take_rate_token():
+            self.requests["rate_limited"] += 1
+            return web.json_response({"error": {"message": "Rate limit reached"}}, status=429, headers={"Retry-After": "1"})
+        if self.max_concurrency and self.in_flight >= self.max_concurrency:
+            self.requests["overloaded"] += 1
+            return web.json_response({"error": {"message": "Server is overloaded"}}, status=429)
+        if self.failure_rate and self._rng.random() < self.failure_rate:
+            self.requests["failed"] += 1
+            return web.json_response({"error": {"message": "Internal error"}}, status=500)
+
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            payload = await request.json()
+            words = " ".join(message["content"] for message in payload["messages"]).split()
+            self.max_prompt_words = max(self.max_prompt_words, len(words))
+            await asyncio.sleep(self.latency + self.latency_per_token * len(words))
+            summary = words[-payload.get("max_tokens", 100):]
+        finally:
+            self.in_flight -= 1
+        self.requests["completed"] += 1
+        return web.json_response({
+            "id": f"chatcmpl-{self.requests['completed']}",
+            "object": "chat.completion",
+            "model": payload.get("model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(summary)},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": len(words),
+                "completion_tokens": len(summary),
+                "total_tokens": len(words) + len(summary),
+            },
+        })
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 << 20)
+        app.router.add_post("/v1/chat/completions", self._completions)
+        return app
+
+    @asynccontextmanager
+    async def serve(self, port: int = 8766):
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", port)
+        await site.start()
+        self.base_url = f"http://127.0.0.1:{port}/v1"
+        try:
+            yield self
+        finally:
+            await runner.cleanup()
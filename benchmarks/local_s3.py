@@ -0,0 +1,41 @@
+import logging
+import os
+
+import boto3
+from moto.server import ThreadedMotoServer
+
+
+# Start an in-process moto S3 server and point every boto3/aioboto3 client at it through
+# AWS_ENDPOINT_URL, so the pipelines run unmodified against a local stand-in
+def start_local_s3(buckets=("obd-sum-stats",), port: int = 5055) -> ThreadedMotoServer:
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    os.environ.update(
+        AWS_ACCESS_KEY_ID="testing",
+        AWS_SECRET_ACCESS_KEY="testing",
+        AWS_REGION="us-east-1",
+        AWS_ENDPOINT_URL=f"http://127.0.0.1:{port}",
+    )
+    client = boto3.client("s3", region_name="us-east-1")
+    for bucket in buckets:
+        client.create_bucket(Bucket=bucket)
+    return server
+
+
+def bucket_usage(bucket: str) -> tuple[int, int]:
+    client = boto3.client("s3", region_name="us-east-1")
+    count = size = 0
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket=bucket):
+        for obj in page.get("Contents", []):
+            count += 1
+            size += obj["Size"]
+    return count, size
+
+
+def empty_bucket(bucket: str):
+    client = boto3.client("s3", region_name="us-east-1")
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket=bucket):
+        keys = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+        if keys:
+            client.delete_objects(Bucket=bucket, Delete={"Objects": keys})
@@ -0,0 +1,121 @@
+import json
+import random
+
+import numpy as np
+
+from stats_writer import read_stats_columns
+
+_WORDS = (
+    "the minister department request access information record briefing note contract "
+    "review policy federal canada government meeting email attached response section "
+    "exemption pursuant act page total cost program report analysis officer director "
+    "committee budget agreement service public file number date memo draft final"
+).split()
+_PUNCT = [".", ",", ";", ":", "(", ")", "-", "'s", "$", "%"]
+
+
+# Build a page of pseudo-English text with enough punctuation to exercise the tokenizer
+def make_page_text(rng: random.Random, num_words: int) -> str:
+    parts = []
+    for _ in range(num_words):
+        word = rng.choice(_WORDS)
+        roll = rng.random()
+        if roll < 0.08:
+            word += rng.choice(_PUNCT)
+        elif roll < 0.12:
+            word = str(rng.randint(1, 99999))
+        parts.append(word)
+    return " ".join(parts).capitalize() + "."
+
+
+# A document bundle shaped like the objects dc_to_s3 uploads
+def make_document(doc_id: int, num_pages: int, words_per_page: int, rng: random.Random) -> dict:
+    pages = [
+        {"page": i, "contents": make_page_text(rng, words_per_page)}
+        for i in range(num_pages)
+    ]
+    metadata = {
+        "id": doc_id,
+        "title": f"Synthetic document {doc_id}",
+        "slug": f"synthetic-document-{doc_id}",
+        "description": "",
+        "created_at": "2024-01-01T00:00:00Z",
+        "page_count": num_pages,
+        "data": {
+            "organization": ["Synthetic Org"],
+            "request_number": [f"A-2024-{doc_id:05d}"],
+            "file_size": [str(num_pages * words_per_page * 6)],
+        },
+    }
+    return {"doc_id": doc_id, "metadata": metadata, "text_json": {"pages": pages}}
+
+
+def make_document_bytes(doc_id: int, num_pages: int, words_per_page: int, rng: random.Random) -> bytes:
+    return json.dumps(make_document(doc_id, num_pages, words_per_page, rng)).encode("utf-8")
+
+
+# Word pool for the vectorized page generator, in roughly make_page_text's proportions
+_POOL = np.array(
+    _WORDS * 20 + [word + punct for word in _WORDS for punct in _PUNCT[:4]] + [str(n) for n in range(100, 260)],
+    dtype=object,
+)
+# spaCy splits off the punctuation attached to some words
+_TOKENS_PER_WORD = 1.1
+# Used when there are no stats to fit: a long tail of very long documents, ~200 tokens per page
+DEFAULT_MODEL = {"pages_mu": 2.3, "pages_sigma": 1.3, "tokens_mu": 5.3, "tokens_sigma": 0.6, "page_sigma": 0.5}
+
+
+class CorpusModel:
+    # Lognormal page counts per document; each document has a lognormal mean tokens per page, and
+    # its pages vary around that mean with a lognormal spread (page_sigma). fit() estimates all
+    # of it from document_stats: page_count, token_avg_per_page and token_std_dev per document.
+    def __init__(self, pages_mu, pages_sigma, tokens_mu, tokens_sigma, page_sigma, max_pages: int = 2000):
+        self.pages_mu = pages_mu
+        self.pages_sigma = pages_sigma
+        self.tokens_mu = tokens_mu
+        self.tokens_sigma = tokens_sigma
+        self.page_sigma = page_sigma
+        self.max_pages = max_pages
+
+    @classmethod
+    def fit(cls, doc_stats_path="data/document_stats.csv", **kwargs) -> "CorpusModel":
+        columns = ["page_count", "token_avg_per_page", "token_std_dev"]
+        stats = read_stats_columns(doc_stats_path, columns).dropna()
+        stats = stats[(stats["page_count"] > 0) & (stats["token_avg_per_page"] > 0)]
+        if len(stats) < 2:
+            raise ValueError(f"Not enough documents in {doc_stats_path} to fit a corpus model")
+        pages = np.log(stats["page_count"].to_numpy(dtype=np.float64))
+        tokens = np.log(stats["token_avg_per_page"].to_numpy(dtype=np.float64))
+        # Within-document spread from the coefficient of variation of a lognormal, over documents
+        # with more than one page
+        multi = stats[stats["page_count"] > 1]
+        cv = (multi["token_std_dev"] / multi["token_avg_per_page"]).to_numpy(dtype=np.float64)
+        page_sigma = float(np.median(np.sqrt(np.log1p(cv ** 2)))) if len(cv) else 0.0
+        return cls(float(pages.mean()), float(pages.std()), float(tokens.mean()), float(tokens.std()), page_sigma, **kwargs)
+
+    @classmethod
+    def fit_or_default(cls, doc_stats_path="data/document_stats.csv", **kwargs) -> "CorpusModel":
+        try:
+            return cls.fit(doc_stats_path, **kwargs)
+        except (OSError, ValueError) as e:
+            print(f"Using the default corpus model ({e})")
+            return cls(**DEFAULT_MODEL, **kwargs)
+
+    def params(self) -> dict:
+        return {name: getattr(self, name) for name in (*DEFAULT_MODEL, "max_pages")}
+
+    # Tokens per page for each of num_docs documents
+    def sample_page_tokens(self, num_docs: int, rng: np.random.Generator) -> list[np.ndarray]:
+        pages = np.clip(rng.lognormal(self.pages_mu, self.pages_sigma, num_docs), 1, self.max_pages).astype(np.int64)
+        means = rng.lognormal(self.tokens_mu, self.tokens_sigma, num_docs)
+        return [
+            np.maximum(1, rng.lognormal(np.log(mean) - self.page_sigma ** 2 / 2, self.page_sigma, n)).astype(np.int64)
+            for n, mean in zip(pages, means)
+        ]
+
+    def sample_pages(self, num_docs: int, rng: np.random.Generator):
+        for tokens in self.sample_page_tokens(num_docs, rng):
+            words = np.maximum(1, (tokens / _TOKENS_PER_WORD).astype(np.int64))
+            indexes = rng.integers(0, len(_POOL), int(words.sum()))
+            ends = np.cumsum(words)
+            yield [" ".join(_POOL[indexes[end - n:end]]).capitalize() + "." for n, end in zip(words, ends)]
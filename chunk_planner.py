@@ -0,0 +1,297 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from stats_writer import read_stats_columns
+
+# Plans how each document would be fed to a model with a given context window, from per-page
+# token counts alone. Three strategies for documents longer than the context:
+#
+#   map_reduce          consecutive pages packed greedily into chunks (with `overlap` tokens of
+#                       the previous chunk repeated), one call per chunk, then the chunk
+#                       summaries combined in as many reduce rounds as they need
+#   central_truncation  one call on the first and last budget/2 tokens, the middle dropped
+#   skimming            one call on `segments` evenly spaced windows of budget/segments tokens
+#
+# Everything runs on arrays over the whole page table: a global cumulative sum of tokens and
+# searchsorted into it. The only Python loops are over chunk rounds (every document advances one
+# chunk per round) and reduce levels, never over documents or pages.
+STRATEGIES = ("map_reduce", "central_truncation", "skimming")
+
+
+class PageTable:
+    # Pages sorted by (doc_id, page_number). Document d owns pages starts[d]:ends[d], and
+    # cum[j] is the number of tokens before page j, so a span's tokens are cum[end] - cum[start].
+    def __init__(self, doc_ids, page_numbers, tokens):
+        codes, uniques = pd.factorize(pd.Series(doc_ids).astype(str), sort=True)
+        page_numbers = np.asarray(page_numbers, dtype=np.int64)
+        order = np.lexsort((page_numbers, codes))
+        codes = codes[order]
+        self.doc_ids = np.asarray(uniques, dtype=object)
+        self.page_numbers = page_numbers[order]
+        self.tokens = np.asarray(tokens, dtype=np.int64)[order]
+        self.cum = np.concatenate(([0], np.cumsum(self.tokens)))
+        self.starts = np.searchsorted(codes, np.arange(len(uniques)), side="left")
+        self.ends = np.searchsorted(codes, np.arange(len(uniques)), side="right")
+
+    @classmethod
+    def from_frame(cls, pages: pd.DataFrame, column: str = "tokens_per_page") -> "PageTable":
+        # Pages from stats written before an extra counter was configured have no count for it
+        pages = pages.dropna(subset=[column])
+        return cls(pages["doc_id"], pages["page_number"], pages[column])
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_ids)
+
+    @property
+    def num_pages(self) -> int:
+        return len(self.tokens)
+
+    def doc_tokens(self) -> np.ndarray:
+        return self.cum[self.ends] - self.cum[self.starts]
+
+
+# Reads only the columns the planner needs, from a Parquet dataset or CSV
+def load_page_table(path, column: str = "tokens_per_page") -> PageTable:
+    pages = read_stats_columns(path, ["doc_id", "page_number", column], dtype={"doc_id": str})
+    return PageTable.from_frame(pages, column)
+
+
+# Tokens of the context left for document text once the prompt and the summary are reserved
+def input_budget(context: int, prompt_tokens: int, summary_tokens: int) -> int:
+    budget = context - prompt_tokens - summary_tokens
+    if budget <= 0:
+        raise ValueError(f"A {context}-token context leaves no room for text after the prompt and summary")
+    return budget
+
+
+def _ceil_div(a, b):
+    return -(-a // b)
+
+
+# Greedy map chunks for every document at once. Each round advances every unfinished document by
+# one chunk: the furthest page boundary within budget of its position (budget - overlap after the
+# first chunk, which repeats the end of the previous one). A page larger than the budget is a
+# chunk of its own, split across ceil(tokens / budget) calls.
+# Returns (doc, start, end, tokens, input_tokens, calls) arrays, one entry per chunk.
+def _map_chunks(table: PageTable, budget: int, overlap: int):
+    if not 0 <= overlap < budget:
+        raise ValueError(f"overlap must be at least 0 and below the {budget}-token input budget")
+    cum = table.cum
+    docs = np.flatnonzero(table.ends > table.starts)
+    pos = table.starts[docs]
+    ends = table.ends[docs]
+    prev = np.zeros(len(docs), dtype=np.int64)
+    rounds = []
+    step = budget
+    while len(docs):
+        nxt = np.searchsorted(cum, cum[pos] + step, side="right") - 1
+        nxt = np.maximum(np.minimum(nxt, ends), pos + 1)
+        tokens = cum[nxt] - cum[pos]
+        rounds.append((docs, pos, nxt, tokens, tokens + np.minimum(prev, overlap)))
+        left = nxt < ends
+        docs, pos, ends, prev = docs[left], nxt[left], ends[left], tokens[left]
+        step = budget - overlap
+    if not rounds:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, empty, empty, empty
+    doc, start, end, tokens, input_tokens = (np.concatenate(parts) for parts in zip(*rounds))
+    # Rounds are in chunk order; a stable sort by document keeps them that way within a document
+    order = np.argsort(doc, kind="stable")
+    doc, start, end, tokens, input_tokens = doc[order], start[order], end[order], tokens[order], input_tokens[order]
+    calls = np.maximum(_ceil_div(input_tokens, budget), 1)
+    return doc, start, end, tokens, input_tokens, calls
+
+
+# Reduce rounds for n chunk summaries per document: each call combines up to fan_in summaries,
+# until one is left. Returns (calls, input tokens) per document.
+def _reduce_calls(map_calls: np.ndarray, budget: int, summary_tokens: int):
+    fan_in = max(2, budget // max(summary_tokens, 1))
+    n = map_calls.astype(np.int64)
+    calls = np.zeros_like(n)
+    input_tokens = np.zeros_like(n)
+    while (n > 1).any():
+        merging = n > 1
+        input_tokens += np.where(merging, n * summary_tokens, 0)
+        n = np.where(merging, _ceil_div(n, fan_in), n)
+        calls += np.where(merging, n, 0)
+    return calls, input_tokens
+
+
+# Spans (doc, call, start, end, tokens) for the single-call strategies. A span's first and last
+# pages may only be partly used; tokens counts what is kept.
+def _truncation_spans(table: PageTable, budget: int):
+    cum = table.cum
+    docs = np.flatnonzero(table.ends > table.starts)
+    s, e = table.starts[docs], table.ends[docs]
+    total = cum[e] - cum[s]
+    fits = total <= budget
+    half = budget // 2
+    head_end = np.searchsorted(cum, cum[s] + half, side="left")
+    tail_start = np.searchsorted(cum, cum[e] - (budget - half), side="right") - 1
+    # Head and tail both whole when the document fits; otherwise both clipped
+    head_end = np.where(fits, e, np.maximum(head_end, s + 1))
+    head_tokens = np.where(fits, total, half)
+    long = ~fits
+    doc = np.concatenate((docs, docs[long]))
+    start = np.concatenate((s, np.minimum(tail_start[long], e[long] - 1)))
+    end = np.concatenate((head_end, e[long]))
+    tokens = np.concatenate((head_tokens, np.full(long.sum(), budget - half)))
+    order = np.argsort(doc, kind="stable")
+    return doc[order], np.zeros(len(doc), dtype=np.int64), start[order], end[order], tokens[order]
+
+
+def _skimming_spans(table: PageTable, budget: int, segments: int):
+    if not 0 < segments <= budget:
+        raise ValueError(f"segments must be between 1 and the {budget}-token input budget")
+    cum = table.cum
+    docs = np.flatnonzero(table.ends > table.starts)
+    s, e = table.starts[docs], table.ends[docs]
+    total = cum[e] - cum[s]
+    fits = total <= budget
+    # Documents that fit are one span; the rest get `segments` windows at evenly spaced offsets
+    n = np.where(fits, 1, segments)
+    doc = np.repeat(docs, n)
+    s_rep, e_rep, total_rep = np.repeat(s, n), np.repeat(e, n), np.repeat(total, n)
+    segment = np.arange(len(doc)) - np.repeat(np.cumsum(n) - n, n)
+    window = budget // segments
+    offset = cum[s_rep] + segment * total_rep // np.repeat(n, n)
+    whole = np.repeat(fits, n)
+    start = np.where(whole, s_rep, np.searchsorted(cum, offset, side="right") - 1)
+    end = np.where(whole, e_rep, np.searchsorted(cum, offset + window, side="left"))
+    end = np.minimum(np.maximum(end, start + 1), e_rep)
+    tokens = np.where(whole, total_rep, window)
+    return doc, np.zeros(len(doc), dtype=np.int64), start, end, tokens
+
+
+def _check_strategy(strategy: str):
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy {strategy!r}; expected one of {STRATEGIES}")
+
+
+# Page spans sent to the model for each document: one row per (doc_id, call, span), with the
+# page_number of the first and last page in the span and the tokens it contributes
+def plan_chunks(
+    table: PageTable,
+    strategy: str,
+    context: int,
+    overlap: int = 0,
+    prompt_tokens: int = 200,
+    summary_tokens: int = 300,
+    segments: int = 8,
+) -> pd.DataFrame:
+    _check_strategy(strategy)
+    budget = input_budget(context, prompt_tokens, summary_tokens)
+    if strategy == "map_reduce":
+        doc, start, end, tokens, _, _ = _map_chunks(table, budget, overlap)
+        first = np.searchsorted(doc, doc, side="left")
+        call = np.arange(len(doc)) - first
+    elif strategy == "central_truncation":
+        doc, call, start, end, tokens = _truncation_spans(table, budget)
+    else:
+        doc, call, start, end, tokens = _skimming_spans(table, budget, segments)
+    return pd.DataFrame({
+        "doc_id": table.doc_ids[doc],
+        "call": call,
+        "first_page": table.page_numbers[start],
+        "last_page": table.page_numbers[end - 1],
+        "tokens": tokens,
+    })
+
+
+# Per-document cost of a strategy: calls and input/output tokens, prompts included
+def plan_documents(
+    table: PageTable,
+    strategy: str,
+    context: int,
+    overlap: int = 0,
+    prompt_tokens: int = 200,
+    summary_tokens: int = 300,
+) -> pd.DataFrame:
+    _check_strategy(strategy)
+    budget = input_budget(context, prompt_tokens, summary_tokens)
+    doc_tokens = table.doc_tokens()
+    has_pages = (table.ends > table.starts).astype(np.int64)
+    if strategy == "map_reduce":
+        doc, _, _, _, chunk_input, chunk_calls = _map_chunks(table, budget, overlap)
+        map_calls = np.bincount(doc, weights=chunk_calls, minlength=table.num_docs).astype(np.int64)
+        map_input = np.bincount(doc, weights=chunk_input, minlength=table.num_docs).astype(np.int64)
+        reduce_calls, reduce_input = _reduce_calls(map_calls, budget, summary_tokens)
+        text_tokens = map_input + reduce_input
+    else:
+        # Both single-call strategies send min(document, budget) tokens once
+        map_calls = has_pages
+        reduce_calls = np.zeros(table.num_docs, dtype=np.int64)
+        text_tokens = np.minimum(doc_tokens, budget)
+    llm_calls = map_calls + reduce_calls
+    return pd.DataFrame({
+        "doc_id": table.doc_ids,
+        "pages": table.ends - table.starts,
+        "tokens": doc_tokens,
+        "map_calls": map_calls,
+        "reduce_calls": reduce_calls,
+        "llm_calls": llm_calls,
+        "input_tokens": text_tokens + llm_calls * prompt_tokens,
+        "output_tokens": llm_calls * summary_tokens,
+        "truncated": (doc_tokens > budget) & (strategy != "map_reduce"),
+    })
+
+
+# Corpus totals for every (strategy, context) pair
+def estimate_corpus(
+    table: PageTable,
+    contexts,
+    strategies=STRATEGIES,
+    overlap: int = 0,
+    prompt_tokens: int = 200,
+    summary_tokens: int = 300,
+) -> pd.DataFrame:
+    budgets = {context: input_budget(context, prompt_tokens, summary_tokens) for context in contexts}
+    doc_tokens = table.doc_tokens()
+    rows = []
+    for strategy in strategies:
+        for context in contexts:
+            plan = plan_documents(table, strategy, context, overlap, prompt_tokens, summary_tokens)
+            rows.append({
+                "strategy": strategy,
+                "context": context,
+                "documents": len(plan),
+                "llm_calls": int(plan["llm_calls"].sum()),
+                "input_tokens": int(plan["input_tokens"].sum()),
+                "output_tokens": int(plan["output_tokens"].sum()),
+                "docs_over_context": int((doc_tokens > budgets[context]).sum()),
+                "max_calls_per_doc": int(plan["llm_calls"].max()) if len(plan) else 0,
+            })
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan chunked summarization from page token counts")
+    parser.add_argument("page_stats", nargs="?", default="data/page_token_counts")
+    parser.add_argument("--column", default="tokens_per_page", help="e.g. tokens_per_page_llama3")
+    parser.add_argument("--contexts", type=int, nargs="+", default=[4096, 8192, 16384, 32768, 128000])
+    parser.add_argument("--strategies", nargs="+", choices=STRATEGIES, default=list(STRATEGIES))
+    parser.add_argument("--overlap", type=int, default=0)
+    parser.add_argument("--prompt-tokens", type=int, default=200)
+    parser.add_argument("--summary-tokens", type=int, default=300)
+    parser.add_argument("--chunks-out", help="write the chunk plan of the first strategy and context here (Parquet)")
+    args = parser.parse_args()
+
+    table = load_page_table(args.page_stats, args.column)
+    print(f"{table.num_docs} documents, {table.num_pages} pages, {int(table.cum[-1])} tokens")
+    estimate = estimate_corpus(
+        table, args.contexts, args.strategies, args.overlap, args.prompt_tokens, args.summary_tokens
+    )
+    print(estimate.to_string(index=False))
+    if args.chunks_out:
+        chunks = plan_chunks(
+            table, args.strategies[0], args.contexts[0], args.overlap, args.prompt_tokens, args.summary_tokens
+        )
+        chunks.to_parquet(args.chunks_out, index=False)
+        print(f"Wrote {len(chunks)} chunks to {args.chunks_out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import gzip
+import json
+
+COMPRESSIONS = (None, "gzip", "zstd")
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+# Python 3.14 ships zstd in the standard library; older interpreters need the zstandard package
+def _zstd():
+    try:
+        from compression import zstd
+        return zstd.compress, zstd.decompress
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("zstd compression needs Python 3.14+ or the zstandard package") from e
+    return zstandard.ZstdCompressor().compress, lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+# Whether this interpreter can write and read zstd at all, for checking options up front
+def zstd_available() -> bool:
+    try:
+        _zstd()
+    except ImportError:
+        return False
+    return True
+
+
+def compress(payload: bytes, compression: str | None = None) -> bytes:
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression: {compression}")
+    if compression == "gzip":
+        return gzip.compress(payload, compresslevel=6)
+    if compression == "zstd":
+        return _zstd()[0](payload)
+    return payload
+
+
+# The uncompressed JSON payload, as decode_body gives it back
+def serialize_document(doc_bundle: dict) -> bytes:
+    return json.dumps(doc_bundle, separators=(",", ":")).encode("utf-8")
+
+
+# Serialize a document bundle compactly; returns the payload and its Content-Encoding (or None)
+def encode_document(doc_bundle: dict, compression: str | None = None) -> tuple[bytes, str | None]:
+    return compress(serialize_document(doc_bundle), compression), compression
+
+
+# Undo encode_document by sniffing magic bytes rather than trusting Content-Encoding: some HTTP
+# clients already inflate gzip bodies on the way in, and plain JSON never starts with either magic
+def decode_body(body: bytes) -> bytes:
+    if body[:2] == _GZIP_MAGIC:
+        return gzip.decompress(body)
+    if body[:4] == _ZSTD_MAGIC:
+        return _zstd()[1](body)
+    return body
@@ -1,11 +1,27 @@
 import asyncio
-import json
 import os
+import random
+import time
+from array import array
+from collections import defaultdict
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from io import BytesIO
-import boto3
-from aiohttp import ClientSession
+from pathlib import Path
+from urllib.parse import urlencode
+import aioboto3
+from aiohttp import ClientSession, TCPConnector
 from dotenv import load_dotenv
+from codec import COMPRESSIONS, compress, serialize_document, zstd_available
+from leases import bucket_of, default_owner
+from ledger import EXPORT_STAGE, JobLedger
+from metrics import Metrics, maybe_profile, report_periodically
+from rate_limit import AdaptiveRateLimiter, request_json
+from s3_listing import S3Manifest
+
+
+# Overridable (e.g. in .env) to point the exporter at a local fake DocumentCloud
+DEFAULT_DC_API_URL = "https://api.www.documentcloud.org/api/"
+DEFAULT_DC_AUTH_URL = "https://accounts.muckrock.com/api/token/"
 
 
 class Singleton(type):
@@ -22,258 +38,528 @@ class DCToken(metaclass=Singleton):
         load_dotenv()
         self._uname = os.environ["DOCUMENTCLOUD_USERNAME"]
         self._pw = os.environ["DOCUMENTCLOUD_PASSWORD"]
+        self._auth_url = os.environ.get("DOCUMENTCLOUD_AUTH_URL", DEFAULT_DC_AUTH_URL)
         self._token = None
         self._token_expiry = datetime.fromtimestamp(0)
-        self._session = ClientSession()
+        self._lock = None
+        self._loop = None
 
-    async def _get_new_token(self) -> str:
+    async def _get_new_token(self, session: ClientSession) -> str:
         formdata = {"username": self._uname, "password": self._pw}
-        res = await self._session.post(
-            "https://accounts.muckrock.com/api/token/",
-            data=formdata,
-            allow_redirects=True,
-        )
-        if not res.ok:
-            res.raise_for_status()
-        return json.loads(await res.text())["access"]
-
-    async def token(self):
-        now = datetime.now()
-        if self._token_expiry < now:
-            self._token = await self._get_new_token()
-            self._token_expiry = now + timedelta(minutes=4, seconds=50)
+        data = await request_json(session, self._auth_url, method="POST", data=formdata, allow_redirects=True)
+        return data["access"]
+
+    # Single flight: when the token expires, the first caller refreshes it and every other
+    # consumer waits on the lock and reuses the new token instead of requesting its own
+    async def token(self, session: ClientSession):
+        if self._token_expiry > datetime.now():
+            return self._token
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._lock = loop, asyncio.Lock()
+        async with self._lock:
+            if self._token_expiry <= datetime.now():
+                now = datetime.now()
+                self._token = await self._get_new_token(session)
+                self._token_expiry = now + timedelta(minutes=4, seconds=50)
         return self._token
 
+    async def headers(self, session: ClientSession) -> dict:
+        return {"Authorization": f"Bearer {await self.token(session)}"}
+
+    # Called when the API rejects a token; only expire it if nobody has refreshed it since
+    def invalidate(self, headers: dict):
+        if headers and headers.get("Authorization") == f"Bearer {self._token}":
+            self._token_expiry = datetime.fromtimestamp(0)
+
 
 class dc_to_s3:
-    def __init__(self, project_id, max_documents, num_consumers) -> None:
+    def __init__(
+        self,
+        project_id,
+        max_documents,
+        num_consumers,
+        ledger_path="data/ledger.sqlite3",
+        listing_max_age=timedelta(hours=24),
+        upload_concurrency=16,
+        compression=None,
+        incremental=False,
+        api_rate=1.0,
+        api_max_rate=10.0,
+        max_connections=64,
+        max_connections_per_host=32,
+        metrics_path="data/metrics/export.prom",
+        metrics_interval=15.0,
+        profile_path=None,
+    ) -> None:
         load_dotenv()
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"compression must be one of {COMPRESSIONS}")
+        # Here rather than at the first upload, with consumers already running
+        if compression == "zstd" and not zstd_available():
+            raise ImportError("zstd compression needs Python 3.14+ or the zstandard package")
         self._S3_BUCKET = "obd-sum-stats"
-        self._s3_client = boto3.client(
-            "s3",
-            aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
-            aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"],
-            region_name=os.environ["AWS_REGION"],
-        )
-        self._DC_URL = "https://api.www.documentcloud.org/api/projects/"
+        self._aws_kwargs = {
+            "aws_access_key_id": os.environ["AWS_ACCESS_KEY_ID"],
+            "aws_secret_access_key": os.environ["AWS_SECRET_ACCESS_KEY"],
+            "region_name": os.environ["AWS_REGION"],
+        }
+        self._async_s3 = None
+        self._upload_semaphore = asyncio.Semaphore(upload_concurrency)
+        self._compression = compression
+        self._incremental = incremental
+        self._API_URL = os.environ.get("DOCUMENTCLOUD_API_URL", DEFAULT_DC_API_URL)
+        self._DC_URL = f"{self._API_URL}projects/"
         self._PROJECT_ID = project_id
         self._max_documents = max_documents
         self._num_consumers = num_consumers
+        self._ledger = JobLedger(ledger_path)
+        self._listing_max_age = listing_max_age
+        # One limiter for every DocumentCloud API call, shared by all consumers
+        self._limiter = AdaptiveRateLimiter(rate=api_rate, max_rate=api_max_rate)
+        self._max_connections = max_connections
+        self._max_connections_per_host = max_connections_per_host
+        # Per-stage latencies and document counts (see metrics.py), written to metrics_path every
+        # metrics_interval seconds along with a progress line; profile_path (or $OBD_PROFILE)
+        # turns on the sampling profiler for the run
+        self.metrics = Metrics()
+        self._metrics_path = metrics_path
+        self._metrics_interval = metrics_interval
+        self._profile_path = profile_path or os.environ.get("OBD_PROFILE")
+        # Async callback given (doc_id, payload) for every document this run uploads, payload being
+        # the uncompressed bundle JSON; a fused run (ingest.py) tokenizes documents from it
+        self.tee = None
+        # Keys, sizes and ETags in the bucket (see s3_listing.py), kept next to the ledger; every
+        # upload is recorded in it
+        self.manifest = S3Manifest(self._S3_BUCKET, directory=Path(ledger_path).parent / "s3_manifest")
+        self._busy_consumers = 0
+        self._uploads_in_flight = 0
+        self.metrics.gauge("api_rate_limit", lambda: self._limiter.rate)
+        self.metrics.gauge("api_throttled", lambda: self._limiter.throttled)
+        self.metrics.gauge("busy_consumers", lambda: self._busy_consumers)
+        self.metrics.gauge("uploads_in_flight", lambda: self._uploads_in_flight)
+
+    # One pooled connector for the API and the static asset host: connections are reused across
+    # documents instead of re-doing TCP/TLS handshakes, and DNS answers are cached
+    def _make_connector(self) -> TCPConnector:
+        return TCPConnector(
+            limit=self._max_connections,
+            limit_per_host=self._max_connections_per_host,
+            keepalive_timeout=60,
+            ttl_dns_cache=300,
+        )
+
+    # Rate-limited, retried GET against the DocumentCloud API; stage is "listing" or "metadata_get"
+    async def _api_get(self, session: ClientSession, url: str, stage: str = "metadata_get"):
+        with self.metrics.time("stage_seconds", stage=stage):
+            return await request_json(session, url, limiter=self._limiter, auth=DCToken())
 
     # Fetch a batch of documents from DC
     async def fetch_document_batches(self, session: ClientSession, project_id: int, batch_size: int = 100):
-        dctk = DCToken()
-        token = await dctk.token()
-
-        headers = {"Authorization": f"Bearer {token}"}
-        url = f"{self._DC_URL}{project_id}/documents/?per_page={batch_size}"
+        url = f"{self._DC_URL}{project_id}/documents/?per_page={batch_size}&expand=document"
         total_fetched = 0
 
         while url and total_fetched < self._max_documents:
-            async with session.get(url, headers=headers) as res:
-                if res.status == 403:
-                    await asyncio.sleep(5)
-                    continue
-                if res.status == 429:
-                    msg = await res.text()
-                    print("429 Received:", msg)
-                res.raise_for_status()
-                data = await res.json()
-                results = data.get("results", [])
-                total_fetched += len(results)
-                yield results
-                url = data.get("next")
-                await asyncio.sleep(1)
-
-    # Pack a document onj
-    async def get_document_obj(self, session: ClientSession, doc_id: int) -> dict:
-        dctk = DCToken()
-        token = await dctk.token()
-        headers = {"Authorization": f"Bearer {token}"}
-
-        async with session.get(f"https://api.www.documentcloud.org/api/documents/{doc_id}/", headers=headers) as meta_res:
-            meta_res.raise_for_status()
-            metadata = await meta_res.json()
+            data = await self._api_get(session, url, stage="listing")
+            results = data.get("results", [])
+            total_fetched += len(results)
+            yield results
+            url = data.get("next")
+
+    # Pack a document onj. Metadata from the project listing saves the per-document API call;
+    # without it (or if its text URL has gone stale) the metadata is fetched.
+    async def get_document_obj(self, session: ClientSession, doc_id: int, metadata: dict | None = None) -> dict:
+        from_listing = bool(metadata and metadata.get("asset_url") and metadata.get("slug"))
+        if not from_listing:
+            metadata = await self._api_get(session, f"{self._API_URL}documents/{doc_id}/")
+
+        text_json = await self._get_text_json(session, doc_id, metadata)
+        if text_json is None and from_listing:
+            fresh = await self._api_get(session, f"{self._API_URL}documents/{doc_id}/")
+            if (fresh.get("asset_url"), fresh.get("slug")) != (metadata.get("asset_url"), metadata.get("slug")):
+                text_json = await self._get_text_json(session, doc_id, fresh)
+            metadata = fresh
+        if text_json is None:
+            self.metrics.inc("missing_text_total")
+            return {"doc_id": doc_id, "metadata": metadata, "text_json": {}}
+        return {"doc_id": doc_id, "metadata": metadata, "text_json": text_json}
 
+    async def _get_text_json(self, session: ClientSession, doc_id: int, metadata: dict):
         asset_url = metadata.get("asset_url")
         slug = metadata.get("slug")
         if not asset_url:
             raise ValueError(f"No asset_url found for {doc_id}")
         static_text_url = f"{asset_url}documents/{doc_id}/{slug}.txt.json"
 
-        async with session.get(static_text_url) as text_res:
-            if text_res.status == 404:
-                print(f"No text JSON found for {doc_id}")
-                return {"doc_id": doc_id, "metadata": metadata, "text_json": {}}
-
-            text_res.raise_for_status()
-            text_json = await text_res.json()
-        return {"doc_id": doc_id, "metadata": metadata, "text_json": text_json}
+        # Static assets aren't behind the API rate limit, but still get retries
+        with self.metrics.time("stage_seconds", stage="text_get"):
+            return await request_json(session, static_text_url, allow_404=True)
 
-    # Upload a doc to S3 and log it
-    async def process_document(self, session: ClientSession, doc_id: int, empty_path: str):
+    # Upload a doc to S3, record its state in the ledger and hand it to the tee, if any
+    async def process_document(self, session: ClientSession, doc_id: int, metadata: dict | None = None):
+        start = time.perf_counter()
+        payload = None
         try:
-            doc_bundle = await self.get_document_obj(session, doc_id)
-            if not doc_bundle["text_json"]:
-                with open(empty_path, "a") as f:
-                    f.write(f"{doc_id}\n")
-            await self.upload_document_to_s3(doc_bundle, cache_path="uploaded_ids_cache.txt")
+            doc_bundle = await self.get_document_obj(session, doc_id, metadata)
+            self._ledger.record(doc_id, EXPORT_STAGE, "fetched")
+            payload = await self.upload_document_to_s3(doc_bundle)
+            status = "uploaded" if doc_bundle["text_json"] else "empty"
+            self._ledger.record(doc_id, EXPORT_STAGE, status)
         except Exception as e:
+            status = "failed"
+            payload = None
+            self._ledger.record(doc_id, EXPORT_STAGE, "failed", error=repr(e))
             print(f"Error with {doc_id}: {e}")
+        self.metrics.inc("documents_total", status=status)
+        self.metrics.observe("stage_seconds", time.perf_counter() - start, stage="document")
+        if payload is not None and self.tee is not None:
+            await self.tee(doc_id, payload)
+
+    # Opens the async S3 client that upload_document_to_s3 uses for the duration of a run
+    @asynccontextmanager
+    async def open_async_s3(self):
+        async with aioboto3.Session().client("s3", **self._aws_kwargs) as s3:
+            self._async_s3 = s3
+            try:
+                yield s3
+            finally:
+                self._async_s3 = None
 
-    # Uploading helper
-    async def upload_document_to_s3(self, doc_bundle: dict, cache_path):
+    # Uploading helper: compact (optionally compressed) JSON, PUT without blocking the event loop.
+    # Returns the uncompressed payload.
+    async def upload_document_to_s3(self, doc_bundle: dict) -> bytes:
         doc_id = doc_bundle["doc_id"]
-        buffer = BytesIO(json.dumps(doc_bundle, indent=2).encode("utf-8"))
-        self._s3_client.upload_fileobj(buffer, self._S3_BUCKET, f"{doc_id}.json")
-        print(f"Uploaded {doc_id}")
-
-        # Append to cache
-        with open(cache_path, "a") as f:
-            f.write(f"{doc_id}\n")
-
-    async def consumer(self, queue, session, empty_path, total_pending, completed_lock, completed_count_ref):
+        payload = serialize_document(doc_bundle)
+        body = compress(payload, self._compression)
+        extra = {"ContentEncoding": self._compression} if self._compression else {}
+        async with self._upload_semaphore:
+            self._uploads_in_flight += 1
+            try:
+                with self.metrics.time("stage_seconds", stage="s3_put"):
+                    response = await self._async_s3.put_object(
+                        Bucket=self._S3_BUCKET,
+                        Key=f"{doc_id}.json",
+                        Body=body,
+                        ContentType="application/json",
+                        **extra,
+                    )
+            finally:
+                self._uploads_in_flight -= 1
+        self.manifest.record(f"{doc_id}.json", len(body), response.get("ETag", ""))
+        self.metrics.inc("uploaded_bytes_total", len(body))
+        return payload
+
+    # still_owned, in sharded mode, drops queued documents whose bucket lease has been lost.
+    # Progress is counted in self.metrics and printed by the reporter, not per document.
+    async def consumer(self, queue, session, still_owned=None):
         while True:
-            doc_id = await queue.get()
-            if doc_id is None:
+            item = await queue.get()
+            if item is None:
                 queue.task_done()
                 break
+            doc_id, metadata = item
             try:
-                await self.process_document(session, int(doc_id), empty_path)
-                async with completed_lock:
-                    completed_count_ref[0] += 1
-                    print(f"Progress: {completed_count_ref[0]}/{len(total_pending)} done")
+                if still_owned and not still_owned(doc_id):
+                    self.metrics.inc("documents_skipped_total")
+                    continue
+                self._busy_consumers += 1
+                try:
+                    await self.process_document(session, int(doc_id), metadata)
+                finally:
+                    self._busy_consumers -= 1
             finally:
                 queue.task_done()
 
-    # Get the list of docs in S3
-    async def list_uploaded_ids_s3(self, cache_path="uploaded_ids_cache.txt") -> set:
-        if os.path.exists(cache_path):
-            print(f"Using cached uploaded IDs from {cache_path}")
-            with open(cache_path, "r") as f:
-                return set(line.strip() for line in f)
-
-        print("Fetching uploaded IDs from S3...")
-        paginator = self._s3_client.get_paginator("list_objects_v2")
-        uploaded_ids = set()
-
+    def _documents_done(self) -> int:
+        return int(sum(self.metrics.counter("documents_total", status=s) for s in ("uploaded", "empty", "failed")))
+
+    def _progress_line(self, total_pending: int) -> str:
+        done = self._documents_done()
+        rate = done / max(time.monotonic() - self._run_started, 1e-9)
+        return f"Progress: {done}/{total_pending} done ({rate:.1f} docs/sec)"
+
+    # Periodic metrics snapshots and progress lines for the duration of a run, and the stage
+    # latencies at the end
+    @asynccontextmanager
+    async def _reporting(self, queue, total_pending: int):
+        self._run_started = time.monotonic()
+        self.metrics.gauge("queue_depth", queue.qsize)
+        reporter = asyncio.create_task(report_periodically(
+            self.metrics, self._metrics_path, self._metrics_interval, lambda: self._progress_line(total_pending)
+        ))
         try:
-            for page in paginator.paginate(Bucket=self._S3_BUCKET):
-                for obj in page.get("Contents", []):
-                    key = obj["Key"]
-                    if key.endswith(".json"):
-                        doc_id = key.replace(".json", "")
-                        uploaded_ids.add(doc_id)
+            with maybe_profile(self._profile_path):
+                yield
+        finally:
+            reporter.cancel()
+            await asyncio.gather(reporter, return_exceptions=True)
+            print(self._progress_line(total_pending))
+            for line in self.metrics.latency_report():
+                print(f"  {line}")
+
+    # Record the objects in S3 the ledger doesn't have as exported yet, e.g. ones other nodes or
+    # an earlier ledger uploaded. The listing comes from the bucket manifest, which is only
+    # re-listed when older than listing_max_age (or with force), so a run usually just checks
+    # the manifest's keys against the ledger. Changed documents stay pending for re-export.
+    async def sync_uploaded_ids_from_s3(self, force=False) -> int:
+        max_age = 0.0 if force else self._listing_max_age.total_seconds()
+        if not self.manifest.is_fresh(max_age):
+            print("Fetching uploaded IDs from S3...")
+        try:
+            with self.metrics.time("stage_seconds", stage="s3_listing"):
+                await self.manifest.refresh(self._async_s3, max_age)
         except Exception as e:
             print(f"Failed to list objects in S3: {e}")
-
-        # Save to cache
-        with open(cache_path, "w") as f:
-            for doc_id in uploaded_ids:
-                f.write(f"{doc_id}\n")
-
-        print(f"Cached {len(uploaded_ids)} uploaded document IDs")
-        return uploaded_ids
-
-    async def load_or_fetch_dc_doc_ids(self, session: ClientSession, cache_path="dc_document_ids_cache.txt") -> set:
-        if os.path.exists(cache_path):
-            print(f"Using cached DC document IDs from {cache_path}")
-            with open(cache_path, "r") as f:
-                return set(line.strip() for line in f)
+            return self._ledger.count(EXPORT_STAGE, ("uploaded", "empty"))
+
+        doc_ids = [key.removesuffix(".json") for key in self.manifest.keys(".json")]
+        changed = self._ledger.ids_in_state(EXPORT_STAGE, "changed")
+        new = [doc_id for doc_id in self._ledger.filter_not_done(doc_ids, EXPORT_STAGE) if doc_id not in changed]
+        self._ledger.record_many(new, EXPORT_STAGE, "uploaded")
+        self._ledger.flush()
+        if new:
+            print(f"Recorded {len(new)} more uploaded document IDs from the S3 listing")
+        return self._ledger.count(EXPORT_STAGE, ("uploaded", "empty"))
+
+    def _listing_is_fresh(self) -> bool:
+        listed_at = self._ledger.get_meta("dc_listed_at")
+        return bool(listed_at) and datetime.now() - datetime.fromisoformat(listed_at) < self._listing_max_age
+
+    # Re-list the project when the last complete listing is older than listing_max_age, so new
+    # documents aren't hidden behind a stale listing. Listed ids never overwrite later states.
+    async def refresh_dc_doc_ids(self, session: ClientSession, force=False) -> int:
+        if not force and self._listing_is_fresh():
+            print(f"Using DC document listing from {self._ledger.get_meta('dc_listed_at')}")
+            return self._ledger.count(EXPORT_STAGE)
 
         print("Fetching document IDs from DocumentCloud API...")
 
-        url = f"{self._DC_URL}{self._PROJECT_ID}/documents/?per_page=100"
-        doc_ids = set()
-
-        with open(cache_path, "w") as f:
-            while url:
-                dctk = DCToken()
-                token = await dctk.token()
-                headers = {"Authorization": f"Bearer {token}"}
-
-                async with session.get(url, headers=headers) as res:
-                    if res.status == 403:
-                        print("Got 403")
-                        await asyncio.sleep(5)
-                        continue
-                    if res.status == 429:
-                        print("Rate limited while fetching DC document list.")
-                        await asyncio.sleep(10)
-                        continue
-                    res.raise_for_status()
-                    data = await res.json()
-                    results = data.get("results", [])
-
-                    new_ids = [str(entry["document"]) for entry in results]
-                    for doc_id in new_ids:
-                        if doc_id not in doc_ids:
-                            f.write(f"{doc_id}\n")
-                            doc_ids.add(doc_id)
-
-                    print(f"Fetched {len(new_ids)} more, total so far: {len(doc_ids)}")
-
-                    url = data.get("next")
-                    if not url:
-                        print("Reached end of document list.")
-                        break
-
-                    await asyncio.sleep(1)
-
-        print(f"Wrote {len(doc_ids)} total IDs to {cache_path}")
-        return doc_ids
+        url = f"{self._DC_URL}{self._PROJECT_ID}/documents/?per_page=100&expand=document"
+        total = 0
+        newest = None
+
+        while url:
+            data = await self._api_get(session, url, stage="listing")
+            results = data.get("results", [])
+            self._ledger.save_metadata(entry["document"] for entry in results if isinstance(entry["document"], dict))
+
+            for entry in results:
+                doc = entry["document"]
+                if isinstance(doc, dict):
+                    self._ledger.record(doc["id"], EXPORT_STAGE, "listed")
+                    updated_at = doc.get("updated_at")
+                    if updated_at and (newest is None or updated_at > newest):
+                        newest = updated_at
+                else:
+                    self._ledger.record(doc, EXPORT_STAGE, "listed")
+            total += len(results)
+
+            print(f"Fetched {len(results)} more, total so far: {total}")
+
+            url = data.get("next")
+            if not url:
+                print("Reached end of document list.")
+
+        self._ledger.flush()
+        self._ledger.set_meta("dc_listed_at", datetime.now().isoformat())
+        if newest and newest > self._ledger.get_meta("dc_updated_hwm", ""):
+            self._ledger.set_meta("dc_updated_hwm", newest)
+        print(f"Listed {total} document IDs")
+        return total
+
+    # Fetch only documents created or updated after the high-water mark (the newest updated_at
+    # seen so far, in DocumentCloud's own clock). Documents already exported are reopened so
+    # their changed text is uploaded again. The mark only advances once a pass completes.
+    async def sync_dc_changes(self, session: ClientSession) -> int:
+        hwm = self._ledger.get_meta("dc_updated_hwm")
+        if hwm is None:
+            return await self.refresh_dc_doc_ids(session, force=True)
+
+        print(f"Fetching documents updated since {hwm}...")
+        query = urlencode({"project": self._PROJECT_ID, "updated_at__gt": hwm, "per_page": 100})
+        url = f"{self._API_URL}documents/?{query}"
+        newest = hwm
+        new_count = changed_count = 0
+
+        while url:
+            data = await self._api_get(session, url, stage="listing")
+            results = data.get("results", [])
+            self._ledger.save_metadata(results)
+            doc_ids = [str(doc["id"]) for doc in results]
+            not_done = set(self._ledger.filter_not_done(doc_ids, EXPORT_STAGE))
+            for doc_id in doc_ids:
+                if doc_id in not_done:
+                    self._ledger.record(doc_id, EXPORT_STAGE, "listed")
+                    new_count += 1
+                else:
+                    self._ledger.record(doc_id, EXPORT_STAGE, "changed")
+                    changed_count += 1
+            newest = max([newest, *(doc.get("updated_at") or "" for doc in results)])
+            url = data.get("next")
+
+        self._ledger.flush()
+        self._ledger.set_meta("dc_updated_hwm", newest)
+        print(f"Delta sync: {new_count} new and {changed_count} changed documents")
+        return new_count + changed_count
+
+    # Carry over resume state from the flat files earlier versions wrote
+    def _import_legacy_caches(self):
+        self._ledger.import_id_file("dc_document_ids_cache.txt", EXPORT_STAGE, "listed")
+        self._ledger.import_id_file("uploaded_ids_cache.txt", EXPORT_STAGE, "uploaded")
+        self._ledger.import_id_file("empty_docs_all.txt", EXPORT_STAGE, "empty")
+
+    # Bring the ledger up to date with S3 and DocumentCloud before enqueueing pending documents
+    async def _refresh_pending(self, session: ClientSession):
+        print("Checking S3 bucket")
+        uploaded = await self.sync_uploaded_ids_from_s3()
+        print(f"{uploaded} documents are already in the S3 bucket.")
+
+        if self._incremental and self._listing_is_fresh():
+            await self.sync_dc_changes(session)
+        else:
+            await self.refresh_dc_doc_ids(session)
 
     # main() will call this
     async def export_with_queue(self):
-        empty_path = "empty_docs_all.txt" # log documents with no texts
         queue = asyncio.Queue(maxsize=100)
+        self._import_legacy_caches()
+
+        async with ClientSession(connector=self._make_connector()) as session, self.open_async_s3():
+            await self._refresh_pending(session)
 
-        async with ClientSession() as session:
+            total_pending = min(self._ledger.count_pending(EXPORT_STAGE), self._max_documents)
 
-            print("Checking S3 bucket")
-            paginator = self._s3_client.get_paginator("list_objects_v2")
-            current_bucket = set()
+            print(f"Found {total_pending} pending documents")
+
+            consumer_tasks = [
+                asyncio.create_task(self.consumer(queue, session))
+                for _ in range(self._num_consumers)
+            ]
 
             try:
-                for page in paginator.paginate(Bucket=self._S3_BUCKET):
-                    for obj in page.get("Contents", []):
-                        key = obj["Key"]
-                        if key.endswith(".json"):
-                            doc_id = key.replace(".json", "")
-                            current_bucket.add(doc_id)
-            except Exception as e:
-                print(f"Failed to list objects in S3: {e}")
+                async with self._reporting(queue, total_pending):
+                    newly_added = 0
+                    for doc_id in self._ledger.iter_pending(EXPORT_STAGE):
+                        await queue.put((doc_id, self._ledger.get_metadata(doc_id)))
+                        newly_added += 1
+                        if newly_added >= self._max_documents:
+                            break
+
+                    print(f"Enqueued {newly_added} new documents")
+
+                    await queue.join()
+                    for _ in range(self._num_consumers):
+                        await queue.put(None)
+                    await asyncio.gather(*consumer_tasks)
+            finally:
+                self._ledger.flush()
 
-            uploaded_ids = await self.list_uploaded_ids_s3()
-            print(f"{len(current_bucket)} documents are already in the S3 bucket.")
 
-            completed_count_ref = [0]
-            completed_lock = asyncio.Lock()
+    # Keep every held lease alive; a lease that can't be renewed is dropped so its remaining
+    # documents are skipped rather than exported alongside whichever node takes the bucket over
+    async def _renew_leases(self, lease_store, owner: str, held: dict, lease_ttl: float):
+        while True:
+            await asyncio.sleep(lease_ttl / 3)
+            for bucket in list(held):
+                deadline = time.monotonic() + lease_ttl
+                if await asyncio.to_thread(lease_store.renew, bucket, owner, lease_ttl):
+                    held[bucket] = deadline
+                else:
+                    held.pop(bucket, None)
+                    print(f"Lost the lease on bucket {bucket}")
+
+    # Several nodes exporting one project: pending ids are split into num_buckets crc32 hash
+    # buckets, and a node only exports the documents of buckets it holds a lease on (see
+    # leases.py). Each node keeps its own ledger. Buckets held by other nodes are retried until
+    # they are completed, so a crashed node's work is picked up when its leases expire.
+    async def export_sharded(self, lease_store, owner=None, num_buckets=64, lease_ttl=300.0):
+        owner = owner or default_owner()
+        queue = asyncio.Queue(maxsize=100)
+        held = {}
+        self._import_legacy_caches()
 
-            dc_doc_ids = await self.load_or_fetch_dc_doc_ids(session)
-            pending_ids = dc_doc_ids - uploaded_ids
+        def holds(bucket):
+            deadline = held.get(bucket)
+            return deadline is not None and time.monotonic() < deadline
 
-            print(f"Found {len(pending_ids)} pending documents")
+        def still_owned(doc_id):
+            return holds(bucket_of(doc_id, num_buckets))
+
+        async with ClientSession(connector=self._make_connector()) as session, self.open_async_s3():
+            await self._refresh_pending(session)
+
+            # Packed 8-byte ids rather than lists of strs, for projects with millions pending
+            pending_by_bucket = defaultdict(lambda: array("Q"))
+            for doc_id in self._ledger.iter_pending(EXPORT_STAGE):
+                pending_by_bucket[bucket_of(doc_id, num_buckets)].append(int(doc_id))
+            total_pending = min(sum(len(ids) for ids in pending_by_bucket.values()), self._max_documents)
+            print(f"Node {owner}: {total_pending} pending documents across {num_buckets} buckets")
 
             consumer_tasks = [
-                asyncio.create_task(
-                    self.consumer(queue, session, empty_path, pending_ids, completed_lock, completed_count_ref)
-                )
+                asyncio.create_task(self.consumer(queue, session, still_owned))
                 for _ in range(self._num_consumers)
             ]
+            renew_task = asyncio.create_task(self._renew_leases(lease_store, owner, held, lease_ttl))
 
-            total_added = 0
-            newly_added = 0
-            for doc_id in pending_ids:
-                await queue.put(doc_id)
-                total_added += 1
-                newly_added += 1
-                if total_added >= self._max_documents:
-                    break
-
-            print(f"Enqueued {newly_added} new documents")
-
-            await queue.join()
-            for _ in range(self._num_consumers):
-                await queue.put(None)
-            await asyncio.gather(*consumer_tasks)
+            try:
+                async with self._reporting(queue, total_pending):
+                    enqueued = 0
+                    remaining = set(range(num_buckets))
+                    while remaining and enqueued < self._max_documents:
+                        remaining -= await asyncio.to_thread(lease_store.done_buckets)
+                        claimed = 0
+                        # Random order, so nodes starting together don't all contend for bucket 0
+                        for bucket in random.sample(sorted(remaining), len(remaining)):
+                            if enqueued >= self._max_documents:
+                                break
+                            deadline = time.monotonic() + lease_ttl
+                            if not await asyncio.to_thread(lease_store.acquire, bucket, owner, lease_ttl):
+                                continue
+                            held[bucket] = deadline
+                            claimed += 1
+
+                            # A bucket released earlier may already be partly exported by this node
+                            doc_ids = self._ledger.filter_not_done(pending_by_bucket.get(bucket, []), EXPORT_STAGE)
+                            all_enqueued = True
+                            for doc_id in doc_ids:
+                                if not holds(bucket) or enqueued >= self._max_documents:
+                                    all_enqueued = False
+                                    break
+                                await queue.put((doc_id, self._ledger.get_metadata(doc_id)))
+                                enqueued += 1
+                            await queue.join()
+                            self._ledger.flush()
+
+                            # A completed bucket is never handed out again in the epoch, so one
+                            # with failed documents is released for another node (or a rerun) to
+                            # retry; this node doesn't take it again
+                            failed = len(self._ledger.filter_not_done(doc_ids, EXPORT_STAGE)) if all_enqueued else 0
+                            finished = all_enqueued and holds(bucket) and not failed
+                            held.pop(bucket, None)
+                            if finished:
+                                if await asyncio.to_thread(lease_store.complete, bucket, owner):
+                                    remaining.discard(bucket)
+                                    print(f"Completed bucket {bucket} ({len(doc_ids)} documents)")
+                                else:
+                                    print(f"Lost the lease on bucket {bucket} before completing it")
+                            else:
+                                await asyncio.to_thread(lease_store.release, bucket, owner)
+                                if failed:
+                                    remaining.discard(bucket)
+                                    print(f"Released bucket {bucket} with {failed} failed documents")
+                                else:
+                                    print(f"Released bucket {bucket} unfinished")
+
+                        # Everything left is leased by other nodes: wait for them to finish or expire
+                        if remaining and not claimed:
+                            await asyncio.sleep(lease_ttl / 4)
+
+                    print(f"Node {owner} enqueued {enqueued} documents")
+                    for _ in range(self._num_consumers):
+                        await queue.put(None)
+                    await asyncio.gather(*consumer_tasks)
+            finally:
+                renew_task.cancel()
+                for bucket in list(held):
+                    await asyncio.to_thread(lease_store.release, bucket, owner)
+                self._ledger.flush()
@@ -0,0 +1,160 @@
+import codecs
+import json
+import re
+
+# Incremental reading of exported document bundles, {"doc_id", "metadata", "text_json"}, without
+# materializing the whole object: the header comes from the first few KB, and pages are decoded
+# one at a time from text_json.pages. Bundles laid out differently still parse, just less lazily.
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def _skip_ws(text: str, i: int) -> int:
+    return _WHITESPACE.match(text, i).end()
+
+
+def _expect(text: str, i: int, char: str) -> int:
+    i = _skip_ws(text, i)
+    if text[i:i + 1] != char:
+        raise ValueError(f"Expected {char!r} at offset {i}")
+    return i + 1
+
+
+# Walk the object starting at i. Members are decoded into `found` until `key` is reached, whose
+# value offset is returned; stops early (returning None) once every name in `wanted` is found.
+def _find_member(text: str, i: int, key: str | None, found: dict | None = None, wanted=()) -> int | None:
+    i = _skip_ws(text, _expect(text, i, "{"))
+    if text[i:i + 1] == "}":
+        return None
+    while True:
+        name, i = _decoder.raw_decode(text, i)
+        i = _skip_ws(text, _expect(text, i, ":"))
+        if name == key:
+            return i
+        value, i = _decoder.raw_decode(text, i)
+        # Check the delimiter first: a number cut off at the end of a prefix still decodes
+        i = _skip_ws(text, i)
+        delimiter = text[i:i + 1]
+        if delimiter not in (",", "}"):
+            raise ValueError(f"Expected ',' or '}}' at offset {i}")
+        if found is not None:
+            found[name] = value
+            if wanted and all(w in found for w in wanted):
+                return None
+        if delimiter == "}":
+            return None
+        i = _skip_ws(text, i + 1)
+
+
+def _header_from_text(text: str) -> tuple:
+    found = {}
+    if _find_member(text, 0, "text_json", found, wanted=("doc_id", "metadata")) is not None:
+        # text_json came first: fall back to decoding everything
+        found = json.loads(text)
+    return found.get("doc_id"), found.get("metadata", {})
+
+
+# doc_id and metadata of a bundle. Only a prefix of the body is decoded, doubling it until the
+# header fits, so this is cheap on the event loop even for documents with thousands of pages.
+def read_header(body: bytes | str, prefix_bytes: int = 64 << 10) -> tuple:
+    if isinstance(body, str):
+        return _header_from_text(body)
+    size = prefix_bytes
+    while size < len(body):
+        # A multi-byte character cut at the end of the prefix is dropped; the header ends sooner
+        try:
+            return _header_from_text(body[:size].decode("utf-8", errors="ignore"))
+        except (ValueError, IndexError):
+            size *= 2
+    return _header_from_text(body.decode("utf-8"))
+
+
+# Byte offset just past the "[" of text_json.pages, found by parsing a growing prefix. A prefix
+# that ends before the answer is known is grown; None means the whole body has no pages.
+def _pages_offset(body: bytes, prefix_bytes: int) -> int | None:
+    size = prefix_bytes
+    while True:
+        text = body[:size].decode("utf-8", errors="ignore")
+        try:
+            start = _find_member(text, 0, "text_json")
+            if start is None:
+                return None
+            start = _skip_ws(text, start)
+            if start >= len(text):
+                raise IndexError("The prefix ends before the value of text_json")
+            if text[start] != "{":
+                return None
+            start = _find_member(text, start, "pages")
+            if start is None:
+                return None
+            return len(text[:_expect(text, start, "[")].encode("utf-8"))
+        except (ValueError, IndexError):
+            if size >= len(body):
+                raise
+            size *= 2
+
+
+class _WindowedText:
+    # Decodes a UTF-8 body window by window, so the full body is never held as a str
+    def __init__(self, body: bytes, start: int, window: int):
+        self._body = memoryview(body)
+        self._cursor = start
+        self._window = window
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+
+    # Drop text before i, append the next window; returns False at the end of the body
+    def extend(self, i: int) -> bool:
+        if self._cursor >= len(self._body):
+            return False
+        end = self._cursor + self._window
+        self.text = self.text[i:] + self._decoder.decode(self._body[self._cursor:end], final=end >= len(self._body))
+        self._cursor = end
+        return True
+
+
+# The page objects of text_json.pages, decoded one at a time in file order. Bytes are decoded a
+# window at a time, so memory stays at the body plus about one window however many pages it has.
+def iter_pages(body: bytes | str, window: int = 1 << 20, prefix_bytes: int = 64 << 10):
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    start = _pages_offset(body, prefix_bytes)
+    if start is None:
+        return
+    buf = _WindowedText(body, start, window)
+    i = 0
+    expect_value = True
+    while True:
+        i = _skip_ws(buf.text, i)
+        if i >= len(buf.text):
+            if not buf.extend(i):
+                raise ValueError("text_json.pages is not terminated")
+            i = 0
+            continue
+        char = buf.text[i]
+        if char == "]":
+            return
+        if expect_value:
+            try:
+                page, i = _decoder.raw_decode(buf.text, i)
+            except json.JSONDecodeError:
+                # The page runs past the decoded window (pages are objects, so a cut one never parses)
+                if not buf.extend(i):
+                    raise
+                i = 0
+                continue
+            yield page
+            expect_value = False
+        elif char == ",":
+            i += 1
+            expect_value = True
+        else:
+            raise ValueError(f"Expected ',' or ']' in text_json.pages, got {char!r}")
+
+
+# Put per-page values back in order of their "page" field. The sort is stable, so pages with
+# equal numbers keep their file order.
+def in_page_order(page_numbers: list, values: list) -> list:
+    order = sorted(range(len(values)), key=lambda j: page_numbers[j])
+    return [values[j] for j in order]
@@ -0,0 +1,269 @@
+import argparse
+import math
+import os
+import re
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Reference-based scores of generated summaries (the `output` column of simulate_data's CSV)
+# against `ground_truth`: ROUGE-1, ROUGE-2 and ROUGE-L F1, sentence BLEU-4 and METEOR, per row,
+# plus their means and corpus BLEU with bootstrap confidence intervals.
+#
+# Each text is tokenized once and its 1- to 4-gram counts are built once; ROUGE-1/2, BLEU and
+# METEOR all read from the same counts, and ROUGE-L runs a bit-parallel LCS over the same words.
+# Rows are scored in batches on a process pool, and each batch also returns its share of the
+# bootstrap: Poisson(1) weights per row and resample, so resamples never need every row in memory.
+# Per-row scores are streamed to a Parquet file as the batches come back, in input order.
+#
+# METEOR is the exact-match variant (no stemming or synonym stages), with the usual
+# Fmean = 10PR / (R + 9P) and fragmentation penalty 0.5 * (chunks / matches)^3.
+MAX_N = 4
+METRICS = ("rouge1", "rouge2", "rougeL", "bleu", "meteor")
+# Per-row columns after the metrics: clipped n-gram matches and candidate n-grams for n = 1..4,
+# then candidate and reference length, which is all corpus BLEU needs
+_MATCHES = len(METRICS)
+_TOTALS = _MATCHES + MAX_N
+_CANDIDATE_WORDS = _TOTALS + MAX_N
+_REFERENCE_WORDS = _CANDIDATE_WORDS + 1
+_COLUMNS = _REFERENCE_WORDS + 1
+
+SCORES_SCHEMA = pa.schema(
+    [("row", pa.int64())]
+    + [(metric, pa.float32()) for metric in METRICS]
+    + [("candidate_words", pa.int32()), ("reference_words", pa.int32())]
+)
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text) -> list[str]:
+    return _WORD.findall(text.lower()) if isinstance(text, str) else []
+
+
+def ngram_counts(words: list[str], max_n: int = MAX_N) -> list[Counter]:
+    return [Counter(zip(*(words[i:] for i in range(n)))) for n in range(1, max_n + 1)]
+
+
+def _overlap(a: Counter, b: Counter) -> int:
+    return sum(min(a[gram], b[gram]) for gram in a.keys() & b.keys())
+
+
+def _f1(matches: int, candidate: int, reference: int) -> float:
+    return 2 * matches / (candidate + reference) if matches else 0.0
+
+
+# Length of the longest common subsequence, bit-parallel over the reference positions
+# (Allison-Dix / Hyyrö): one big-int update per candidate word instead of a row of the DP table
+def lcs_length(candidate: list[str], reference: list[str]) -> int:
+    if not candidate or not reference:
+        return 0
+    positions = {}
+    for i, word in enumerate(reference):
+        positions[word] = positions.get(word, 0) | (1 << i)
+    mask = (1 << len(reference)) - 1
+    v = mask
+    for word in candidate:
+        u = v & positions.get(word, 0)
+        v = ((v + u) | (v - u)) & mask
+    return len(reference) - v.bit_count()
+
+
+# Sentence BLEU-4 with add-one smoothing of the 2- to 4-gram precisions (Lin & Och, 2004)
+def _sentence_bleu(matches, totals, candidate_len: int, reference_len: int) -> float:
+    if not candidate_len or not matches[0]:
+        return 0.0
+    log_precision = math.log(matches[0] / totals[0])
+    for n in range(1, MAX_N):
+        log_precision += math.log((matches[n] + 1) / (totals[n] + 1))
+    brevity = min(0.0, 1 - reference_len / candidate_len)
+    return math.exp(brevity + log_precision / MAX_N)
+
+
+# Exact-match METEOR: each candidate word aligned to the earliest unused equal reference word,
+# chunks counted as runs that are contiguous in both texts
+def _meteor(candidate: list[str], reference: list[str], matches: int) -> float:
+    if not matches:
+        return 0.0
+    slots = {}
+    for i, word in enumerate(reference):
+        slots.setdefault(word, []).append(i)
+    slots = {word: iter(positions) for word, positions in slots.items()}
+    chunks = 0
+    previous = -2
+    for word in candidate:
+        position = next(slots[word], None) if word in slots else None
+        if position is None:
+            previous = -2
+            continue
+        if position != previous + 1:
+            chunks += 1
+        previous = position
+    precision = matches / len(candidate)
+    recall = matches / len(reference)
+    fmean = 10 * precision * recall / (recall + 9 * precision)
+    return fmean * (1 - 0.5 * (chunks / matches) ** 3)
+
+
+def score_pair(candidate_text, reference_text) -> list[float]:
+    candidate = tokenize(candidate_text)
+    reference = tokenize(reference_text)
+    candidate_grams = ngram_counts(candidate)
+    reference_grams = ngram_counts(reference)
+    matches = [_overlap(c, r) for c, r in zip(candidate_grams, reference_grams)]
+    totals = [max(0, len(candidate) - n) for n in range(MAX_N)]
+    reference_totals = [max(0, len(reference) - n) for n in range(MAX_N)]
+    lcs = lcs_length(candidate, reference)
+    return [
+        _f1(matches[0], totals[0], reference_totals[0]),
+        _f1(matches[1], totals[1], reference_totals[1]),
+        _f1(lcs, len(candidate), len(reference)),
+        _sentence_bleu(matches, totals, len(candidate), len(reference)),
+        _meteor(candidate, reference, matches[0]),
+        *matches,
+        *totals,
+        len(candidate),
+        len(reference),
+    ]
+
+
+# Pool task: per-row columns of one batch, with the batch's column sums and its Poisson bootstrap
+# sums (resamples x columns, and the weight total per resample). The weights are seeded by batch
+# index, so results do not depend on the number of workers.
+def score_batch(batch_index: int, candidates: list, references: list, resamples: int, seed: int):
+    scores = np.array([score_pair(c, r) for c, r in zip(candidates, references)], dtype=np.float64)
+    scores = scores.reshape(len(candidates), _COLUMNS)
+    weights = np.random.default_rng([seed, batch_index]).poisson(1.0, (resamples, len(scores))).astype(np.float64)
+    return scores, scores.sum(axis=0), weights @ scores, weights.sum(axis=1)
+
+
+def _corpus_bleu(sums: np.ndarray) -> np.ndarray:
+    # sums: (..., _COLUMNS) column totals of a corpus or of each bootstrap resample
+    matches = sums[..., _MATCHES:_TOTALS]
+    totals = sums[..., _TOTALS:_CANDIDATE_WORDS]
+    candidate_len = sums[..., _CANDIDATE_WORDS]
+    reference_len = sums[..., _REFERENCE_WORDS]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_precision = np.log(matches / totals).mean(axis=-1)
+        brevity = np.minimum(0.0, 1 - reference_len / candidate_len)
+        bleu = np.exp(brevity + log_precision)
+    return np.nan_to_num(bleu)
+
+
+# Means of every metric plus corpus BLEU, with percentile bootstrap intervals
+def summarize_scores(rows: int, sums: np.ndarray, boot_sums: np.ndarray, boot_weights: np.ndarray,
+                     confidence: float = 0.95) -> pd.DataFrame:
+    tail = (1 - confidence) / 2 * 100
+    points = list(sums[:len(METRICS)] / max(rows, 1)) + [_corpus_bleu(sums)]
+    replicates = boot_sums[:, :len(METRICS)] / np.maximum(boot_weights, 1)[:, None]
+    replicates = np.column_stack([replicates, _corpus_bleu(boot_sums)])
+    if len(replicates):
+        low, high = np.percentile(replicates, [tail, 100 - tail], axis=0)
+    else:
+        low = high = np.full(len(points), np.nan)
+    return pd.DataFrame({
+        "metric": [f"{metric}_mean" for metric in METRICS] + ["corpus_bleu"],
+        "value": np.asarray(points, dtype=np.float64),
+        "ci_low": low,
+        "ci_high": high,
+        "rows": rows,
+    })
+
+
+def _read_batches(csv_path, output_column: str, reference_column: str, batch_rows: int):
+    reader = pd.read_csv(
+        csv_path, usecols=[output_column, reference_column], dtype=str, keep_default_na=False, chunksize=batch_rows
+    )
+    for chunk in reader:
+        yield chunk[output_column].tolist(), chunk[reference_column].tolist()
+
+
+def evaluate_csv(
+    csv_path="data/00-simulated_data.csv",
+    scores_path="data/evaluation/scores.parquet",
+    summary_path="data/evaluation/summary.parquet",
+    output_column: str = "output",
+    reference_column: str = "ground_truth",
+    workers: int | None = None,
+    batch_rows: int = 5000,
+    resamples: int = 200,
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> pd.DataFrame:
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(os.path.dirname(scores_path) or ".", exist_ok=True)
+    os.makedirs(os.path.dirname(summary_path) or ".", exist_ok=True)
+    rows = 0
+    sums = np.zeros(_COLUMNS)
+    boot_sums = np.zeros((resamples, _COLUMNS))
+    boot_weights = np.zeros(resamples)
+    tmp = f"{scores_path}.tmp"
+
+    def write(writer, result):
+        nonlocal rows, sums, boot_sums, boot_weights
+        scores, batch_sums, batch_boot_sums, batch_boot_weights = result
+        columns = {"row": np.arange(rows, rows + len(scores))}
+        columns.update((metric, scores[:, i]) for i, metric in enumerate(METRICS))
+        columns["candidate_words"] = scores[:, _CANDIDATE_WORDS]
+        columns["reference_words"] = scores[:, _REFERENCE_WORDS]
+        writer.write_table(pa.Table.from_pydict(columns).cast(SCORES_SCHEMA))
+        rows += len(scores)
+        sums += batch_sums
+        boot_sums += batch_boot_sums
+        boot_weights += batch_boot_weights
+
+    batches = _read_batches(csv_path, output_column, reference_column, batch_rows)
+    with pq.ParquetWriter(tmp, SCORES_SCHEMA, compression="zstd") as writer:
+        if workers <= 1:
+            for index, (candidates, references) in enumerate(batches):
+                write(writer, score_batch(index, candidates, references, resamples, seed))
+        else:
+            # At most two batches per worker in flight; results are written in submission order
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = deque()
+                for index, (candidates, references) in enumerate(batches):
+                    pending.append(pool.submit(score_batch, index, candidates, references, resamples, seed))
+                    if len(pending) >= 2 * workers:
+                        write(writer, pending.popleft().result())
+                while pending:
+                    write(writer, pending.popleft().result())
+    os.replace(tmp, scores_path)
+
+    summary = summarize_scores(rows, sums, boot_sums, boot_weights, confidence)
+    summary.to_parquet(summary_path, index=False)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score generated summaries against ground truth")
+    parser.add_argument("csv", nargs="?", default="data/00-simulated_data.csv")
+    parser.add_argument("--scores-out", default="data/evaluation/scores.parquet")
+    parser.add_argument("--summary-out", default="data/evaluation/summary.parquet")
+    parser.add_argument("--output-column", default="output")
+    parser.add_argument("--reference-column", default="ground_truth")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-rows", type=int, default=5000)
+    parser.add_argument("--resamples", type=int, default=200, help="bootstrap resamples for the intervals")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    args = parser.parse_args()
+
+    summary = evaluate_csv(
+        args.csv,
+        args.scores_out,
+        args.summary_out,
+        output_column=args.output_column,
+        reference_column=args.reference_column,
+        workers=args.workers,
+        batch_rows=args.batch_rows,
+        resamples=args.resamples,
+        confidence=args.confidence,
+    )
+    print(summary.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
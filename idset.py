@@ -0,0 +1,137 @@
+import os
+from pathlib import Path
+
+import numpy as np
+
+# Sets of integer document ids kept as sorted uint64 arrays: 8 bytes an id instead of the ~80 a
+# str costs in a Python set, and membership or difference for millions of ids as vectorized
+# binary searches. save() writes a .npy that open() memory-maps, so reopening a saved set reads
+# nothing up front. Ids added after that are appended to a .log file next to it (raw uint64s,
+# safe to append to while the set is in use; a torn tail is dropped on replay) and folded into
+# the .npy by the next save().
+#
+# In memory the set is a few disjoint sorted runs, merged whenever a newer run grows to half
+# the size of the one before it, so adding in small batches stays cheap.
+
+_EMPTY = np.empty(0, dtype=np.uint64)
+
+
+# Ints, numeric strs, or an array of either as a uint64 array. Anything else (non-numeric or
+# negative ids) raises ValueError, for callers to fall back to exact string matching.
+def as_ids(doc_ids) -> np.ndarray:
+    if not isinstance(doc_ids, np.ndarray):
+        doc_ids = np.asarray(doc_ids if isinstance(doc_ids, (list, tuple)) else list(doc_ids))
+    if not len(doc_ids):
+        return _EMPTY
+    if doc_ids.dtype == np.uint64:
+        return doc_ids
+    if doc_ids.dtype.kind == "i" and doc_ids.min() < 0:
+        raise ValueError("Document ids must not be negative")
+    try:
+        return doc_ids.astype(np.uint64)
+    except OverflowError as e:
+        raise ValueError(str(e)) from e
+
+
+# np.unique, by sorting: much faster than np.unique on large integer arrays here
+def _sorted_unique(values: np.ndarray) -> np.ndarray:
+    values = np.sort(values)
+    if len(values) < 2:
+        return values
+    keep = np.empty(len(values), dtype=bool)
+    keep[0] = True
+    np.not_equal(values[1:], values[:-1], out=keep[1:])
+    return values[keep]
+
+
+def _isin_sorted(sorted_ids: np.ndarray, values: np.ndarray) -> np.ndarray:
+    if not len(sorted_ids):
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(sorted_ids, values)
+    np.minimum(positions, len(sorted_ids) - 1, out=positions)
+    return sorted_ids[positions] == values
+
+
+class IdSet:
+    def __init__(self, sorted_ids: np.ndarray = _EMPTY, path=None):
+        self._runs = [sorted_ids] if len(sorted_ids) else []
+        self.path = Path(path) if path else None
+
+    @classmethod
+    def from_ids(cls, doc_ids, path=None) -> "IdSet":
+        return cls(_sorted_unique(as_ids(doc_ids)), path)
+
+    # The saved set memory-mapped, plus whatever was appended to its log since
+    @classmethod
+    def open(cls, path) -> "IdSet":
+        path = Path(path)
+        ids = cls(np.load(path, mmap_mode="r") if path.exists() else _EMPTY, path)
+        log_path = ids.log_path
+        if log_path.exists():
+            data = log_path.read_bytes()
+            logged = _sorted_unique(np.frombuffer(data[:len(data) - len(data) % 8], dtype=np.uint64))
+            ids._add(logged[~ids.contains(logged)])
+        return ids
+
+    @property
+    def log_path(self) -> Path:
+        return self.path.with_suffix(".log")
+
+    def __len__(self) -> int:
+        return sum(len(run) for run in self._runs)
+
+    def __contains__(self, doc_id) -> bool:
+        try:
+            return bool(self.contains([doc_id])[0])
+        except ValueError:
+            return False
+
+    # Element-wise membership of doc_ids, as a bool array
+    def contains(self, doc_ids) -> np.ndarray:
+        values = as_ids(doc_ids)
+        mask = np.zeros(len(values), dtype=bool)
+        for run in self._runs:
+            mask |= _isin_sorted(run, values)
+        return mask
+
+    # The doc_ids not in the set, in their original order
+    def difference(self, doc_ids) -> np.ndarray:
+        values = as_ids(doc_ids)
+        return values[~self.contains(values)]
+
+    # Adds ids, appending the new ones to the log when the set has a path. Returns how many
+    # weren't in the set already.
+    def add(self, doc_ids) -> int:
+        values = _sorted_unique(as_ids(doc_ids))
+        values = values[~self.contains(values)]
+        if len(values) and self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.log_path, "ab") as f:
+                f.write(values.tobytes())
+        self._add(values)
+        return len(values)
+
+    def _add(self, sorted_ids: np.ndarray):
+        if not len(sorted_ids):
+            return
+        self._runs.append(sorted_ids)
+        while len(self._runs) > 1 and len(self._runs[-2]) <= 2 * len(self._runs[-1]):
+            newer = self._runs.pop()
+            self._runs[-1] = _sorted_unique(np.concatenate([self._runs[-1], newer]))
+
+    def to_array(self) -> np.ndarray:
+        if len(self._runs) == 1:
+            return self._runs[0]
+        return _sorted_unique(np.concatenate(self._runs)) if self._runs else _EMPTY
+
+    # Writes the whole set as one .npy (atomically) and empties the log
+    def save(self, path=None):
+        self.path = Path(path) if path else self.path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        merged = np.ascontiguousarray(self.to_array())
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, merged)
+        os.replace(tmp, self.path)
+        self.log_path.unlink(missing_ok=True)
+        self._runs = [np.load(self.path, mmap_mode="r")] if len(merged) else []
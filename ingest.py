@@ -0,0 +1,52 @@
+import asyncio
+
+# Export and stats in one pass. Every document the exporter uploads is also handed, as the same
+# uncompressed payload, to the collector's tokenizer pool, so nothing is downloaded back from S3
+# and the stats rows are written in the same run. The bounded queue between the two applies
+# backpressure: when tokenizing falls behind, the export consumers wait rather than buffering.
+#
+# Only documents exported by this run are tokenized here; ones exported earlier but not yet
+# tokenized are picked up by a plain collector run (the "stats" stage in main.py).
+
+
+async def export_and_collect(exporter, collector, queue_size: int = 64):
+    queue = asyncio.Queue(maxsize=queue_size)
+
+    async def tee(doc_id, payload: bytes):
+        await queue.put((doc_id, payload))
+
+    # Documents re-exported after a change keep the stats they already have, as in a plain run.
+    # Whatever is queued is checked against the ledger as one batch.
+    async def exported_docs():
+        finished = False
+        while not finished:
+            batch = [await queue.get()]
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+            if None in batch:
+                finished = True
+                batch = batch[:batch.index(None)]
+            payloads = dict(batch)
+            for doc_id in collector.filter_untokenized(payloads):
+                yield doc_id, payloads[doc_id]
+
+    exporter.tee = tee
+    export = asyncio.create_task(exporter.export_with_queue())
+    stats = asyncio.create_task(collector.process_documents_async(exported_docs()))
+    try:
+        done, _ = await asyncio.wait({export, stats}, return_when=asyncio.FIRST_COMPLETED)
+        # The stats side only finishes first if it failed or was cancelled; the export would
+        # block on the tee. An export that failed too raises its own error first.
+        if stats in done:
+            if export.done():
+                export.result()
+            await stats
+            raise RuntimeError("Tokenizing stopped before the export finished")
+        export.result()
+        await queue.put(None)
+        await stats
+    finally:
+        exporter.tee = None
+        for task in (export, stats):
+            task.cancel()
+        await asyncio.gather(export, stats, return_exceptions=True)
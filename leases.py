@@ -0,0 +1,189 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from pathlib import Path
+from urllib.parse import urlparse
+
+import boto3
+from botocore.exceptions import ClientError
+
+# Lease stores hand out hash buckets of document ids to exporter nodes. A lease is held until
+# expires_at (wall clock, so node clocks should agree to well within the ttl) and renewed while
+# the node works; a crashed node's buckets become claimable again once its leases expire.
+# Leases belong to an epoch, one pass over the project shared by every node of a run: completed
+# buckets are never handed out again within it, and a later run with a new epoch starts over
+# with every bucket open (each node's ledger still skips what is already exported).
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    epoch TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (epoch, bucket)
+);
+"""
+
+# Claims a free, expired or already-owned bucket in one statement
+_SQLITE_ACQUIRE = """
+INSERT INTO leases (epoch, bucket, owner, expires_at, done) VALUES (?, ?, ?, ?, 0)
+ON CONFLICT (epoch, bucket) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+WHERE leases.done = 0 AND (leases.owner = excluded.owner OR leases.expires_at < ?)
+"""
+
+# S3 answers a failed If-Match/If-None-Match with 412, or 409 when two conditional writes race
+_CONFLICT_CODES = ("PreconditionFailed", "ConditionalRequestConflict")
+
+
+def bucket_of(doc_id, num_buckets: int) -> int:
+    return zlib.crc32(str(doc_id).encode()) % num_buckets
+
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+class SQLiteLeaseStore:
+    # Leases in a SQLite file, for several exporter processes on one machine (or a shared disk).
+    # The exporter calls it from worker threads, so the connection is shared under a lock.
+    def __init__(self, path="data/leases.sqlite3", epoch: str = ""):
+        self.path = Path(path)
+        self.epoch = epoch
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, isolation_level=None, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SQLITE_SCHEMA)
+        self._lock = threading.Lock()
+
+    def _execute(self, query: str, params=()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn.execute(query, params)
+
+    def acquire(self, bucket: int, owner: str, ttl: float) -> bool:
+        now = time.time()
+        return self._execute(_SQLITE_ACQUIRE, (self.epoch, bucket, owner, now + ttl, now)).rowcount == 1
+
+    def renew(self, bucket: int, owner: str, ttl: float) -> bool:
+        return self._execute(
+            "UPDATE leases SET expires_at = ? WHERE epoch = ? AND bucket = ? AND owner = ? AND done = 0",
+            (time.time() + ttl, self.epoch, bucket, owner),
+        ).rowcount == 1
+
+    def complete(self, bucket: int, owner: str) -> bool:
+        return self._execute(
+            "UPDATE leases SET done = 1 WHERE epoch = ? AND bucket = ? AND owner = ? AND done = 0",
+            (self.epoch, bucket, owner),
+        ).rowcount == 1
+
+    def release(self, bucket: int, owner: str):
+        self._execute(
+            "UPDATE leases SET expires_at = 0 WHERE epoch = ? AND bucket = ? AND owner = ? AND done = 0",
+            (self.epoch, bucket, owner),
+        )
+
+    def done_buckets(self) -> set[int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT bucket FROM leases WHERE epoch = ? AND done = 1", (self.epoch,))
+            return {row[0] for row in rows}
+
+    def close(self):
+        self._conn.close()
+
+
+class S3LeaseStore:
+    # One small JSON object per bucket, updated with conditional writes: If-None-Match: * to
+    # create a lease, If-Match: <etag> to take over or renew one, so of two nodes racing for a
+    # bucket exactly one write succeeds. Completed buckets also get a marker under done/ so
+    # done_buckets is a single listing. Each epoch has its own folder under prefix.
+    def __init__(self, bucket_name: str, prefix: str = "leases/", client=None, epoch: str = ""):
+        self.bucket_name = bucket_name
+        self.epoch = epoch
+        self.prefix = f"{prefix}{epoch}/" if epoch else prefix
+        self._s3 = client or boto3.client("s3", region_name=os.environ.get("AWS_REGION"))
+
+    def _key(self, bucket: int) -> str:
+        return f"{self.prefix}bucket-{bucket:05d}.json"
+
+    def _read(self, bucket: int) -> tuple[dict | None, str | None]:
+        try:
+            res = self._s3.get_object(Bucket=self.bucket_name, Key=self._key(bucket))
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchKey":
+                return None, None
+            raise
+        return json.loads(res["Body"].read()), res["ETag"]
+
+    def _write(self, bucket: int, lease: dict, etag: str | None) -> bool:
+        condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+        try:
+            self._s3.put_object(
+                Bucket=self.bucket_name,
+                Key=self._key(bucket),
+                Body=json.dumps(lease).encode(),
+                ContentType="application/json",
+                **condition,
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in _CONFLICT_CODES:
+                return False
+            raise
+        return True
+
+    def acquire(self, bucket: int, owner: str, ttl: float) -> bool:
+        lease, etag = self._read(bucket)
+        now = time.time()
+        if lease and (lease["done"] or (lease["owner"] != owner and lease["expires_at"] >= now)):
+            return False
+        return self._write(bucket, {"owner": owner, "expires_at": now + ttl, "done": False}, etag)
+
+    # A conflict here may just be this node's own renewal racing a complete or release, so
+    # re-read and retry for as long as the lease is still ours
+    def _update_own(self, bucket: int, owner: str, attempts: int = 5, **changes) -> bool:
+        for _ in range(attempts):
+            lease, etag = self._read(bucket)
+            if not lease or lease["owner"] != owner or lease["done"]:
+                return False
+            if self._write(bucket, {**lease, **changes}, etag):
+                return True
+        return False
+
+    def renew(self, bucket: int, owner: str, ttl: float) -> bool:
+        return self._update_own(bucket, owner, expires_at=time.time() + ttl)
+
+    def complete(self, bucket: int, owner: str) -> bool:
+        if not self._update_own(bucket, owner, done=True):
+            return False
+        self._s3.put_object(Bucket=self.bucket_name, Key=f"{self.prefix}done/{bucket:05d}", Body=owner.encode())
+        return True
+
+    def release(self, bucket: int, owner: str):
+        self._update_own(bucket, owner, expires_at=0)
+
+    def done_buckets(self) -> set[int]:
+        done = set()
+        paginator = self._s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=f"{self.prefix}done/"):
+            done.update(int(obj["Key"].rsplit("/", 1)[1]) for obj in page.get("Contents", []))
+        return done
+
+    def close(self):
+        pass
+
+
+# sqlite:///relative/leases.sqlite3, sqlite:////absolute/leases.sqlite3 or s3://bucket/prefix/
+def open_lease_store(url: str, epoch: str = ""):
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        return SQLiteLeaseStore(parsed.path[1:], epoch=epoch)
+    if parsed.scheme == "s3":
+        prefix = parsed.path.lstrip("/")
+        if prefix and not prefix.endswith("/"):
+            prefix += "/"
+        return S3LeaseStore(parsed.netloc, prefix or "leases/", epoch=epoch)
+    raise ValueError(f"Unknown lease store: {url}")
@@ -0,0 +1,324 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+from idset import IdSet
+
+# Per-stage document states: listed, fetched, uploaded, empty, tokenized, summarized, failed, and
+# changed for documents a delta sync found updated after export. "listed" rows never overwrite a
+# later state, so re-listing a project only adds new documents.
+EXPORT_STAGE = "export"
+STATS_STAGE = "stats"
+SUMMARY_STAGE = "summary"
+DONE_STATES = {
+    EXPORT_STAGE: ("uploaded", "empty"),
+    STATS_STAGE: ("tokenized",),
+    SUMMARY_STAGE: ("summarized", "empty"),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS doc_state (
+    doc_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    state TEXT NOT NULL,
+    error_count INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (doc_id, stage)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS doc_state_by_state ON doc_state (stage, state, doc_id);
+CREATE TABLE IF NOT EXISTS doc_metadata (
+    doc_id TEXT PRIMARY KEY,
+    metadata TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_UPSERT = """
+INSERT INTO doc_state (doc_id, stage, state, error_count, last_error, created_at, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (doc_id, stage) DO UPDATE SET
+    state = excluded.state,
+    error_count = doc_state.error_count + excluded.error_count,
+    last_error = COALESCE(excluded.last_error, doc_state.last_error),
+    updated_at = excluded.updated_at
+WHERE excluded.state != 'listed'
+"""
+
+
+class JobLedger:
+    # SQLite (WAL) record of every document's state per stage. Writes are buffered and committed
+    # in one transaction every batch_size records or flush_interval seconds.
+    def __init__(self, path="data/ledger.sqlite3", batch_size: int = 1000, flush_interval: float = 5.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        # Per stage, (version, IdSet of done ids or None if the ids aren't all integers); see done_ids.
+        # Versions are qualified by this ledger's id, so a recreated ledger never matches old snapshots.
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('ledger_id', ?)", (uuid.uuid4().hex,))
+        self._ledger_id = self.get_meta("ledger_id")
+        self._ids_dir = self.path.parent / f"{self.path.stem}_ids"
+        self._id_sets = {}
+
+    def record(self, doc_id, stage: str, state: str, error: str | None = None):
+        now = time.time()
+        self._buffer.append((str(doc_id), stage, state, 1 if error else 0, error, now, now))
+        if len(self._buffer) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def record_many(self, doc_ids, stage: str, state: str):
+        for doc_id in doc_ids:
+            self.record(doc_id, stage, state)
+
+    # Also bumps the version of every stage written, so done_ids snapshots can tell they're stale
+    def flush(self):
+        if self._buffer:
+            stages = sorted({row[1] for row in self._buffer})
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(_UPSERT, self._buffer)
+                self._conn.executemany(
+                    "INSERT INTO meta (key, value) VALUES (?, '1') "
+                    "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+                    [(f"version:{stage}",) for stage in stages],
+                )
+                versions = {stage: self._stage_version(stage) for stage in stages}
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            self._update_id_sets(self._buffer, versions)
+            self._buffer = []
+        self._last_flush = time.monotonic()
+
+    # Carry just-committed rows into the open done-id sets. A stage whose rows took a done
+    # document out of its done states (a changed export) is rebuilt on its next use instead.
+    def _update_id_sets(self, rows, versions: dict):
+        for stage, version in versions.items():
+            cached = self._id_sets.get(stage)
+            if cached is None:
+                continue
+            if cached[1] is None:
+                self._id_sets[stage] = (version, None)
+                continue
+            ids = cached[1]
+            done_states = DONE_STATES.get(stage, ())
+            done = [row[0] for row in rows if row[1] == stage and row[2] in done_states]
+            not_done = [row[0] for row in rows if row[1] == stage and row[2] not in done_states]
+            try:
+                if not_done and ids.contains(not_done).any():
+                    raise ValueError("done ids left their done states")
+                ids.add(done)
+            except ValueError:
+                del self._id_sets[stage]
+                self._ids_version_path(stage).unlink(missing_ok=True)
+                continue
+            self._id_sets[stage] = (version, ids)
+            self._write_ids_version(stage, version)
+
+    # Reads through the unflushed buffer instead of committing it on every lookup. A buffered
+    # "listed" row only counts if the table has no state for the document yet, as in _UPSERT.
+    def state(self, doc_id, stage: str) -> str | None:
+        doc_id = str(doc_id)
+        listed = False
+        for row in reversed(self._buffer):
+            if row[0] == doc_id and row[1] == stage:
+                if row[2] != "listed":
+                    return row[2]
+                listed = True
+        row = self._conn.execute(
+            "SELECT state FROM doc_state WHERE doc_id = ? AND stage = ?", (doc_id, stage)
+        ).fetchone()
+        return row[0] if row else "listed" if listed else None
+
+    def is_done(self, doc_id, stage: str) -> bool:
+        return self.state(doc_id, stage) in DONE_STATES[stage]
+
+    def _stage_version(self, stage: str) -> str:
+        return f"{self._ledger_id}:{self.get_meta(f'version:{stage}', '0')}"
+
+    def _ids_version_path(self, stage: str) -> Path:
+        return self._ids_dir / f"{stage}.version"
+
+    def _write_ids_version(self, stage: str, version: str):
+        path = self._ids_version_path(stage)
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_text(version)
+        os.replace(tmp, path)
+
+    # The ids done for a stage as an IdSet (see idset.py), or None if some aren't integers.
+    # Snapshotted to <ledger>_ids/<stage>.npy with the stage version it matches, so a later run
+    # memory-maps it instead of reading every row; rebuilt from the table when any other writer
+    # has changed the stage since. Kept current in place as this ledger flushes.
+    def done_ids(self, stage: str) -> IdSet | None:
+        self.flush()
+        version = self._stage_version(stage)
+        cached = self._id_sets.get(stage)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        path = self._ids_dir / f"{stage}.npy"
+        version_path = self._ids_version_path(stage)
+        if version_path.exists() and version_path.read_text() == version:
+            ids = IdSet.open(path)
+        else:
+            done_states = DONE_STATES[stage]
+            rows = self._conn.execute(
+                f"SELECT doc_id FROM doc_state WHERE stage = ? AND state IN ({','.join('?' * len(done_states))})",
+                (stage, *done_states),
+            )
+            try:
+                ids = IdSet.from_ids(np.fromiter((int(row[0]) for row in rows), dtype=np.uint64), path)
+            except (ValueError, OverflowError):
+                ids = None
+            if ids is not None:
+                ids.save()
+                self._write_ids_version(stage, version)
+        self._id_sets[stage] = (version, ids)
+        return ids
+
+    # Of the given ids, the ones not yet done for this stage
+    def filter_not_done(self, doc_ids, stage: str, chunk_size: int = 500) -> list[str]:
+        doc_ids = [str(doc_id) for doc_id in doc_ids]
+        pending = self.not_done_mask(doc_ids, stage, chunk_size)
+        return [doc_id for doc_id, keep in zip(doc_ids, pending) if keep]
+
+    # Element-wise "not done yet" for doc_ids (a list, array or Series): a vectorized lookup in
+    # done_ids, or one indexed query per chunk when the ids aren't all integers
+    def not_done_mask(self, doc_ids, stage: str, chunk_size: int = 500) -> np.ndarray:
+        done_ids = self.done_ids(stage)
+        if done_ids is not None:
+            try:
+                return ~done_ids.contains(doc_ids)
+            except ValueError:
+                pass
+        doc_ids = [str(doc_id) for doc_id in doc_ids]
+        done_states = DONE_STATES[stage]
+        done = set()
+        for start in range(0, len(doc_ids), chunk_size):
+            chunk = doc_ids[start:start + chunk_size]
+            rows = self._conn.execute(
+                f"SELECT doc_id FROM doc_state WHERE stage = ? AND state IN ({','.join('?' * len(done_states))}) "
+                f"AND doc_id IN ({','.join('?' * len(chunk))})",
+                (stage, *done_states, *chunk),
+            )
+            done.update(row[0] for row in rows)
+        return np.array([doc_id not in done for doc_id in doc_ids], dtype=bool)
+
+    # Every id in one state, e.g. the changed exports
+    def ids_in_state(self, stage: str, state: str) -> set[str]:
+        self.flush()
+        rows = self._conn.execute("SELECT doc_id FROM doc_state WHERE stage = ? AND state = ?", (stage, state))
+        return {row[0] for row in rows}
+
+    # Ids not done that have failed max_errors times, which iter_pending leaves out too
+    def given_up_ids(self, stage: str, max_errors: int = 3) -> set[str]:
+        self.flush()
+        done_states = DONE_STATES[stage]
+        rows = self._conn.execute(
+            f"SELECT doc_id FROM doc_state WHERE stage = ? "
+            f"AND state NOT IN ({','.join('?' * len(done_states))}) AND error_count >= ?",
+            (stage, *done_states, max_errors),
+        )
+        return {row[0] for row in rows}
+
+    # Streams ids that still need work, paging by key so concurrent writes don't disturb the scan.
+    # Documents that have failed max_errors times are left out until their count is reset.
+    def iter_pending(self, stage: str, max_errors: int = 3, page_size: int = 1000):
+        self.flush()
+        done_states = DONE_STATES[stage]
+        last = ""
+        while True:
+            rows = self._conn.execute(
+                f"SELECT doc_id FROM doc_state WHERE stage = ? AND doc_id > ? "
+                f"AND state NOT IN ({','.join('?' * len(done_states))}) AND error_count < ? "
+                f"ORDER BY doc_id LIMIT ?",
+                (stage, last, *done_states, max_errors, page_size),
+            ).fetchall()
+            if not rows:
+                return
+            for (doc_id,) in rows:
+                yield doc_id
+            last = rows[-1][0]
+
+    def count_pending(self, stage: str, max_errors: int = 3) -> int:
+        self.flush()
+        done_states = DONE_STATES[stage]
+        return self._conn.execute(
+            f"SELECT COUNT(*) FROM doc_state WHERE stage = ? "
+            f"AND state NOT IN ({','.join('?' * len(done_states))}) AND error_count < ?",
+            (stage, *done_states, max_errors),
+        ).fetchone()[0]
+
+    def count(self, stage: str, states=None) -> int:
+        self.flush()
+        if states is None:
+            query, params = "SELECT COUNT(*) FROM doc_state WHERE stage = ?", (stage,)
+        else:
+            query = f"SELECT COUNT(*) FROM doc_state WHERE stage = ? AND state IN ({','.join('?' * len(states))})"
+            params = (stage, *states)
+        return self._conn.execute(query, params).fetchone()[0]
+
+    def get_meta(self, key: str, default=None):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value):
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, str(value)),
+        )
+
+    # Document metadata from project listings, kept so the exporter can build text URLs without
+    # a per-document API call. Written straight away: listings are already batched by page.
+    def save_metadata(self, docs):
+        rows = [(str(doc["id"]), json.dumps(doc, separators=(",", ":"))) for doc in docs]
+        if rows:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT INTO doc_metadata (doc_id, metadata) VALUES (?, ?) "
+                "ON CONFLICT (doc_id) DO UPDATE SET metadata = excluded.metadata",
+                rows,
+            )
+            self._conn.execute("COMMIT")
+
+    def get_metadata(self, doc_id) -> dict | None:
+        row = self._conn.execute("SELECT metadata FROM doc_metadata WHERE doc_id = ?", (str(doc_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # One-time import of the newline-delimited id files earlier versions kept for resuming
+    def import_id_file(self, path, stage: str, state: str):
+        marker = f"imported:{Path(path).name}"
+        if not os.path.exists(path) or self.get_meta(marker):
+            return
+        with open(path) as f:
+            self.record_many((line.strip() for line in f if line.strip()), stage, state)
+        self.flush()
+        self.set_meta(marker, time.time())
+        print(f"Imported {path} into the ledger as {stage}/{state}")
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
@@ -1,24 +1,109 @@
+import argparse
 import asyncio
 from dc_to_s3 import dc_to_s3
+from evaluate import evaluate_csv
+from ingest import export_and_collect
+from leases import open_lease_store
 from sum_from_S3 import DocumentStatsCollector
 from sum_stats import DocumentStatsAnalyzer
+from summarize import Summarizer
+
+STAGES = ("export", "stats", "summarize", "evaluate", "analyze")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run pipeline stages in order")
+    # No choices=: argparse checks a nargs="*" default against them as a whole list and rejects it
+    parser.add_argument("stages", nargs="*", metavar="stage",
+                        help=f"stages to run: {', '.join(STAGES)} (default: analyze)")
+    parser.add_argument("--project-id", type=int, default=216694)
+    parser.add_argument("--max-documents", type=int, default=30000)
+    parser.add_argument("--consumers", type=int, default=3)
+    parser.add_argument("--bucket", default="obd-sum-stats")
+    parser.add_argument("--workers", type=int, default=8)
+    # export and stats together are fused by default: documents are tokenized as they are
+    # uploaded instead of downloaded back from S3 (see ingest.py)
+    parser.add_argument("--no-fuse", action="store_true", help="run export and stats as separate passes")
+    parser.add_argument("--lease-store", help="export with the other nodes sharing this lease store")
+    # Every node of one run passes the same epoch; a new epoch reopens all buckets, so a later
+    # run picks up documents added since. There is no default: nodes that disagree on it (started
+    # either side of midnight, say) would each export every bucket.
+    parser.add_argument("--lease-epoch", help="export pass the leases belong to (required with --lease-store)")
+    args = parser.parse_args(argv)
+    for stage in args.stages:
+        if stage not in STAGES:
+            parser.error(f"invalid stage: {stage!r} (choose from {', '.join(STAGES)})")
+    args.stages = args.stages or ["analyze"]
+    if args.lease_store and not args.lease_epoch:
+        parser.error("--lease-store needs --lease-epoch, the same on every node of the run")
+    return args
+
+
+async def run_ingest(args, stages: set):
+    exporter = collector = None
+    if "export" in stages:
+        exporter = dc_to_s3(project_id=args.project_id, max_documents=args.max_documents,
+                            num_consumers=args.consumers)
+    if "stats" in stages:
+        collector = DocumentStatsCollector(
+            bucket_name=args.bucket,
+            prefix="",
+            workers=args.workers,
+            # layout="shards" reads packed shards written by `python shards.py obd-sum-stats`
+            # Extra count columns per target model; the first counter fills token_total:
+            # token_counters=["spacy:en_core_web_sm", "llama3=hf:models/llama3/tokenizer.json"],
+            # Reuse counts for pages seen before and flag near-duplicate pages:
+            # page_cache_path="data/page_cache.sqlite3", near_duplicates=True,
+            # Score pages and don't tokenize blank scans and OCR noise (see page_quality.py):
+            # page_quality=True, min_page_quality=0.3,
+        )
+    # Stage latencies go to data/metrics/*.prom every 15s; OBD_PROFILE=data/profile.folded also
+    # writes sampled stacks for a flame graph.
+    if exporter and collector and not args.no_fuse and not args.lease_store:
+        await export_and_collect(exporter, collector)
+        # Then whatever an earlier run exported but never tokenized (listing only, if nothing)
+        await collector.process_documents_async()
+        return
+    if exporter and args.lease_store:
+        await exporter.export_sharded(open_lease_store(args.lease_store, args.lease_epoch))
+    elif exporter:
+        await exporter.export_with_queue()
+    if collector:
+        await collector.process_documents_async()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stages = set(args.stages)
+    if stages & {"export", "stats"}:
+        asyncio.run(run_ingest(args, stages))
+
+    if "summarize" in stages:
+        # Map-reduce summaries through the OpenAI-compatible endpoint at $LLM_API_URL ($LLM_MODEL).
+        # page_cache_path="data/page_cache.sqlite3" caches completions, and
+        # near_duplicates_from="data/page_token_counts" leaves out flagged pages, and
+        # min_page_quality=0.3 blank scans and OCR noise.
+        summarizer = Summarizer(bucket_name=args.bucket, context=8192)
+        asyncio.run(summarizer.summarize_async())
+
+    if "evaluate" in stages:
+        # ROUGE/BLEU/METEOR of simulate_data's output against ground_truth, per row and with intervals
+        print(evaluate_csv("data/00-simulated_data.csv", workers=args.workers))
+
+    if "analyze" in stages:
+        analyzer = DocumentStatsAnalyzer(
+                doc_stats_path="data/document_stats",
+                page_tokens_path="data/page_token_counts"
+            )
+        # Summaries kept up to date by the collector; load_data() reads the full tables instead
+        analyzer.load_summary()
+        analyzer.show_summary()
+        print(f"Plots written to {', '.join(map(str, analyzer.plot_all()))}")
+        # Per-document comparisons need the tables:
+        # analyzer.load_data(doc_columns=None, page_columns=analyzer.PLOT_PAGE_COLUMNS)
+        # analyzer.compare_token_counters()
+
 
 # Press the green button in the gutter to run the script.
 if __name__ == "__main__":
-    # exporter = dc_to_s3(project_id=216694, max_documents=30000, num_consumers=3)
-    # asyncio.run(exporter.export_with_queue())
-
-    # collector = DocumentStatsCollector(
-    #     bucket_name="obd-sum-stats",
-    #     prefix="",
-    #     workers=8
-    # )
-    # asyncio.run(collector.process_documents_async())
-
-    analyzer = DocumentStatsAnalyzer(
-            doc_stats_path="data/document_stats.csv",
-            page_tokens_path="data/page_token_counts.csv"
-        )
-    analyzer.load_data()
-    analyzer.show_summary()
-    analyzer.plot_all()
\ No newline at end of file
+    main()
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+# In-process counters, gauges and latency histograms for the pipelines, cheap enough to leave
+# on: an update is a dict lookup plus, for histograms, a bisect over fixed buckets, with no locks
+# (each pipeline updates its Metrics from one event loop; pool workers keep their own and ship
+# drain()ed deltas back with their results to be merge()d). Snapshots are written atomically as
+# JSON or in the Prometheus text format (by file suffix), e.g. for node_exporter's textfile
+# collector, by report_periodically or write().
+
+# Seconds, doubling from 1ms to ~2 minutes
+LATENCY_BUCKETS = tuple(0.001 * 2 ** i for i in range(18))
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted(labels.items())))
+
+
+class Histogram:
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, counts, total: float, count: int):
+        for i, c in enumerate(counts):
+            self.counts[i] += c
+        self.sum += total
+        self.count += count
+
+    # Estimated by interpolating inside the bucket the quantile falls in
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return float("nan")
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                lower = self.bounds[i - 1] if i else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.bounds[-1] * 2
+                return lower + (upper - lower) * (rank - seen) / c
+            seen += c
+        return self.bounds[-1]
+
+
+class Metrics:
+    def __init__(self, namespace: str = "obd"):
+        self.namespace = namespace
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        # Values, or callables evaluated at snapshot time (queue depths, utilization)
+        self.gauges = {}
+        self.started = time.monotonic()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        self.counters[_key(name, labels)] += value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    def gauge(self, name: str, value, **labels):
+        self.gauges[_key(name, labels)] = value
+
+    # `with metrics.time("stage_seconds", stage="s3_put"):` also works around awaits
+    @contextmanager
+    def time(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    # Everything recorded since the last drain, as a picklable delta, and reset
+    def drain(self) -> dict:
+        delta = {
+            "counters": list(self.counters.items()),
+            "histograms": [(key, h.counts, h.sum, h.count) for key, h in self.histograms.items()],
+        }
+        self.counters.clear()
+        self.histograms.clear()
+        return delta
+
+    def merge(self, delta: dict):
+        for key, value in delta["counters"]:
+            self.counters[key] += value
+        for key, counts, total, count in delta["histograms"]:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.merge(counts, total, count)
+
+    def counter(self, name: str, **labels) -> float:
+        return self.counters.get(_key(name, labels), 0)
+
+    def histogram(self, name: str, **labels) -> Histogram | None:
+        return self.histograms.get(_key(name, labels))
+
+    def _gauge_values(self):
+        for key, value in list(self.gauges.items()):
+            try:
+                yield key, float(value() if callable(value) else value)
+            except Exception:
+                continue
+
+    def snapshot(self) -> dict:
+        def flat(key):
+            name, labels = key
+            return {"name": name, **dict(labels)}
+
+        return {
+            "timestamp": time.time(),
+            "uptime_seconds": time.monotonic() - self.started,
+            "counters": [{**flat(key), "value": value} for key, value in self.counters.items()],
+            "gauges": [{**flat(key), "value": value} for key, value in self._gauge_values()],
+            "histograms": [
+                {
+                    **flat(key),
+                    "count": h.count,
+                    "sum": h.sum,
+                    "p50": h.quantile(0.5),
+                    "p99": h.quantile(0.99),
+                    "buckets": dict(zip([*map(str, h.bounds), "+Inf"], h.counts)),
+                }
+                for key, h in self.histograms.items()
+            ],
+        }
+
+    def prometheus(self) -> str:
+        def series(name, labels, extra=()):
+            pairs = [*labels, *extra]
+            inner = ",".join(f'{k}="{v}"' for k, v in pairs)
+            return f"{self.namespace}_{name}{{{inner}}}" if inner else f"{self.namespace}_{name}"
+
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {self.namespace}_{name} {kind}")
+
+        for (name, labels), value in sorted(self.counters.items()):
+            declare(name, "counter")
+            lines.append(f"{series(name, labels)} {value:.12g}")
+        for (name, labels), value in sorted(self._gauge_values()):
+            declare(name, "gauge")
+            lines.append(f"{series(name, labels)} {value:.12g}")
+        for (name, labels), h in sorted(self.histograms.items()):
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, count in zip([*(f"{b:g}" for b in h.bounds), "+Inf"], h.counts):
+                cumulative += count
+                lines.append(f"{series(name + '_bucket', labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{series(name + '_sum', labels)} {h.sum:.12g}")
+            lines.append(f"{series(name + '_count', labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    # .prom/.txt files get the Prometheus text format, anything else JSON
+    def write(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix in (".prom", ".txt"):
+            text = self.prometheus()
+        else:
+            text = json.dumps(self.snapshot(), indent=1)
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_text(text)
+        os.replace(tmp, path)
+
+    # One line per histogram: count, p50 and p99 in ms
+    def latency_report(self) -> list[str]:
+        return [
+            f"{name} {' '.join(f'{k}={v}' for k, v in labels)}: n={h.count} "
+            f"p50={h.quantile(0.5) * 1000:.1f}ms p99={h.quantile(0.99) * 1000:.1f}ms"
+            for (name, labels), h in sorted(self.histograms.items())
+        ]
+
+
+# Writes a snapshot (if path is set) and prints progress() (if it returns a line) every interval
+# seconds until cancelled, then once more
+async def report_periodically(metrics: Metrics, path=None, interval: float = 15.0, progress=None):
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            if path:
+                metrics.write(path)
+            line = progress() if progress else None
+            if line:
+                print(line)
+    finally:
+        if path:
+            metrics.write(path)
+
+
+class SamplingProfiler:
+    # Samples one thread's Python stack every `interval` seconds from a daemon thread and counts
+    # collapsed stacks, written on stop() as "outer;inner;leaf count" lines (what flamegraph.pl
+    # and speedscope read). Costs one sys._current_frames() per sample on the sampling thread.
+    def __init__(self, path, interval: float = 0.01, thread_id: int | None = None):
+        self.path = Path(path)
+        self.interval = interval
+        self.thread_id = thread_id or threading.main_thread().ident
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# A started profiler when path is set (e.g. from $OBD_PROFILE), else a no-op context
+@contextmanager
+def maybe_profile(path=None, interval: float = 0.01):
+    if not path:
+        yield None
+        return
+    with SamplingProfiler(path, interval) as profiler:
+        yield profiler
@@ -0,0 +1,135 @@
+import re
+import sqlite3
+import zlib
+from contextlib import closing
+from pathlib import Path
+
+import numpy as np
+
+# Near-duplicate pages (cover letters, exemption notices, repeated forms) by MinHash over word
+# shingles and LSH banding. Signatures are computed with numpy per page; the index keeps one
+# representative per group of similar pages, and a page is a near duplicate of the first
+# representative it shares a band with whose signatures agree on at least `threshold` of their
+# positions (an estimate of the Jaccard similarity of their shingle sets). The representatives
+# can be saved to a SQLite file and loaded by a later run, which rebuilds the bands from them.
+
+_PRIME = (1 << 31) - 1
+_WORD = re.compile(r"\w+")
+# Row of an empty page (no words): never indexed, never a duplicate
+EMPTY = np.uint32(0xFFFFFFFF)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS representatives (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    signature BLOB NOT NULL
+);
+"""
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 128, shingle: int = 3, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle = shingle
+        # a * x stays below 2**63 for 32-bit x, so (a * x + b) % p never overflows uint64
+        self._a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)[:, None]
+        self._b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)[:, None]
+
+    # 32-bit hashes of the page's word shingles, combined from per-word crc32s in numpy
+    def _shingles(self, text: str) -> np.ndarray:
+        words = np.fromiter((zlib.crc32(w.encode()) for w in _WORD.findall(text.lower())), dtype=np.uint64)
+        if len(words) <= self.shingle:
+            return words[:1] if len(words) else words
+        hashes = np.zeros(len(words) - self.shingle + 1, dtype=np.uint64)
+        for i in range(self.shingle):
+            hashes = (hashes * np.uint64(0x01000193) + words[i:len(words) - self.shingle + 1 + i]) & np.uint64(0xFFFFFFFF)
+        return np.unique(hashes)
+
+    def signatures(self, texts) -> np.ndarray:
+        texts = list(texts)
+        signatures = np.full((len(texts), self.num_perm), EMPTY, dtype=np.uint32)
+        for i, text in enumerate(texts):
+            shingles = self._shingles(text)
+            if len(shingles):
+                signatures[i] = ((self._a * shingles[None, :] + self._b) % np.uint64(_PRIME)).min(axis=1)
+        return signatures
+
+
+class NearDuplicateIndex:
+    # bands x rows must equal the signature length; with 16 bands of 8 rows, pages with a Jaccard
+    # similarity around 0.7 become candidates half the time and 0.85 ones almost always. Memory is
+    # one signature plus `bands` dict entries per representative (roughly 2 KB).
+    def __init__(self, num_perm: int = 128, bands: int = 16, threshold: float = 0.8, seed: int = 2):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self._mix = np.random.default_rng(seed).integers(1, 1 << 63, self.rows, dtype=np.uint64)
+        self._band_ids = np.arange(bands, dtype=np.uint64) << np.uint64(56)
+        self._buckets = {}
+        self._keys = []
+        self._signatures = []
+        # Representatives before this one are already in the file save() appends to
+        self._saved = 0
+        self.pages = 0
+        self.duplicates = 0
+
+    def _band_keys(self, signature: np.ndarray) -> list[int]:
+        # Wrapping uint64 dot product of each band with fixed odd multipliers, tagged by band
+        with np.errstate(over="ignore"):
+            keys = (signature.reshape(self.bands, self.rows).astype(np.uint64) * self._mix).sum(axis=1)
+        return (keys ^ self._band_ids).tolist()
+
+    # The key of the page this one nearly duplicates, or None (and it becomes a representative)
+    def add(self, key, signature: np.ndarray):
+        if signature[0] == EMPTY:
+            return None
+        self.pages += 1
+        band_keys = self._band_keys(signature)
+        for candidate in dict.fromkeys(self._buckets.get(k) for k in band_keys):
+            if candidate is None:
+                continue
+            # A page indexed before a crash, tokenized again on resume, is its own representative
+            if self._keys[candidate] == key:
+                return None
+            if (self._signatures[candidate] == signature).mean() >= self.threshold:
+                self.duplicates += 1
+                return self._keys[candidate]
+        self._insert(key, signature, band_keys)
+        return None
+
+    def _insert(self, key, signature: np.ndarray, band_keys: list[int]):
+        index = len(self._keys)
+        self._keys.append(key)
+        self._signatures.append(signature)
+        for k in band_keys:
+            self._buckets.setdefault(k, index)
+
+    def add_many(self, keys, signatures: np.ndarray) -> list:
+        return [self.add(key, signature) for key, signature in zip(keys, signatures)]
+
+    # Append the representatives added since the last save (or load) to the file at path
+    def save(self, path):
+        rows = [(i, str(self._keys[i]), self._signatures[i].tobytes()) for i in range(self._saved, len(self._keys))]
+        with closing(sqlite3.connect(path)) as conn:
+            conn.executescript(_SCHEMA)
+            with conn:
+                conn.executemany("INSERT INTO representatives (id, key, signature) VALUES (?, ?, ?)", rows)
+        self._saved = len(self._keys)
+
+    # Representatives saved by earlier runs, in the order they were added; returns how many
+    def load(self, path) -> int:
+        if not Path(path).exists():
+            return 0
+        with closing(sqlite3.connect(path)) as conn:
+            conn.executescript(_SCHEMA)
+            rows = conn.execute("SELECT key, signature FROM representatives ORDER BY id").fetchall()
+        for key, blob in rows:
+            signature = np.frombuffer(blob, dtype=np.uint32)
+            if len(signature) != self.bands * self.rows:
+                raise ValueError(f"{path} holds {len(signature)}-value signatures, not {self.bands * self.rows}")
+            self._insert(key, signature, self._band_keys(signature))
+        self._saved = len(self._keys)
+        return len(rows)
@@ -0,0 +1,172 @@
+import hashlib
+import sqlite3
+import time
+from pathlib import Path
+
+# Content-addressed cache of per-page results, shared by every worker process through one SQLite
+# (WAL) file. Keys hash a namespace, which names the processor and its exact version (a token
+# counter's `version`, later a summarization model and prompt), together with the page text, so
+# results are reused across documents and runs and go stale on their own when the processor
+# changes. The text is hashed as the processor sees it: any normalization would change what the
+# counters return. The file is kept under max_bytes by evicting the least recently used entries.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key BLOB PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_by_last_used ON entries (last_used);
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO usage (id, bytes) VALUES (0, 0);
+CREATE TABLE IF NOT EXISTS stats (
+    namespace TEXT PRIMARY KEY,
+    hits INTEGER NOT NULL,
+    misses INTEGER NOT NULL,
+    miss_seconds REAL NOT NULL
+);
+"""
+
+# Per-row bookkeeping on top of key and value, for the size budget
+_ROW_OVERHEAD = 24
+
+
+def page_key(namespace: str, text: str) -> bytes:
+    # surrogatepass: page text decoded from JSON may hold lone surrogates
+    data = f"{namespace}\0{text}".encode("utf-8", "surrogatepass")
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class PageCache:
+    def __init__(self, path="data/page_cache.sqlite3", max_bytes: int = 1 << 30):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._conn = sqlite3.connect(self.path, isolation_level=None, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def get_many(self, keys, chunk_size: int = 500) -> dict[bytes, str]:
+        keys = list(keys)
+        found = {}
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            rows = self._conn.execute(
+                f"SELECT key, value FROM entries WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            )
+            found.update(rows)
+        return found
+
+    # One write transaction: insert new entries, refresh the LRU position of the ones that were
+    # hit, add to the namespace's hit/miss counters, and evict if over budget
+    def update(self, items: dict[bytes, str], touched=(), namespace: str | None = None,
+               hits: int = 0, misses: int = 0, miss_seconds: float = 0.0):
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            added = 0
+            for key, value in items.items():
+                size = len(key) + len(value) + _ROW_OVERHEAD
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO entries (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                    (key, value, size, now),
+                )
+                added += size * cursor.rowcount
+            self._conn.executemany("UPDATE entries SET last_used = ? WHERE key = ?", ((now, key) for key in touched))
+            if namespace:
+                self._conn.execute(
+                    "INSERT INTO stats (namespace, hits, misses, miss_seconds) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (namespace) DO UPDATE SET hits = hits + excluded.hits, "
+                    "misses = misses + excluded.misses, miss_seconds = miss_seconds + excluded.miss_seconds",
+                    (namespace, hits, misses, miss_seconds),
+                )
+            used = self._conn.execute("UPDATE usage SET bytes = bytes + ? RETURNING bytes", (added,)).fetchone()[0]
+            if used > self.max_bytes:
+                self._evict(used, int(self.max_bytes * 0.9))
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    # Drop least recently used entries until usage is at most target
+    def _evict(self, used: int, target: int, batch: int = 1000):
+        while used > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM entries ORDER BY last_used LIMIT ?", (batch,)
+            ).fetchall()
+            if not rows:
+                break
+            freed = 0
+            keys = []
+            for key, size in rows:
+                keys.append((key,))
+                freed += size
+                if used - freed <= target:
+                    break
+            self._conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+            used -= freed
+        self._conn.execute("UPDATE usage SET bytes = ?", (max(used, 0),))
+
+    def usage(self) -> int:
+        return self._conn.execute("SELECT bytes FROM usage").fetchone()[0]
+
+    # {namespace: (hits, misses, miss_seconds)}, accumulated over every run that used this file
+    def stats(self) -> dict:
+        return {
+            namespace: (hits, misses, miss_seconds)
+            for namespace, hits, misses, miss_seconds in self._conn.execute("SELECT * FROM stats")
+        }
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Counts for texts, running the counter only on pages neither the cache nor an earlier page of
+# the same call has. Pages served without counting are hits.
+def cached_count(counter, texts: list[str], cache: PageCache) -> list[int]:
+    namespace = f"tokens:{counter.version}"
+    keys = [page_key(namespace, text) for text in texts]
+    found = cache.get_many(set(keys))
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found:
+            missing.setdefault(key, text)
+    start = time.perf_counter()
+    counted = dict(zip(missing, counter.count(list(missing.values())))) if missing else {}
+    seconds = time.perf_counter() - start
+    cache.update(
+        {key: str(count) for key, count in counted.items()},
+        touched=found,
+        namespace=namespace,
+        hits=len(texts) - len(missing),
+        misses=len(missing),
+        miss_seconds=seconds,
+    )
+    return [counted[key] if key in counted else int(found[key]) for key in keys]
+
+
+# Difference between two stats() snapshots as a report: hit rate and the counting time the hits
+# saved, estimated at the average cost of a miss over the cache's lifetime
+def report_stats(before: dict, after: dict) -> list[str]:
+    lines = []
+    for namespace, (total_hits, total_misses, total_seconds) in after.items():
+        prev = before.get(namespace, (0, 0, 0.0))
+        hits, misses = total_hits - prev[0], total_misses - prev[1]
+        if hits + misses == 0:
+            continue
+        saved = hits * total_seconds / total_misses if total_misses else 0.0
+        lines.append(
+            f"{namespace}: {hits}/{hits + misses} pages from cache ({hits / (hits + misses):.1%}), "
+            f"~{saved:.1f}s of counting saved"
+        )
+    return lines
@@ -0,0 +1,147 @@
+import unicodedata
+from functools import cache
+
+import numpy as np
+
+# Cheap page-quality scores for skipping blank scans and OCR noise before tokenization and
+# summarization. A batch of pages is scored at once in numpy over their code points: the share
+# of letters and digits, the share of symbols (anything but letters, digits, whitespace and
+# punctuation) and the share of words found in a small dictionary of frequent English and French
+# words. Pages with fewer than min_chars non-space characters score 0.
+#
+# A score is in [0, 1]: prose scores near 1, misread OCR of prose 0.6-0.9, a page of bare figures
+# or of letters that form no known words 0.4, and symbol noise close to 0. Words are runs of
+# letters matched by a 64-bit polynomial hash of their lowercased code points, so the dictionary
+# lookup is a sorted-array search too.
+
+DEFAULT_MIN_QUALITY = 0.3
+
+COMMON_WORDS = frozenset("""
+a about above act action after again against all also am an and any are as at be because been
+before being below between both but by can could did do does doing down during each few for
+from further had has have having he her here hers him his how i if in into is it its itself just
+me more most my no nor not now of off on once only or other our out over own same she should so
+some such than that the their them then there these they this those through to too under until
+up very was we were what when where which while who whom why will with would you your yours
+may must shall might per via upon within without however therefore whether either neither also
+one two three four five six seven eight nine ten first second third new last next
+year years month months day days week time date dated today number numbers total amount
+access information request requests requested record records file files page pages document
+documents copy copies release released disclosure section sections subsection paragraph act
+exemption exempted pursuant privacy personal third party parties consultation consulted
+minister ministers deputy assistant director general manager officer official officials staff
+department departments agency branch division office offices unit team program programs
+government federal provincial canada canadian public national international service services
+policy policies review report reports analysis briefing note notes memo memorandum draft final
+meeting meetings email emails letter letters attached attachment attachments subject sent
+received reply response responses question questions issue issues matter matters
+contract contracts agreement agreements budget cost costs funding fund funds financial
+payment payments invoice price value fiscal expenditure expenditures revenue grant grants
+committee council board chair member members president secretary treasury legal law
+please thank thanks regards dear sincerely cc re fw fwd from to
+data system systems project projects process management plan plans work support
+provide provided include including included following follow based related regarding
+decision decisions approval approved recommend recommended recommendation recommendations
+current previous proposed available required requirement requirements require need needs
+information part parts further additional general specific key main other others
+make made take taken use used well good also only such each many much
+le la les de des du un une et en est que qui dans pour par sur au aux ce cette ces il elle ils
+nous vous pas plus ne se sa son ses leur leurs avec sont être été avoir ont fait comme mais ou
+loi article demande renseignements document documents ministère gouvernement
+""".split())
+
+# Character classes
+OTHER, LETTER, DIGIT, SPACE, PUNCT = range(5)
+_MAX_WORD = 24
+_HASH_BASE = np.uint64(0x100000001B3)
+_POWERS = np.cumprod(np.r_[np.uint64(1), np.full(_MAX_WORD - 1, _HASH_BASE, dtype=np.uint64)], dtype=np.uint64)
+
+
+# Class of every code point in the Basic Multilingual Plane; anything above it is OTHER. Built
+# once per process (a few tens of milliseconds).
+@cache
+def _classes() -> np.ndarray:
+    table = np.full(0x10001, OTHER, dtype=np.uint8)
+    for cp in range(0x10000):
+        char = chr(cp)
+        if char.isalpha():
+            table[cp] = LETTER
+        elif char.isdigit():
+            table[cp] = DIGIT
+        elif char.isspace():
+            table[cp] = SPACE
+        elif unicodedata.category(char)[0] == "P" or unicodedata.category(char) == "Sc":
+            table[cp] = PUNCT
+    return table
+
+
+def _code_points(texts: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    joined = "".join(texts).encode("utf-32-le", "surrogatepass")
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    return np.frombuffer(joined, dtype=np.uint32), lengths
+
+
+# (page, hash, length) of each word; words longer than _MAX_WORD hash to 0. Words are runs of
+# letters that don't cross page boundaries; ASCII and Latin-1 capitals are lowercased.
+def _word_hashes(code_points: np.ndarray, is_letter: np.ndarray, page_of: np.ndarray, page_starts: np.ndarray):
+    starts = is_letter.copy()
+    starts[1:] &= ~is_letter[:-1]
+    page_starts = page_starts[page_starts < len(starts)]
+    starts[page_starts] = is_letter[page_starts]
+    letters = code_points[is_letter].astype(np.uint64)
+    upper = ((letters >= 0x41) & (letters <= 0x5A)) | ((letters >= 0xC0) & (letters <= 0xDE) & (letters != 0xD7))
+    letters[upper] += np.uint64(0x20)
+    word_starts = np.flatnonzero(starts[is_letter])
+    if not len(word_starts):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+    lengths = np.diff(np.r_[word_starts, len(letters)])
+    position = np.arange(len(letters)) - np.repeat(word_starts, lengths)
+    hashes = np.add.reduceat(letters * _POWERS[np.minimum(position, _MAX_WORD - 1)], word_starts)
+    hashes[lengths > _MAX_WORD] = 0
+    return page_of[np.flatnonzero(is_letter)[word_starts]], hashes, lengths
+
+
+class PageQualityScorer:
+    def __init__(self, words=COMMON_WORDS, min_chars: int = 20):
+        self.min_chars = min_chars
+        words = sorted(words)
+        code_points, lengths = _code_points(words)
+        _, hashes, _ = _word_hashes(
+            code_points, np.ones(len(code_points), dtype=bool), np.repeat(np.arange(len(words)), lengths),
+            np.r_[0, np.cumsum(lengths)[:-1]],
+        )
+        self._known = np.unique(hashes[hashes != 0])
+
+    # Per-page counts: chars (non-space), letters, digits, punct, other, words (2+ letters) and
+    # known_words (those in the dictionary)
+    def features(self, texts) -> dict:
+        texts = list(texts)
+        code_points, lengths = _code_points(texts)
+        page_of = np.repeat(np.arange(len(texts)), lengths)
+        classes = _classes()[np.minimum(code_points, 0x10000)]
+        counts = np.bincount(page_of * 5 + classes, minlength=len(texts) * 5).reshape(len(texts), 5)
+        word_pages, hashes, word_lengths = _word_hashes(
+            code_points, classes == LETTER, page_of, np.r_[0, np.cumsum(lengths)[:-1]]
+        )
+        words = word_lengths >= 2
+        positions = np.minimum(np.searchsorted(self._known, hashes), len(self._known) - 1)
+        known = words & (self._known[positions] == hashes)
+        return {
+            "chars": counts.sum(axis=1) - counts[:, SPACE],
+            "letters": counts[:, LETTER],
+            "digits": counts[:, DIGIT],
+            "punct": counts[:, PUNCT],
+            "other": counts[:, OTHER],
+            "words": np.bincount(word_pages[words], minlength=len(texts)),
+            "known_words": np.bincount(word_pages[known], minlength=len(texts)),
+        }
+
+    def score(self, texts) -> np.ndarray:
+        f = self.features(texts)
+        chars = np.maximum(f["chars"], 1)
+        alnum = np.minimum(1.0, (f["letters"] + f["digits"]) / chars / 0.7)
+        known = np.minimum(1.0, f["known_words"] / np.maximum(f["words"], 1) / 0.3)
+        clean = np.clip(1.0 - (f["other"] / chars - 0.05) / 0.25, 0.0, 1.0)
+        scores = clean * (0.4 * alnum + 0.6 * known)
+        scores[f["chars"] < self.min_chars] = 0.0
+        return scores.astype(np.float32)
@@ -0,0 +1,215 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from aiohttp import ClientConnectionError, ClientSession
+
+THROTTLE_STATUSES = (429,)
+AUTH_STATUSES = (401, 403)
+TRANSIENT_STATUSES = (500, 502, 503, 504)
+
+
+class AdaptiveRateLimiter:
+    # Token bucket shared by every consumer of one API. The refill rate follows AIMD: until the
+    # first throttle it grows by `increase` x rate per success (slow start), after that each
+    # success adds `increase` requests/sec up to max_rate, and each throttle multiplies it by
+    # `decrease` down to min_rate, at most once per cooldown so a burst of 429s from requests that
+    # were already in flight counts once. A Retry-After pauses the whole bucket, not just one caller.
+    def __init__(
+        self,
+        rate: float = 1.0,
+        max_rate: float = 10.0,
+        min_rate: float = 0.2,
+        increase: float = 0.1,
+        decrease: float = 0.75,
+        burst: float = 1.0,
+        cooldown: float = 1.0,
+    ):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.burst = burst
+        self.cooldown = cooldown
+        self.throttled = 0
+        self._slow_start = True
+        self._last_decrease = 0.0
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = None
+        self._loop = None
+
+    # The lock is created per event loop so one limiter survives successive asyncio.run calls
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._lock = loop, asyncio.Lock()
+        return self._lock
+
+    async def acquire(self):
+        async with self._get_lock():
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def on_success(self):
+        step = self.increase * self.rate if self._slow_start else self.increase
+        self.rate = min(self.max_rate, self.rate + step)
+
+    def on_throttle(self, retry_after: float | None = None):
+        now = time.monotonic()
+        self.throttled += 1
+        self._slow_start = False
+        if now - self._last_decrease >= self.cooldown:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._last_decrease = now
+        self._tokens = 0
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+
+
+class AdaptiveConcurrencyLimiter:
+    # AIMD on the number of requests in flight rather than their rate, for APIs where a request
+    # takes seconds (LLM completions): the limit grows by `increase` per limit's worth of successes
+    # (about +1 per round trip), and each throttle multiplies it by `decrease`, once per cooldown.
+    def __init__(
+        self,
+        limit: float = 4.0,
+        max_limit: float = 64.0,
+        min_limit: float = 1.0,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        cooldown: float = 1.0,
+    ):
+        self.limit = limit
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.throttled = 0
+        self._last_decrease = 0.0
+        self._condition = None
+        self._loop = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._condition = loop, asyncio.Condition()
+        return self._condition
+
+    @asynccontextmanager
+    async def slot(self):
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            async with condition:
+                self.in_flight -= 1
+                condition.notify_all()
+
+    def on_success(self):
+        self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+
+    def on_throttle(self):
+        now = time.monotonic()
+        self.throttled += 1
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(self.min_limit, self.limit * self.decrease)
+            self._last_decrease = now
+
+
+# Retry-After is either delta-seconds or an HTTP date
+def parse_retry_after(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+# "Full jitter" exponential backoff, so retrying consumers don't stampede in lockstep
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class _Retry(Exception):
+    pass
+
+
+class RetriesExhausted(Exception):
+    pass
+
+
+# GET/POST a JSON endpoint through the limiter, retrying throttles, auth expiry, 5xx and connection
+# errors with jittered backoff. `auth` supplies headers and is told when a token is rejected.
+# Returns None for a 404 when allow_404 is set. With `concurrency`, each attempt holds one of its
+# slots (released before any backoff) and reports throttles and successes to it.
+async def request_json(
+    session: ClientSession,
+    url: str,
+    limiter: AdaptiveRateLimiter | None = None,
+    auth=None,
+    method: str = "GET",
+    max_retries: int = 5,
+    allow_404: bool = False,
+    concurrency: AdaptiveConcurrencyLimiter | None = None,
+    **kwargs,
+):
+    for attempt in range(max_retries + 1):
+        if limiter:
+            await limiter.acquire()
+        headers = await auth.headers(session) if auth else None
+        try:
+            async with concurrency.slot() if concurrency else nullcontext(), session.request(
+                method, url, headers=headers, **kwargs
+            ) as res:
+                if res.status in THROTTLE_STATUSES:
+                    if limiter:
+                        limiter.on_throttle(parse_retry_after(res.headers.get("Retry-After")))
+                    if concurrency:
+                        concurrency.on_throttle()
+                    raise _Retry(f"{res.status} from {url}")
+                if res.status in AUTH_STATUSES and auth:
+                    auth.invalidate(headers)
+                    raise _Retry(f"{res.status} from {url}")
+                if res.status in TRANSIENT_STATUSES:
+                    raise _Retry(f"{res.status} from {url}")
+                if res.status == 404 and allow_404:
+                    return None
+                res.raise_for_status()
+                data = await res.json(content_type=None)
+        except (_Retry, ClientConnectionError, asyncio.TimeoutError) as e:
+            if attempt == max_retries:
+                raise RetriesExhausted(f"Gave up after {attempt + 1} attempts: {e}") from e
+            await asyncio.sleep(backoff_delay(attempt))
+            continue
+        if limiter:
+            limiter.on_success()
+        if concurrency:
+            concurrency.on_success()
+        return data
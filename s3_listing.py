@@ -0,0 +1,194 @@
+import asyncio
+import fcntl
+import json
+import os
+import re
+import time
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Bucket listings split into key ranges that are listed concurrently, and kept as a manifest of
+# keys, sizes and ETags so later runs start from it instead of re-listing.
+#
+# A range is (after, upto]: list_objects_v2 from StartAfter=after until a key passes upto. With
+# a previous manifest the ranges are cut at its key quantiles, so they come out even however
+# the keys are named (no hashed key prefixes needed); the first listing of a bucket cuts at
+# two leading digits, which suits the {doc_id}.json keys. A range overshoots by at most one page.
+#
+# Between listings, writers that know what they PUT (the exporter) append it to the manifest's
+# log, so the manifest stays current for up to max_age without listing at all. Other instances
+# (another process, or the collector next to an exporter) pick the log and any newer snapshot up
+# on their next refresh; appends and the log rewrite after a listing hold a lock on the log.
+
+MANIFEST_SCHEMA = pa.schema([
+    ("key", pa.string()),
+    ("size", pa.int64()),
+    ("etag", pa.string()),
+])
+
+# Cut points (after the prefix) for a bucket without a manifest: (, "10"], ("10", "11"], ...,
+# ("99", ), two leading digits of the doc id
+DEFAULT_SPLITS = tuple(str(i) for i in range(10, 100))
+
+
+def manifest_path(bucket: str, prefix: str = "", directory="data/s3_manifest") -> Path:
+    name = bucket if not prefix else f"{bucket}-{re.sub(r'[^A-Za-z0-9._-]', '_', prefix)}"
+    return Path(directory) / f"{name}.parquet"
+
+
+# Cut points splitting sorted keys into about `ranges` equal parts
+def split_points(keys, ranges: int) -> list[str]:
+    if len(keys) < 2 * ranges:
+        return []
+    return list(dict.fromkeys(keys[len(keys) * i // ranges] for i in range(1, ranges)))
+
+
+async def _list_range(s3, bucket: str, prefix: str, after: str | None, upto: str | None) -> list[tuple]:
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    if after:
+        kwargs["StartAfter"] = after
+    rows = []
+    async for page in s3.get_paginator("list_objects_v2").paginate(**kwargs):
+        for obj in page.get("Contents", []):
+            if upto is not None and obj["Key"] > upto:
+                return rows
+            rows.append((obj["Key"], obj["Size"], obj["ETag"].strip('"')))
+    return rows
+
+
+# Every object under prefix as sorted (key, size, etag) rows, listing the ranges between
+# consecutive splits with up to `concurrency` requests in flight
+async def list_objects_parallel(s3, bucket: str, prefix: str = "", splits=DEFAULT_SPLITS,
+                                concurrency: int = 16) -> list[tuple]:
+    bounds = [None, *sorted(s for s in splits if s.startswith(prefix)), None]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def list_one(after, upto):
+        async with semaphore:
+            return await _list_range(s3, bucket, prefix, after, upto)
+
+    parts = await asyncio.gather(*(list_one(a, b) for a, b in zip(bounds, bounds[1:])))
+    return [row for part in parts for row in part]
+
+
+def _log_line(key: str, size: int, etag: str, at: float) -> str:
+    return json.dumps({"key": key, "size": size, "etag": etag, "at": at}) + "\n"
+
+
+# {key: (size, etag, at)} from an open log. A torn last line (a writer killed mid-append) is skipped.
+def _read_log(f) -> dict:
+    recorded = {}
+    for line in f:
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        recorded[entry["key"]] = (entry["size"], entry["etag"], entry["at"])
+    return recorded
+
+
+class S3Manifest:
+    # Keys, sizes and ETags of one bucket prefix: a Parquet snapshot from the last listing plus a
+    # JSON-lines log of objects recorded since
+    def __init__(self, bucket: str, prefix: str = "", directory="data/s3_manifest", path=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.path = Path(path) if path else manifest_path(bucket, prefix, directory)
+        self.log_path = self.path.with_suffix(".log")
+        self.listed_at = None
+        self._keys = np.empty(0, dtype=object)
+        self._sizes = np.empty(0, dtype=np.int64)
+        self._etags = np.empty(0, dtype=object)
+        self._recorded = {}
+        self._snapshot_mtime = None
+        self._load()
+
+    # The snapshot only if it was rewritten since it was last read, and the whole log
+    def _load(self):
+        if self.path.exists() and self.path.stat().st_mtime_ns != self._snapshot_mtime:
+            self._snapshot_mtime = self.path.stat().st_mtime_ns
+            table = pq.read_table(self.path)
+            self.listed_at = float(table.schema.metadata[b"listed_at"])
+            self._keys = table.column("key").to_numpy(zero_copy_only=False)
+            self._sizes = table.column("size").to_numpy()
+            self._etags = table.column("etag").to_numpy(zero_copy_only=False)
+        self._load_log()
+
+    def _load_log(self):
+        if self.log_path.exists():
+            with open(self.log_path) as f:
+                fcntl.flock(f, fcntl.LOCK_SH)
+                self._recorded = _read_log(f)
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    # One object written since the last listing (called by writers right after their PUT)
+    def record(self, key: str, size: int, etag: str):
+        at = time.time()
+        self._recorded[key] = (size, etag.strip('"'), at)
+        self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.log_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(_log_line(key, size, etag.strip('"'), at))
+
+    def is_fresh(self, max_age: float) -> bool:
+        return self.listed_at is not None and time.time() - self.listed_at < max_age
+
+    # Sorted keys, optionally only those with the given suffix
+    def keys(self, suffix: str | None = None) -> list[str]:
+        keys = self._keys.tolist()
+        if self._recorded:
+            keys = sorted(set(keys).union(self._recorded))
+        return [k for k in keys if k.endswith(suffix)] if suffix else keys
+
+    def entries(self) -> dict:
+        entries = {k: (s, e) for k, s, e in zip(self._keys.tolist(), self._sizes.tolist(), self._etags.tolist())}
+        entries.update((k, (s, e)) for k, (s, e, _) in self._recorded.items())
+        return entries
+
+    # Re-list the prefix unless the manifest is younger than max_age seconds. Returns counts of
+    # added, changed (new size or ETag) and removed keys against the previous manifest. What
+    # other instances recorded or listed since this one last looked is read in first.
+    async def refresh(self, s3, max_age: float = 0.0, concurrency: int = 16) -> dict:
+        self._load()
+        if self.is_fresh(max_age):
+            return {"added": 0, "changed": 0, "removed": 0}
+        started = time.time()
+        splits = split_points(self._keys, concurrency * 4) or [self.prefix + s for s in DEFAULT_SPLITS]
+        rows = await list_objects_parallel(s3, self.bucket, self.prefix, splits, concurrency)
+        before = self.entries()
+        after = {key: (size, etag) for key, size, etag in rows}
+        changes = {
+            "added": len(after.keys() - before.keys()),
+            "changed": sum(1 for key, value in after.items() if key in before and before[key] != value),
+            "removed": len(before.keys() - after.keys()),
+        }
+        self._save(rows, started)
+        return changes
+
+    # Snapshot the listing. Log entries recorded after it started (by this or another process)
+    # may not be in it, so they are kept; the log is rewritten in place under its lock, so no
+    # append is lost in between.
+    def _save(self, rows: list[tuple], listed_at: float):
+        keys, sizes, etags = zip(*rows) if rows else ((), (), ())
+        table = pa.table({"key": keys, "size": sizes, "etag": etags}, schema=MANIFEST_SCHEMA)
+        table = table.replace_schema_metadata({"listed_at": str(listed_at)})
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        pq.write_table(table, tmp, compression="zstd")
+        os.replace(tmp, self.path)
+        self._snapshot_mtime = self.path.stat().st_mtime_ns
+        self.listed_at = listed_at
+        self._keys = np.array(keys, dtype=object)
+        self._sizes = np.array(sizes, dtype=np.int64)
+        self._etags = np.array(etags, dtype=object)
+        with open(self.log_path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            self._recorded = {k: v for k, v in _read_log(f).items() if v[2] >= listed_at}
+            f.truncate(0)
+            f.writelines(_log_line(key, size, etag, at) for key, (size, etag, at) in self._recorded.items())
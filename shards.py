@@ -0,0 +1,248 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import time
+
+import aioboto3
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+from codec import COMPRESSIONS, compress, decode_body, zstd_available
+
+# Packed corpus layout: documents are appended to JSONL shards of roughly shard_bytes, and an
+# index maps each doc_id to (shard, offset, length). Every line is compressed on its own (one
+# gzip member or zstd frame per document), so a whole shard is still an ordinary compressed
+# JSONL file while any single document can be read back with one Range GET. The index also keeps
+# the ETag and size of the object each document was packed from, so a re-exported document is
+# packed again and its newer entry supersedes the old one.
+#
+#   {prefix}shard-<run>-00000.jsonl.zst
+#   {prefix}index/shard-<run>-00000.parquet
+INDEX_SCHEMA = pa.schema([
+    ("doc_id", pa.string()),
+    ("shard", pa.string()),
+    ("offset", pa.int64()),
+    ("length", pa.int64()),
+    ("source_etag", pa.string()),
+    ("source_size", pa.int64()),
+])
+
+SHARD_SUFFIXES = {None: ".jsonl", "gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+
+# zstd where the interpreter has it (Python 3.14+, or the zstandard package), gzip otherwise
+DEFAULT_COMPRESSION = "zstd" if zstd_available() else "gzip"
+
+
+def open_s3_client():
+    load_dotenv()
+    return aioboto3.Session().client(
+        "s3",
+        aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
+        aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"],
+        region_name=os.environ["AWS_REGION"],
+    )
+
+
+# One JSON document per line: re-serialize compactly if the object was pretty-printed
+def to_jsonl_line(body: bytes) -> bytes:
+    body = body.strip()
+    if b"\n" in body:
+        body = json.dumps(json.loads(body), separators=(",", ":")).encode("utf-8")
+    return body + b"\n"
+
+
+class ShardWriter:
+    # Buffers compressed lines until shard_bytes, then uploads the shard followed by its index
+    # part. The index part is the commit point: a shard without one (a crash between the two
+    # uploads) is never referenced and is simply rewritten by the next compaction.
+    def __init__(
+        self, s3, bucket_name: str, prefix: str = "shards/", shard_bytes: int = 64 << 20, compression=DEFAULT_COMPRESSION
+    ):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"compression must be one of {COMPRESSIONS}")
+        if compression == "zstd" and not zstd_available():
+            raise ImportError("zstd compression needs Python 3.14+ or the zstandard package")
+        self._s3 = s3
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.shard_bytes = shard_bytes
+        self.compression = compression
+        self.shards_written = 0
+        # Seconds first, so part names still sort by run; the fraction keeps two runs started in
+        # the same second from overwriting each other's shards
+        now = time.time_ns()
+        self._run_id = f"{now // 10**9}.{now % 10**9:09d}-{os.getpid()}"
+        self._buffer = bytearray()
+        self._entries = []
+
+    # No awaits until the shard is full, so concurrent fetchers can add without a lock. etag and
+    # size are those of the source object it was packed from.
+    async def add(self, doc_id, body: bytes, etag: str, size: int):
+        member = compress(to_jsonl_line(body), self.compression)
+        self._entries.append((str(doc_id), len(self._buffer), len(member), etag, size))
+        self._buffer += member
+        if len(self._buffer) >= self.shard_bytes:
+            await self.flush()
+
+    async def flush(self):
+        if not self._entries:
+            return
+        data, entries = bytes(self._buffer), self._entries
+        self._buffer, self._entries = bytearray(), []
+        name = f"shard-{self._run_id}-{self.shards_written:05d}"
+        self.shards_written += 1
+        shard_key = f"{self.prefix}{name}{SHARD_SUFFIXES[self.compression]}"
+
+        await self._s3.put_object(Bucket=self.bucket_name, Key=shard_key, Body=data)
+        doc_ids, offsets, lengths, etags, sizes = zip(*entries)
+        table = pa.table(
+            {
+                "doc_id": doc_ids,
+                "shard": [shard_key] * len(entries),
+                "offset": offsets,
+                "length": lengths,
+                "source_etag": etags,
+                "source_size": sizes,
+            },
+            schema=INDEX_SCHEMA,
+        )
+        sink = io.BytesIO()
+        pq.write_table(table, sink, compression="zstd")
+        await self._s3.put_object(Bucket=self.bucket_name, Key=f"{self.prefix}index/{name}.parquet", Body=sink.getvalue())
+        print(f"Wrote {shard_key}: {len(entries)} documents, {len(data)} bytes")
+
+    async def close(self):
+        await self.flush()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+# Every index part under the prefix as one frame. A document compacted twice keeps its newest
+# entry (part names sort by run).
+async def load_shard_index(s3, bucket_name: str, prefix: str = "shards/") -> pd.DataFrame:
+    tables = []
+    paginator = s3.get_paginator("list_objects_v2")
+    async for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{prefix}index/"):
+        for obj in sorted(page.get("Contents", []), key=lambda o: o["Key"]):
+            res = await s3.get_object(Bucket=bucket_name, Key=obj["Key"])
+            tables.append(pq.read_table(io.BytesIO(await res["Body"].read())))
+    if not tables:
+        return INDEX_SCHEMA.empty_table().to_pandas()
+    index = pa.concat_tables(tables).to_pandas()
+    return index.drop_duplicates("doc_id", keep="last").reset_index(drop=True)
+
+
+# Random access: one Range GET for one document
+async def read_document(s3, bucket_name: str, shard: str, offset: int, length: int) -> bytes:
+    res = await s3.get_object(Bucket=bucket_name, Key=shard, Range=f"bytes={offset}-{offset + length - 1}")
+    return decode_body(await res["Body"].read())
+
+
+# Bulk access: stream a shard once and cut out the given entries (doc_id, offset, length) in
+# offset order, holding no more than one read chunk plus one document in memory
+async def iter_shard(s3, bucket_name: str, shard: str, entries, chunk_size: int = 1 << 20):
+    res = await s3.get_object(Bucket=bucket_name, Key=shard)
+    body = res["Body"]
+    try:
+        buffer = bytearray()
+        base = 0
+        for doc_id, offset, length in sorted(entries, key=lambda entry: entry[1]):
+            end = offset + length
+            while base + len(buffer) < end:
+                chunk = await body.read(chunk_size)
+                if not chunk:
+                    raise ValueError(f"{shard} ends before byte {end}")
+                buffer += chunk
+                # Drop the bytes of documents we weren't asked for as they stream past
+                if offset > base:
+                    skip = min(offset - base, len(buffer))
+                    del buffer[:skip]
+                    base += skip
+            start = offset - base
+            yield doc_id, decode_body(bytes(buffer[start:start + length]))
+            del buffer[:start + length]
+            base = end
+    finally:
+        body.close()
+
+
+# Compaction: pack every per-document {doc_id}.json object under source_prefix into shards,
+# skipping documents already in the index, so it can be rerun as new documents are exported.
+# A document whose object has a different ETag than the one it was packed from was re-exported
+# and is packed again.
+async def compact_bucket(
+    bucket_name: str,
+    source_prefix: str = "",
+    shard_prefix: str = "shards/",
+    shard_bytes: int = 64 << 20,
+    compression: str | None = DEFAULT_COMPRESSION,
+    fetch_concurrency: int = 16,
+) -> int:
+    async with open_s3_client() as s3:
+        index = await load_shard_index(s3, bucket_name, shard_prefix)
+        packed = dict(zip(index["doc_id"], index["source_etag"]))
+        key_queue = asyncio.Queue(maxsize=fetch_concurrency * 2)
+        compacted = 0
+
+        async with ShardWriter(s3, bucket_name, shard_prefix, shard_bytes, compression) as writer:
+
+            async def produce():
+                paginator = s3.get_paginator("list_objects_v2")
+                async for page in paginator.paginate(Bucket=bucket_name, Prefix=source_prefix):
+                    for obj in page.get("Contents", []):
+                        key = obj["Key"]
+                        if key.endswith(".json") and not key.startswith(shard_prefix):
+                            doc_id = key.rsplit("/", 1)[-1][:-len(".json")]
+                            if packed.get(doc_id) != obj["ETag"]:
+                                await key_queue.put(key)
+                for _ in range(fetch_concurrency):
+                    await key_queue.put(None)
+
+            async def fetch():
+                nonlocal compacted
+                while (key := await key_queue.get()) is not None:
+                    try:
+                        res = await s3.get_object(Bucket=bucket_name, Key=key)
+                        raw = await res["Body"].read()
+                        await writer.add(key.rsplit("/", 1)[-1][:-len(".json")], decode_body(raw), res["ETag"], len(raw))
+                        compacted += 1
+                    except Exception as e:
+                        print(f"Failed to compact {key}: {e}")
+
+            await asyncio.gather(produce(), *(fetch() for _ in range(fetch_concurrency)))
+
+    print(f"Compacted {compacted} documents into {writer.shards_written} shards")
+    return compacted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack per-document S3 objects into indexed JSONL shards")
+    parser.add_argument("bucket")
+    parser.add_argument("--source-prefix", default="")
+    parser.add_argument("--shard-prefix", default="shards/")
+    parser.add_argument("--shard-mb", type=int, default=64)
+    parser.add_argument("--compression", choices=("none", "gzip", "zstd"), default=DEFAULT_COMPRESSION)
+    parser.add_argument("--fetch-concurrency", type=int, default=16)
+    args = parser.parse_args()
+    if args.compression == "zstd" and not zstd_available():
+        parser.error("--compression zstd needs Python 3.14+ or the zstandard package")
+    asyncio.run(compact_bucket(
+        args.bucket,
+        source_prefix=args.source_prefix,
+        shard_prefix=args.shard_prefix,
+        shard_bytes=args.shard_mb << 20,
+        compression=None if args.compression == "none" else args.compression,
+        fetch_concurrency=args.fetch_concurrency,
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+import csv
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+DOC_SCHEMA = pa.schema([
+    ("doc_id", pa.string()),
+    ("title", pa.string()),
+    ("organization", pa.string()),
+    ("request_number", pa.string()),
+    ("description", pa.string()),
+    ("created_at", pa.string()),
+    ("page_count", pa.int32()),
+    ("file_size", pa.int64()),
+    ("token_total", pa.int64()),
+    ("token_avg_per_page", pa.float64()),
+    ("token_min", pa.int32()),
+    ("token_max", pa.int32()),
+    ("token_std_dev", pa.float64()),
+])
+
+PAGE_SCHEMA = pa.schema([
+    ("doc_id", pa.string()),
+    ("page_number", pa.int32()),
+    ("tokens_per_page", pa.int32()),
+])
+
+
+# Part names start with the run id, so they sort by run. Seconds come first; the fraction keeps
+# two runs started in the same second from overwriting each other's parts.
+def _new_run_id() -> str:
+    now = time.time_ns()
+    return f"{now // 10**9}.{now % 10**9:09d}-{os.getpid()}"
+
+
+# Extra token counters (see token_counters.py) add a total and a per-page column each, named
+# after the counter; the unsuffixed token columns always hold the first counter's counts
+def doc_schema(counter_names=()) -> pa.Schema:
+    return pa.schema(list(DOC_SCHEMA) + [(f"token_total_{name}", pa.int64()) for name in counter_names])
+
+
+# near_duplicate_of holds "doc_id:page_number" of the page a page nearly repeats (see near_dup.py),
+# quality the page's score from page_quality.py
+def page_schema(counter_names=(), near_duplicates: bool = False, page_quality: bool = False) -> pa.Schema:
+    fields = list(PAGE_SCHEMA) + [(f"tokens_per_page_{name}", pa.int32()) for name in counter_names]
+    if near_duplicates:
+        fields.append(("near_duplicate_of", pa.string()))
+    if page_quality:
+        fields.append(("quality", pa.float32()))
+    return pa.schema(fields)
+
+
+class _RowBuffer:
+    def __init__(self, schema: pa.Schema):
+        self.schema = schema
+        self.clear()
+
+    def clear(self):
+        self.columns = {name: [] for name in self.schema.names}
+        self.num_rows = 0
+        self.nbytes = 0
+
+    # Rough in-memory size: string lengths plus 8 bytes per numeric cell
+    def append(self, row: dict):
+        for name, values in self.columns.items():
+            value = row.get(name)
+            values.append(value)
+            self.nbytes += len(value) if isinstance(value, str) else 8
+        self.num_rows += 1
+
+    def to_table(self) -> pa.Table:
+        return pa.Table.from_pydict(self.columns, schema=self.schema)
+
+    def to_rows(self) -> list[list]:
+        return [list(row) for row in zip(*self.columns.values())]
+
+
+class ParquetStatsWriter:
+    # Buffers doc and page rows and, once flush_bytes is reached, writes one Parquet part file per
+    # table into the doc_path/page_path dataset directories. The page part is written first, so a
+    # doc part on disk always has its pages; page parts left without one by a crash are removed.
+    # A StatsSummary (see stats_summary.py) passed as summary is updated with every flushed batch.
+    def __init__(
+        self,
+        doc_path,
+        page_path,
+        flush_bytes: int = 64 << 20,
+        compression: str = "zstd",
+        on_flush=None,
+        counter_names=(),
+        near_duplicates: bool = False,
+        page_quality: bool = False,
+        summary=None,
+    ):
+        self.doc_path = Path(doc_path)
+        self.page_path = Path(page_path)
+        self.flush_bytes = flush_bytes
+        self.compression = compression
+        self.on_flush = on_flush
+        self.summary = summary
+        self.doc_path.mkdir(parents=True, exist_ok=True)
+        self.page_path.mkdir(parents=True, exist_ok=True)
+        self._docs = _RowBuffer(doc_schema(counter_names))
+        self._pages = _RowBuffer(page_schema(counter_names, near_duplicates, page_quality))
+        self._run_id = _new_run_id()
+        self._part = 0
+        self._remove_orphan_parts()
+
+    def _remove_orphan_parts(self):
+        doc_parts = {p.name for p in self.doc_path.glob("part-*.parquet")}
+        for page_part in self.page_path.glob("part-*.parquet"):
+            if page_part.name not in doc_parts:
+                print(f"Removing page rows without a matching doc part: {page_part}")
+                page_part.unlink()
+
+    def _write_part(self, table: pa.Table, directory: Path, name: str):
+        # Dot-prefixed temp files are ignored by Parquet dataset readers until renamed
+        tmp = directory / f".{name}.tmp"
+        pq.write_table(table, tmp, compression=self.compression)
+        os.replace(tmp, directory / name)
+
+    def write(self, doc_stats: dict, page_stats: list[dict]):
+        self._docs.append(doc_stats)
+        for row in page_stats:
+            self._pages.append(row)
+        if self._docs.nbytes + self._pages.nbytes >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        if not self._docs.num_rows:
+            return
+        name = f"part-{self._run_id}-{self._part:05d}.parquet"
+        self._write_part(self._pages.to_table(), self.page_path, name)
+        self._write_part(self._docs.to_table(), self.doc_path, name)
+        if self.summary is not None:
+            self.summary.update(self._docs.columns, self._pages.columns, part=name)
+        if self.on_flush:
+            self.on_flush(self._docs.columns["doc_id"], name)
+        self._docs.clear()
+        self._pages.clear()
+        self._part += 1
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CsvStatsWriter:
+    # Same interface as ParquetStatsWriter for CSV exports; headers are written when a file is
+    # created and rows are appended in size-based batches instead of once per document. Appending
+    # to a file whose header has other columns (a different set of token counters) is refused.
+    def __init__(
+        self,
+        doc_path,
+        page_path,
+        flush_bytes: int = 16 << 20,
+        on_flush=None,
+        counter_names=(),
+        near_duplicates=False,
+        page_quality=False,
+        summary=None,
+    ):
+        self.doc_path = Path(doc_path)
+        self.page_path = Path(page_path)
+        self.flush_bytes = flush_bytes
+        self.on_flush = on_flush
+        self.summary = summary
+        self._docs = _RowBuffer(doc_schema(counter_names))
+        self._pages = _RowBuffer(page_schema(counter_names, near_duplicates, page_quality))
+        for path, schema in ((self.doc_path, self._docs.schema), (self.page_path, self._pages.schema)):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if not path.exists() or path.stat().st_size == 0:
+                with open(path, "w", newline="") as f:
+                    csv.writer(f).writerow(schema.names)
+                continue
+            with open(path, newline="") as f:
+                header = next(csv.reader(f), [])
+            if header != schema.names:
+                raise ValueError(f"{path} has columns {header}, expected {schema.names}")
+
+    def write(self, doc_stats: dict, page_stats: list[dict]):
+        self._docs.append(doc_stats)
+        for row in page_stats:
+            self._pages.append(row)
+        if self._docs.nbytes + self._pages.nbytes >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        if not self._docs.num_rows:
+            return
+        with open(self.page_path, "a", newline="") as f:
+            csv.writer(f).writerows(self._pages.to_rows())
+        with open(self.doc_path, "a", newline="") as f:
+            csv.writer(f).writerows(self._docs.to_rows())
+        if self.summary is not None:
+            offsets = {"doc": self.doc_path.stat().st_size, "page": self.page_path.stat().st_size}
+            self.summary.update(self._docs.columns, self._pages.columns, csv_offsets=offsets)
+        if self.on_flush:
+            self.on_flush(self._docs.columns["doc_id"], None)
+        self._docs.clear()
+        self._pages.clear()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ParquetTableWriter:
+    # One-table counterpart of ParquetStatsWriter for other per-document outputs (summaries):
+    # rows are buffered and written as part files into the `path` dataset directory
+    def __init__(self, path, schema: pa.Schema, flush_bytes: int = 16 << 20, compression: str = "zstd", on_flush=None):
+        self.path = Path(path)
+        self.flush_bytes = flush_bytes
+        self.compression = compression
+        self.on_flush = on_flush
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._rows = _RowBuffer(schema)
+        self._run_id = _new_run_id()
+        self._part = 0
+
+    def write(self, row: dict):
+        self._rows.append(row)
+        if self._rows.nbytes >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        if not self._rows.num_rows:
+            return
+        name = f"part-{self._run_id}-{self._part:05d}.parquet"
+        tmp = self.path / f".{name}.tmp"
+        pq.write_table(self._rows.to_table(), tmp, compression=self.compression)
+        os.replace(tmp, self.path / name)
+        if self.on_flush:
+            self.on_flush(self._rows.columns["doc_id"], name)
+        self._rows.clear()
+        self._part += 1
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+STATS_WRITERS = {"parquet": ParquetStatsWriter, "csv": CsvStatsWriter}
+
+
+# on_flush(doc_ids, part_name) runs after each flush, once those rows are on disk
+def open_stats_writer(
+    output_format: str,
+    doc_path,
+    page_path,
+    flush_bytes: int | None = None,
+    on_flush=None,
+    counter_names=(),
+    near_duplicates: bool = False,
+    page_quality: bool = False,
+    summary=None,
+):
+    if output_format not in STATS_WRITERS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    kwargs = {"flush_bytes": flush_bytes} if flush_bytes else {}
+    return STATS_WRITERS[output_format](
+        doc_path,
+        page_path,
+        on_flush=on_flush,
+        counter_names=counter_names,
+        near_duplicates=near_duplicates,
+        page_quality=page_quality,
+        summary=summary,
+        **kwargs,
+    )
+
+
+def is_parquet_path(path) -> bool:
+    path = Path(path)
+    return path.is_dir() or path.suffix == ".parquet"
+
+
+# Read only the requested columns from either a Parquet dataset directory or a CSV file. Parts
+# written with different token counters are read against their merged schema, leaving the
+# columns a part doesn't have null.
+def read_stats_columns(path, columns: list[str] | None = None, dtype: dict | None = None) -> pd.DataFrame:
+    if is_parquet_path(path):
+        dataset = ds.dataset(path, format="parquet")
+        if Path(path).is_dir() and dataset.files:
+            schema = pa.unify_schemas([pq.read_schema(f) for f in dataset.files])
+            dataset = ds.dataset(path, schema=schema, format="parquet")
+        df = dataset.to_table(columns=columns).to_pandas()
+        return df.astype({k: v for k, v in (dtype or {}).items() if k in df.columns})
+    return pd.read_csv(path, usecols=columns, dtype=dtype)
@@ -1,30 +1,37 @@
 import os
-import json
-import csv
 import asyncio
-from asyncio import Semaphore, create_task, as_completed
+import time
 import aioboto3
+import numpy as np
 import pandas as pd
-import spacy
 from tqdm.asyncio import tqdm as async_tqdm
 from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from statistics import mean
 from pathlib import Path
 from dotenv import load_dotenv
+from codec import decode_body
+from doc_stream import in_page_order, iter_pages, read_header
+from ledger import STATS_STAGE, JobLedger
+from metrics import Metrics, SamplingProfiler, maybe_profile, report_periodically
+from s3_listing import S3Manifest
+from shards import iter_shard, load_shard_index, open_s3_client, read_document
+from stats_summary import StatsSummary, refresh_summary
+from stats_writer import is_parquet_path, open_stats_writer, read_stats_columns
+from near_dup import EMPTY, MinHasher, NearDuplicateIndex
+from page_quality import DEFAULT_MIN_QUALITY, PageQualityScorer
+from page_cache import PageCache, cached_count, report_stats
+from token_counters import counter_names, get_counters, init_counters
 
 
-def process_document_bytes(doc_bytes: bytes):
-    nlp = spacy.load("en_core_web_sm")
-    doc = json.loads(doc_bytes)
-
-    metadata = doc.get("metadata", {})
+# Pages that were not tokenized (see count_pages) have None counts: their page rows get null
+# tokens, and the per-document token stats cover the counted pages only
+def build_doc_stats(
+    doc_id: str, metadata: dict, num_pages: int, token_counts: list[int | None], extra_counts: dict | None = None
+):
     meta_data = metadata.get("data", {})
-
-    doc_id = str(doc.get("doc_id", ""))
-    pages = doc.get("text_json", {}).get("pages", [])
-    sorted_pages = sorted(pages, key=lambda x: x.get("page", 0))
-    texts = [page.get("contents", "") for page in sorted_pages]
-    token_counts = [len(nlp(page)) for page in texts]
+    extra_counts = extra_counts or {}
+    counted = [count for count in token_counts if count is not None]
 
     doc_stats = {
         "doc_id": doc_id,
@@ -33,75 +40,636 @@ def process_document_bytes(doc_bytes: bytes):
         "request_number": meta_data.get("request_number", [""])[0],
         "description": metadata.get("description", ""),
         "created_at": metadata.get("created_at", ""),
-        "page_count": metadata.get("page_count", len(pages)),
+        "page_count": metadata.get("page_count", num_pages),
         "file_size": int(meta_data.get("file_size", [0])[0]),
-        "token_total": sum(token_counts),
-        "token_avg_per_page": mean(token_counts) if token_counts else 0,
-        "token_min": min(token_counts) if token_counts else 0,
-        "token_max": max(token_counts) if token_counts else 0,
-        "token_std_dev": pd.Series(token_counts).std() if len(token_counts) > 1 else 0,
+        "token_total": sum(counted),
+        "token_avg_per_page": mean(counted) if counted else 0,
+        "token_min": min(counted) if counted else 0,
+        "token_max": max(counted) if counted else 0,
+        "token_std_dev": pd.Series(counted).std() if len(counted) > 1 else 0,
     }
+    for name, counts in extra_counts.items():
+        doc_stats[f"token_total_{name}"] = sum(count for count in counts if count is not None)
 
     page_stats = [
         {"doc_id": doc_id, "page_number": i, "tokens_per_page": count}
         for i, count in enumerate(token_counts)
     ]
+    for name, counts in extra_counts.items():
+        for row, count in zip(page_stats, counts):
+            row[f"tokens_per_page_{name}"] = count
 
     return doc_stats, page_stats
 
 
+# Per-page MinHash signatures travel with the counts under this key (counter names start with a
+# letter) and are attached to the page rows for the parent, which the writers ignore
+MINHASH_KEY = "_minhash"
+# Page-quality scores travel the same way and become the page rows' quality column
+QUALITY_KEY = "_quality"
+
+_page_cache: PageCache | None = None
+_minhasher: MinHasher | None = None
+_quality_scorer: PageQualityScorer | None = None
+_min_quality = 0.0
+# Parse and tokenize timings recorded in a worker, shipped back to the parent with each task's
+# result by run_stats_task
+_worker_metrics = Metrics()
+
+
+# ProcessPoolExecutor initializer: load the tokenizers, open the page cache and set up MinHash
+# and the page-quality scorer once per worker. With min_page_quality set, pages are scored and
+# those scoring below it are not tokenized.
+def init_stats_worker(
+    counter_specs: list[str],
+    batch_size: int = 64,
+    page_cache_path=None,
+    page_cache_bytes: int = 1 << 30,
+    near_duplicates: bool = False,
+    profile_path=None,
+    min_page_quality: float | None = None,
+):
+    global _page_cache, _minhasher, _quality_scorer, _min_quality
+    init_counters(counter_specs, batch_size)
+    _page_cache = PageCache(page_cache_path, page_cache_bytes) if page_cache_path else None
+    _minhasher = MinHasher() if near_duplicates else None
+    _quality_scorer = PageQualityScorer() if min_page_quality is not None else None
+    _min_quality = min_page_quality or 0.0
+    if profile_path:
+        # Pool workers exit without running atexit handlers; multiprocessing finalizers do run
+        from multiprocessing.util import Finalize
+        profiler = SamplingProfiler(f"{profile_path}.worker-{os.getpid()}").start()
+        Finalize(profiler, profiler.stop, exitpriority=10)
+
+
+# Page-quality scores for a chunk of pages and the indexes of the pages worth tokenizing
+def _score_chunk(chunk: list[str]) -> tuple[list[float], np.ndarray]:
+    start = time.perf_counter()
+    scores = _quality_scorer.score(chunk)
+    keep = np.flatnonzero(scores >= _min_quality)
+    _worker_metrics.observe("stage_seconds", time.perf_counter() - start, stage="quality")
+    if len(keep) < len(chunk):
+        _worker_metrics.inc("low_quality_pages_total", len(chunk) - len(keep))
+    return scores.astype(np.float64).round(3).tolist(), keep
+
+
+# {counter name: per-page counts} for every configured counter. Pages are pulled in chunks, so
+# several counters can share one pass over a streamed document. Pages the quality scorer skips
+# count None (not 0, which would drag down the document's token stats) and get an empty MinHash
+# signature.
+def count_pages(texts, chunk_pages: int = 256) -> dict:
+    counters = get_counters()
+    counts = {counter.name: [] for counter in counters}
+    if _minhasher:
+        counts[MINHASH_KEY] = []
+    if _quality_scorer:
+        counts[QUALITY_KEY] = []
+    texts = iter(texts)
+    seconds = 0.0
+    while chunk := list(islice(texts, chunk_pages)):
+        keep = None
+        if _quality_scorer:
+            scores, keep = _score_chunk(chunk)
+            counts[QUALITY_KEY].extend(scores)
+            keep = keep if len(keep) < len(chunk) else None
+        kept = chunk if keep is None else [chunk[i] for i in keep]
+        start = time.perf_counter()
+        for counter in counters:
+            values = cached_count(counter, kept, _page_cache) if _page_cache else counter.count(kept)
+            if keep is not None:
+                spread = [None] * len(chunk)
+                for i, value in zip(keep.tolist(), values):
+                    spread[i] = value
+                values = spread
+            counts[counter.name].extend(values)
+        if _minhasher:
+            signatures = _minhasher.signatures(kept)
+            if keep is not None:
+                spread = np.full((len(chunk), signatures.shape[1]), EMPTY, dtype=np.uint32)
+                spread[keep] = signatures
+                signatures = spread
+            counts[MINHASH_KEY].extend(signature.tobytes() for signature in signatures)
+        seconds += time.perf_counter() - start
+    _worker_metrics.observe("stage_seconds", seconds, stage="tokenize")
+    return counts
+
+
+# The first counter fills the token_* columns, the others their own suffixed columns
+def stats_from_counts(doc_id, metadata: dict, page_numbers: list, counts: dict):
+    counts = {name: in_page_order(page_numbers, values) for name, values in counts.items()}
+    signatures = counts.pop(MINHASH_KEY, None)
+    quality = counts.pop(QUALITY_KEY, None)
+    primary, *extra = counts
+    token_counts = counts[primary]
+    doc_stats, page_stats = build_doc_stats(
+        str(doc_id if doc_id is not None else ""),
+        metadata,
+        len(token_counts),
+        token_counts,
+        {name: counts[name] for name in extra},
+    )
+    if signatures is not None:
+        for row, signature in zip(page_stats, signatures):
+            row[MINHASH_KEY] = signature
+    if quality is not None:
+        for row, score in zip(page_stats, quality):
+            row["quality"] = score
+    return doc_stats, page_stats
+
+
+# Pages are decoded and tokenized a chunk at a time; only their numbers and counts are kept, and
+# the counts are put back in page order at the end
+def process_document_bytes(doc_bytes: bytes):
+    start = time.perf_counter()
+    doc_id, metadata = read_header(doc_bytes)
+    page_numbers = []
+    parse_seconds = time.perf_counter() - start
+
+    def page_texts():
+        nonlocal parse_seconds
+        pages = iter_pages(doc_bytes)
+        while True:
+            start = time.perf_counter()
+            page = next(pages, None)
+            parse_seconds += time.perf_counter() - start
+            if page is None:
+                return
+            page_numbers.append(page.get("page", 0))
+            yield page.get("contents", "")
+
+    counts = count_pages(page_texts())
+    _worker_metrics.observe("stage_seconds", parse_seconds, stage="parse")
+    return stats_from_counts(doc_id, metadata, page_numbers, counts)
+
+
+# Fill near_duplicate_of for a document's page rows from their MinHash signatures; returns the
+# tokens on pages found to be near duplicates
+def mark_near_duplicates(index: NearDuplicateIndex, page_stats: list[dict]) -> int:
+    signatures = [row.pop(MINHASH_KEY) for row in page_stats]
+    if not page_stats:
+        return 0
+    keys = [f"{row['doc_id']}:{row['page_number']}" for row in page_stats]
+    signatures = np.frombuffer(b"".join(signatures), dtype=np.uint32).reshape(len(page_stats), -1)
+    tokens = 0
+    for row, duplicate_of in zip(page_stats, index.add_many(keys, signatures)):
+        row["near_duplicate_of"] = duplicate_of
+        if duplicate_of:
+            tokens += row["tokens_per_page"] or 0
+    return tokens
+
+
+# Worker entry point for a group of small documents; one failure doesn't sink the batch
+def process_document_batch(bodies: list[bytes]) -> list[tuple]:
+    results = []
+    for body in bodies:
+        try:
+            results.append((process_document_bytes(body), None))
+        except Exception as e:
+            results.append((None, repr(e)))
+    return results
+
+
+# Worker entry point for one page range of a document too large for a single task
+def count_page_range(texts: list[str]) -> dict:
+    return count_pages(texts)
+
+
+# What DocumentScheduler actually submits: the task's result plus the worker's metrics since its
+# last task, including the time the worker was busy
+def run_stats_task(fn, arg):
+    start = time.perf_counter()
+    result = fn(arg)
+    _worker_metrics.inc("worker_busy_seconds", time.perf_counter() - start)
+    return result, _worker_metrics.drain()
+
+
+class _SplitDocument:
+    def __init__(self, doc_id, metadata: dict):
+        self.doc_id = doc_id
+        self.metadata = metadata
+        self.page_numbers = []
+        self.parts = []
+        self.remaining = 0
+        self.error = None
+
+
+class DocumentScheduler:
+    # Keeps up to max_in_flight tasks outstanding on the pool. Documents under batch_bytes are
+    # grouped to cut IPC overhead, documents over split_bytes are split into page ranges that run
+    # on several workers. Rows come back in completion order but match a serial run exactly.
+    # Worker-side timings are merged into metrics, if given.
+    def __init__(
+        self,
+        pool,
+        workers: int,
+        max_in_flight: int | None = None,
+        batch_bytes: int = 1 << 20,
+        batch_max_docs: int = 32,
+        split_bytes: int = 8 << 20,
+        pages_per_task: int = 256,
+        metrics: Metrics | None = None,
+    ):
+        self._pool = pool
+        self.metrics = metrics
+        self.workers = workers
+        self.max_in_flight = max_in_flight or workers * 2
+        self.batch_bytes = batch_bytes
+        self.batch_max_docs = batch_max_docs
+        self.split_bytes = split_bytes
+        self.pages_per_task = pages_per_task
+        self._pending = {}
+        self._batch = []
+        self._batch_ids = []
+        self._batch_size = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    def _submit(self, fn, arg, job):
+        loop = asyncio.get_running_loop()
+        self._pending[loop.run_in_executor(self._pool, run_stats_task, fn, arg)] = job
+
+    def _result(self, future):
+        result, delta = future.result()
+        if self.metrics is not None:
+            self.metrics.merge(delta)
+        return result
+
+    def _flush_batch(self):
+        if self._batch:
+            self._submit(process_document_batch, self._batch, ("batch", self._batch_ids))
+            self._batch, self._batch_ids, self._batch_size = [], [], 0
+
+    # Pages are read incrementally and shipped in runs of pages_per_task as they are decoded.
+    # Parsing a document this size takes a while, so it runs in a thread and hands each run back
+    # to the event loop to submit; the fetchers keep going in the meantime.
+    async def _submit_split(self, doc_id, body: bytes):
+        loop = asyncio.get_running_loop()
+        split = _SplitDocument(doc_id, None)
+
+        def read_pages():
+            _, split.metadata = read_header(body)
+            texts = []
+            for page in iter_pages(body):
+                split.page_numbers.append(page.get("page", 0))
+                texts.append(page.get("contents", ""))
+                if len(texts) == self.pages_per_task:
+                    loop.call_soon_threadsafe(self._submit_split_part, split, texts)
+                    texts = []
+            if texts:
+                loop.call_soon_threadsafe(self._submit_split_part, split, texts)
+
+        # The thread's submissions are queued on the loop ahead of its completion, so every part
+        # is submitted by the time this returns. A document that fails partway through is
+        # reported once its submitted parts are back.
+        try:
+            await asyncio.to_thread(read_pages)
+        except Exception as e:
+            if not split.parts:
+                raise
+            split.error = repr(e)
+            return None
+        if not split.parts:
+            return doc_id, build_doc_stats(str(doc_id), split.metadata, 0, []), None
+        return None
+
+    def _submit_split_part(self, split: _SplitDocument, texts: list[str]):
+        split.parts.append(None)
+        split.remaining += 1
+        self._submit(count_page_range, texts, ("split", split, len(split.parts) - 1))
+
+    # Returns (doc_id, (doc_stats, page_stats), error) for every document the done futures finish
+    def _collect(self, done) -> list[tuple]:
+        finished = []
+        for future in done:
+            job = self._pending.pop(future)
+            kind = job[0]
+            if kind == "batch":
+                doc_ids = job[1]
+                try:
+                    outcomes = self._result(future)
+                except Exception as e:
+                    outcomes = [(None, repr(e))] * len(doc_ids)
+                finished.extend((doc_id, result, error) for doc_id, (result, error) in zip(doc_ids, outcomes))
+            else:
+                split, part = job[1], job[2]
+                try:
+                    split.parts[part] = self._result(future)
+                except Exception as e:
+                    split.error = repr(e)
+                split.remaining -= 1
+                if split.remaining == 0:
+                    if split.error:
+                        finished.append((split.doc_id, None, split.error))
+                    else:
+                        counts = {
+                            name: [count for part in split.parts for count in part[name]]
+                            for name in split.parts[0]
+                        }
+                        result = stats_from_counts(split.doc_id, split.metadata, split.page_numbers, counts)
+                        finished.append((split.doc_id, result, None))
+        return finished
+
+    async def _wait(self, return_when):
+        done, _ = await asyncio.wait(self._pending, return_when=return_when)
+        return self._collect(done)
+
+    async def run(self, docs):
+        async for doc_id, body in docs:
+            if len(body) >= self.split_bytes:
+                try:
+                    finished = await self._submit_split(doc_id, body)
+                except Exception as e:
+                    finished = doc_id, None, repr(e)
+                if finished:
+                    yield finished
+            else:
+                self._batch.append(body)
+                self._batch_ids.append(doc_id)
+                self._batch_size += len(body)
+                # Ship partial batches while cores are idle so small corpora still spread out
+                if (
+                    self._batch_size >= self.batch_bytes
+                    or len(self._batch) >= self.batch_max_docs
+                    or len(self._pending) < self.workers
+                ):
+                    self._flush_batch()
+
+            while len(self._pending) >= self.max_in_flight:
+                for finished in await self._wait(asyncio.FIRST_COMPLETED):
+                    yield finished
+            if self._pending:
+                done = [future for future in self._pending if future.done()]
+                for finished in self._collect(done):
+                    yield finished
+
+        self._flush_batch()
+        while self._pending:
+            for finished in await self._wait(asyncio.FIRST_COMPLETED):
+                yield finished
+
+
 class DocumentStatsCollector:
-    def __init__(self, bucket_name: str, prefix: str = "", workers: int = 4):
+    def __init__(
+        self,
+        bucket_name: str,
+        prefix: str = "",
+        workers: int = 4,
+        spacy_model: str = "en_core_web_sm",
+        nlp_batch_size: int = 64,
+        fetch_concurrency: int = 10,
+        prefetch_queue_size: int = 32,
+        max_in_flight: int | None = None,
+        batch_bytes: int = 1 << 20,
+        split_bytes: int = 8 << 20,
+        pages_per_task: int = 256,
+        output_format: str = "parquet",
+        ledger_path: str = "data/ledger.sqlite3",
+        layout: str = "objects",
+        shard_prefix: str = "shards/",
+        token_counters: list[str] | None = None,
+        page_cache_path: str | None = None,
+        page_cache_bytes: int = 1 << 30,
+        near_duplicates: bool = False,
+        near_duplicate_threshold: float = 0.8,
+        page_quality: bool = False,
+        min_page_quality: float = DEFAULT_MIN_QUALITY,
+        metrics_path: str | None = "data/metrics/stats.prom",
+        metrics_interval: float = 15.0,
+        profile_path: str | None = None,
+        listing_max_age: float = 3600.0,
+        max_errors: int = 3,
+    ):
         load_dotenv()
         self._S3_BUCKET = bucket_name
         self.prefix = prefix
         self.workers = workers
-        self.doc_csv_path = Path("data/document_stats.csv")
-        self.page_csv_path = Path("data/page_token_counts.csv")
-        self.already_summed_docs = set()
-        self._load_existing_doc_ids()
-
-    def _load_existing_doc_ids(self):
-        if self.doc_csv_path.exists():
-            with open(self.doc_csv_path, newline="") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    self.already_summed_docs.add(row["doc_id"])
-            print(f"Resuming from {len(self.already_summed_docs)} documents already processed.")
-
-    def list_s3_keys(self):
-        import boto3
-        client = boto3.client(
-            "s3",
-            aws_access_key_id=os.environ["AWS_ACCESS_KEY_ID"],
-            aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"],
-            region_name=os.environ["AWS_REGION"]
-        )
-        paginator = client.get_paginator("list_objects_v2")
-        for page in paginator.paginate(Bucket=self._S3_BUCKET, Prefix=self.prefix):
-            for obj in page.get("Contents", []):
-                if obj["Key"].endswith(".json"):
-                    yield obj["Key"]
-
-    async def fetch_document(self, s3, key, semaphore):
-        async with semaphore:
+        self.spacy_model = spacy_model
+        self.nlp_batch_size = nlp_batch_size
+        self.fetch_concurrency = fetch_concurrency
+        self.prefetch_queue_size = prefetch_queue_size
+        self.max_in_flight = max_in_flight
+        self.batch_bytes = batch_bytes
+        self.split_bytes = split_bytes
+        self.pages_per_task = pages_per_task
+        self._doc_queue = None
+        self._stream_stage = STATS_STAGE
+        self._fetches_in_flight = 0
+        self._fetched_count = 0
+        self._fetch_failed_count = 0
+        if layout not in ("objects", "shards"):
+            raise ValueError(f"Unknown layout: {layout}")
+        self.layout = layout
+        self.shard_prefix = shard_prefix
+        # Token counter specs (see token_counters.py); the first one fills the token_* columns
+        self.token_counters = token_counters or [f"spacy:{spacy_model}"]
+        self.counter_names = counter_names(self.token_counters)
+        # Counts of pages seen before (by exact text) come from the shared page cache
+        self.page_cache_path = page_cache_path
+        self.page_cache_bytes = page_cache_bytes
+        # Pages close to one already seen get its "doc_id:page_number" in near_duplicate_of. The
+        # index's representatives are saved on every flush, so later runs compare against them too.
+        self.near_duplicates = near_duplicates
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self._near_duplicate_index = None
+        # Pages get a quality score (see page_quality.py) in a quality column; those scoring below
+        # min_page_quality (blank scans, OCR noise) are not tokenized: their tokens are null and
+        # they are left out of the document's token stats. 0 only records the scores.
+        self.page_quality = page_quality
+        self.min_page_quality = min_page_quality
+        self.output_format = output_format
+        suffix = ".csv" if output_format == "csv" else ""
+        self.doc_stats_path = Path(f"data/document_stats{suffix}")
+        self.page_stats_path = Path(f"data/page_token_counts{suffix}")
+        # Mergeable summaries of the stats (see stats_summary.py), updated on every flush
+        self.summary_path = Path(f"data/stats_summary{'_csv' if output_format == 'csv' else ''}.npz")
+        self.near_duplicate_index_path = Path(f"data/near_duplicates{'_csv' if output_format == 'csv' else ''}.sqlite3")
+        self._summary = None
+        # Per-stage latencies (S3 GET, parse, tokenize, write; the worker-side ones merged back
+        # from the pool) and document counts, written to metrics_path every metrics_interval
+        # seconds. profile_path (or $OBD_PROFILE) samples this process and, per worker, each pool
+        # worker into <profile_path>.worker-<pid>.
+        self.metrics = Metrics()
+        self.metrics_path = metrics_path
+        self.metrics_interval = metrics_interval
+        self.profile_path = profile_path or os.environ.get("OBD_PROFILE")
+        self.metrics.gauge("fetches_in_flight", lambda: self._fetches_in_flight)
+        self.metrics.gauge("prefetch_queue_depth", lambda: self._doc_queue.qsize() if self._doc_queue else 0)
+        # Keys come from the bucket manifest next to the ledger (see s3_listing.py), re-listed
+        # concurrently when it is older than listing_max_age seconds; the exporter records its
+        # uploads in it in between
+        self.manifest = S3Manifest(bucket_name, prefix, directory=Path(ledger_path).parent / "s3_manifest")
+        self.listing_max_age = listing_max_age
+        self._ledger = JobLedger(ledger_path)
+        # Documents that failed max_errors times are not fetched again, as on the export side
+        self.max_errors = max_errors
+        self._sync_ledger_with_stats()
+
+    # Mark rows already on disk but missing from the ledger as tokenized: every row the first time
+    # a ledger sees these files, afterwards only parts written after the last committed flush
+    def _sync_ledger_with_stats(self):
+        if self.doc_stats_path.exists():
+            if is_parquet_path(self.doc_stats_path):
+                last_part = self._ledger.get_meta("stats_last_part", "")
+                parts = sorted(p for p in self.doc_stats_path.glob("part-*.parquet") if p.name > last_part)
+                for part in parts:
+                    self._ledger.record_many(read_stats_columns(part, ["doc_id"])["doc_id"], STATS_STAGE, "tokenized")
+                if parts:
+                    self._ledger.flush()
+                    self._ledger.set_meta("stats_last_part", parts[-1].name)
+            elif not self._ledger.get_meta("stats_csv_imported"):
+                doc_ids = read_stats_columns(self.doc_stats_path, ["doc_id"], dtype={"doc_id": str})["doc_id"]
+                self._ledger.record_many(doc_ids, STATS_STAGE, "tokenized")
+                self._ledger.flush()
+                self._ledger.set_meta("stats_csv_imported", self.doc_stats_path)
+        done = self._ledger.count(STATS_STAGE, ("tokenized",))
+        if done:
+            print(f"Resuming from {done} documents already processed.")
+
+    # Writer callback: the flushed rows are on disk, so commit them to the ledger in one batch
+    def _commit_flushed(self, doc_ids, part_name):
+        self._ledger.record_many(doc_ids, STATS_STAGE, "tokenized")
+        self._ledger.flush()
+        if part_name:
+            self._ledger.set_meta("stats_last_part", part_name)
+        if self._summary is not None:
+            self._summary.save(self.summary_path)
+        if self._near_duplicate_index is not None:
+            self._near_duplicate_index.save(self.near_duplicate_index_path)
+
+    async def _list_keys(self, s3) -> list[str]:
+        with self.metrics.time("stage_seconds", stage="s3_listing"):
+            changes = await self.manifest.refresh(s3, self.listing_max_age, concurrency=self.fetch_concurrency)
+        if any(changes.values()):
+            print(f"S3 listing: {changes['added']} added, {changes['changed']} changed and "
+                  f"{changes['removed']} removed objects since the last listing")
+        return self.manifest.keys(".json")
+
+    def list_s3_keys(self) -> list[str]:
+        async def list_keys():
+            async with open_s3_client() as s3:
+                return await self._list_keys(s3)
+
+        return asyncio.run(list_keys())
+
+    # Of doc_ids, the ones the ledger doesn't have as tokenized, in one lookup for the batch
+    def filter_untokenized(self, doc_ids) -> list:
+        doc_ids = list(doc_ids)
+        pending = self._ledger.not_done_mask([str(doc_id) for doc_id in doc_ids], STATS_STAGE)
+        return [doc_id for doc_id, todo in zip(doc_ids, pending) if todo]
+
+    # Live view of the prefetch pipeline: GETs in flight and how full the handoff queue is
+    def prefetch_status(self) -> dict:
+        queue = self._doc_queue
+        return {
+            "in_flight": self._fetches_in_flight,
+            "fetched": self._fetched_count,
+            "failed": self._fetch_failed_count,
+            "queued": queue.qsize() if queue is not None else 0,
+            "queue_max": queue.maxsize if queue is not None else self.prefetch_queue_size,
+        }
+
+    # Producer: list keys and hand them to the fetchers, skipping docs the ledger has as tokenized
+    async def _produce_keys(self, s3, key_queue: asyncio.Queue, num_fetchers: int):
+        try:
+            keys = await self._list_keys(s3)
+            given_up = self._ledger.given_up_ids(self._stream_stage, self.max_errors)
+            for start in range(0, len(keys), 1000):
+                page = keys[start:start + 1000]
+                doc_ids = [key.split(".")[0] for key in page]
+                pending = self._ledger.not_done_mask(doc_ids, self._stream_stage)
+                for key, doc_id, todo in zip(page, doc_ids, pending):
+                    if todo and doc_id not in given_up:
+                        await key_queue.put(key)
+        except Exception as e:
+            print(f"Failed to list objects in S3: {e}")
+        for _ in range(num_fetchers):
+            await key_queue.put(None)
+
+    # Fetcher: GET and decode one object at a time; the bounded doc queue applies backpressure
+    async def _fetch_keys(self, s3, key_queue: asyncio.Queue, doc_queue: asyncio.Queue):
+        while True:
+            key = await key_queue.get()
+            if key is None:
+                break
+            self._fetches_in_flight += 1
             try:
-                print(f"Fetching: {key}")
-                response = await s3.get_object(Bucket=self._S3_BUCKET, Key=key)
-                body = await response["Body"].read()
-                print(f"Fetched: {key}")
-                doc = json.loads(body)
-                doc_id = doc.get("doc_id")
-                if doc_id in self.already_summed_docs:
-                    return None, None
-                return doc_id, body
+                with self.metrics.time("stage_seconds", stage="s3_get"):
+                    response = await s3.get_object(Bucket=self._S3_BUCKET, Key=key)
+                    body = decode_body(await response["Body"].read())
             except Exception as e:
+                self._fetch_failed_count += 1
+                self.metrics.inc("fetch_failures_total")
                 print(f"Failed to fetch {key}: {e}")
-                return None, None
+                continue
+            finally:
+                self._fetches_in_flight -= 1
+            try:
+                doc_id, _ = read_header(body)
+            except ValueError as e:
+                self._fetch_failed_count += 1
+                self.metrics.inc("fetch_failures_total")
+                print(f"Failed to decode {key}: {e}")
+                continue
+            self._fetched_count += 1
+            if doc_id:
+                await doc_queue.put((doc_id, body))
+
+    # Shards-layout producer: group pending documents by shard from the index. A shard that is
+    # mostly pending is streamed whole; for the rest only the pending documents are range-read.
+    async def _produce_shards(self, s3, work_queue: asyncio.Queue, num_fetchers: int):
+        try:
+            index = await load_shard_index(s3, self._S3_BUCKET, self.shard_prefix)
+            given_up = self._ledger.given_up_ids(self._stream_stage, self.max_errors)
+            pending = self._ledger.not_done_mask(index["doc_id"], self._stream_stage)
+            index["pending"] = pending & ~index["doc_id"].isin(given_up)
+            for shard, entries in index.groupby("shard", sort=True):
+                todo = entries[entries["pending"]]
+                if len(todo):
+                    rows = list(todo[["doc_id", "offset", "length"]].itertuples(index=False, name=None))
+                    await work_queue.put((shard, rows, 2 * len(todo) >= len(entries)))
+        except Exception as e:
+            print(f"Failed to read the shard index: {e}")
+        for _ in range(num_fetchers):
+            await work_queue.put(None)
 
-    async def stream_docs(self, semaphore_limit=10):
+    async def _fetch_shards(self, s3, work_queue: asyncio.Queue, doc_queue: asyncio.Queue):
+        while True:
+            work = await work_queue.get()
+            if work is None:
+                break
+            shard, rows, stream_whole = work
+            self._fetches_in_flight += 1
+            try:
+                if stream_whole:
+                    # Time spent waiting on the queue is part of this, so it's its own stage
+                    with self.metrics.time("stage_seconds", stage="s3_get_shard"):
+                        async for doc_id, body in iter_shard(s3, self._S3_BUCKET, shard, rows):
+                            self._fetched_count += 1
+                            await doc_queue.put((doc_id, body))
+                else:
+                    for doc_id, offset, length in rows:
+                        with self.metrics.time("stage_seconds", stage="s3_get"):
+                            body = await read_document(s3, self._S3_BUCKET, shard, offset, length)
+                        self._fetched_count += 1
+                        await doc_queue.put((doc_id, body))
+            except Exception as e:
+                self._fetch_failed_count += 1
+                self.metrics.inc("fetch_failures_total")
+                print(f"Failed to read {shard}: {e}")
+            finally:
+                self._fetches_in_flight -= 1
+
+    # Yields (doc_id, body) for every document not yet done for `stage` in the ledger, so later
+    # stages (summarization) can stream the corpus with the same resume logic
+    async def stream_docs(
+        self, fetch_concurrency: int | None = None, queue_size: int | None = None, stage: str = STATS_STAGE
+    ):
+        fetch_concurrency = fetch_concurrency or self.fetch_concurrency
+        queue_size = queue_size or self.prefetch_queue_size
+        self._stream_stage = stage
         session = aioboto3.Session()
-        semaphore = asyncio.Semaphore(semaphore_limit)
 
         async with session.client(
                 "s3",
@@ -109,65 +677,139 @@ class DocumentStatsCollector:
                 aws_secret_access_key=os.environ["AWS_SECRET_ACCESS_KEY"],
                 region_name=os.environ["AWS_REGION"]
         ) as s3:
-            for key in self.list_s3_keys():
-                if key.split(".")[0] in self.already_summed_docs:
-                    continue
-                async with semaphore:
-                    try:
-                        response = await s3.get_object(Bucket=self._S3_BUCKET, Key=key)
-                        body = await response["Body"].read()
-                        doc = json.loads(body)
-                        doc_id = doc.get("doc_id")
-                        if not doc_id:
-                            continue
-                        yield doc_id, body
-                    except Exception as e:
-                        print(f"Failed to fetch {key}: {e}")
-
-    async def process_documents_async(self):
-
-        # Get a streaming async generator of doc_id + body
-        loop = asyncio.get_running_loop()
-        processed = 0
-
-        with ProcessPoolExecutor(max_workers=self.workers) as pool:
-            async for doc_id, body in async_tqdm(self.stream_docs(), desc="Processing docs"):
-                try:
-                    future = loop.run_in_executor(pool, process_document_bytes, body)
-                    doc_stats, page_stats = await future
-
-                    with open(self.doc_csv_path, "a", newline="") as f:
-                        writer = csv.writer(f)
-                        writer.writerow(list(doc_stats.values()))
-
-                    with open(self.page_csv_path, "a", newline="") as f:
-                        writer = csv.writer(f)
-                        writer.writerows([
-                            [r["doc_id"], r["page_number"], r["tokens_per_page"]] for r in page_stats
-                        ])
-                    self.already_summed_docs.add(doc_id)
-                    print(f"Wrote doc: {doc_id}")
-                    processed += 1
-                except Exception as e:
-                    print(f"Failed to process {doc_id}: {e}")
+            key_queue = asyncio.Queue(maxsize=fetch_concurrency * 2)
+            doc_queue = asyncio.Queue(maxsize=queue_size)
+            self._doc_queue = doc_queue
 
-        # Change the column names at the end
-        try:
-            doc_cols = [
-                "doc_id", "title", "organization", "request_number", "description",
-                "created_at", "page_count", "file_size", "token_total",
-                "token_avg_per_page", "token_min", "token_max", "token_std_dev"
+            if self.layout == "shards":
+                produce, fetch = self._produce_shards, self._fetch_shards
+            else:
+                produce, fetch = self._produce_keys, self._fetch_keys
+            producer = asyncio.create_task(produce(s3, key_queue, fetch_concurrency))
+            fetchers = [
+                asyncio.create_task(fetch(s3, key_queue, doc_queue))
+                for _ in range(fetch_concurrency)
             ]
-            page_cols = ["doc_id", "page_number", "tokens_per_page"]
 
-            doc_df = pd.read_csv(self.doc_csv_path, header=None)
-            doc_df.columns = doc_cols
-            doc_df.to_csv(self.doc_csv_path, index=False)
+            # Close the doc queue once every fetcher has drained the key queue
+            async def close_when_done():
+                await asyncio.gather(producer, *fetchers)
+                await doc_queue.put(None)
 
-            page_df = pd.read_csv(self.page_csv_path, header=None)
-            page_df.columns = page_cols
-            page_df.to_csv(self.page_csv_path, index=False)
+            closer = asyncio.create_task(close_when_done())
+            try:
+                while True:
+                    item = await doc_queue.get()
+                    if item is None:
+                        break
+                    yield item
+            finally:
+                for task in (producer, *fetchers, closer):
+                    task.cancel()
+                await asyncio.gather(producer, *fetchers, closer, return_exceptions=True)
+                self._doc_queue = None
 
-            print(f"Added headers to CSVs after writing {processed} documents.")
-        except Exception as e:
-            print(f"Failed to add CSV headers: {e}")
+    # docs is an async iterable of (doc_id, body) to tokenize instead of streaming the pending
+    # documents from S3; a fused run (ingest.py) passes the documents the exporter uploads
+    async def process_documents_async(self, docs=None):
+        processed = 0
+        cache_stats = None
+        if self.page_cache_path:
+            with PageCache(self.page_cache_path, self.page_cache_bytes) as cache:
+                cache_stats = cache.stats()
+        index = None
+        if self.near_duplicates:
+            index = NearDuplicateIndex(threshold=self.near_duplicate_threshold)
+            loaded = index.load(self.near_duplicate_index_path)
+            if loaded:
+                print(f"Loaded {loaded} near-duplicate representatives from earlier runs.")
+        self._near_duplicate_index = index
+        duplicate_tokens = 0
+        # Catch the summary up with stats written without it (or not saved before a crash)
+        self._summary = StatsSummary.load_or_new(self.summary_path)
+        added = refresh_summary(self._summary, self.doc_stats_path, self.page_stats_path)
+        if added:
+            self._summary.save(self.summary_path)
+            print(f"Summarized {added} documents already in the stats files.")
+
+        # Each worker loads its tokenizers once instead of once per document
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=init_stats_worker,
+            initargs=(
+                self.token_counters,
+                self.nlp_batch_size,
+                self.page_cache_path,
+                self.page_cache_bytes,
+                self.near_duplicates,
+                self.profile_path,
+                self.min_page_quality if self.page_quality else None,
+            ),
+        ) as pool, open_stats_writer(
+            self.output_format,
+            self.doc_stats_path,
+            self.page_stats_path,
+            on_flush=self._commit_flushed,
+            counter_names=self.counter_names[1:],
+            near_duplicates=self.near_duplicates,
+            page_quality=self.page_quality,
+            summary=self._summary,
+        ) as writer, maybe_profile(self.profile_path):
+            scheduler = DocumentScheduler(
+                pool,
+                workers=self.workers,
+                max_in_flight=self.max_in_flight,
+                batch_bytes=self.batch_bytes,
+                split_bytes=self.split_bytes,
+                pages_per_task=self.pages_per_task,
+                metrics=self.metrics,
+            )
+            started = time.monotonic()
+            self.metrics.gauge("tasks_in_flight", lambda: scheduler.in_flight)
+            # Share of the pool's time spent in tasks, over the run so far
+            self.metrics.gauge(
+                "worker_utilization",
+                lambda: self.metrics.counter("worker_busy_seconds") / (self.workers * (time.monotonic() - started)),
+            )
+            reporter = asyncio.create_task(
+                report_periodically(self.metrics, self.metrics_path, self.metrics_interval)
+            )
+            try:
+                progress = async_tqdm(scheduler.run(self.stream_docs() if docs is None else docs), desc="Processing docs")
+                async for doc_id, result, error in progress:
+                    status = self.prefetch_status()
+                    progress.set_postfix(
+                        in_flight=status["in_flight"],
+                        queue=f"{status['queued']}/{status['queue_max']}",
+                        tasks=scheduler.in_flight,
+                        refresh=False,
+                    )
+                    if error:
+                        self._ledger.record(doc_id, STATS_STAGE, "failed", error=error)
+                        self.metrics.inc("documents_total", status="failed")
+                        print(f"Failed to process {doc_id}: {error}")
+                        continue
+                    if index:
+                        duplicate_tokens += mark_near_duplicates(index, result[1])
+                    with self.metrics.time("stage_seconds", stage="write"):
+                        writer.write(*result)
+                    self.metrics.inc("documents_total", status="tokenized")
+                    processed += 1
+            finally:
+                reporter.cancel()
+                await asyncio.gather(reporter, return_exceptions=True)
+
+        self._ledger.flush()
+        print(f"Wrote stats for {processed} documents.")
+        for line in self.metrics.latency_report():
+            print(f"  {line}")
+        if cache_stats is not None:
+            with PageCache(self.page_cache_path, self.page_cache_bytes) as cache:
+                for line in report_stats(cache_stats, cache.stats()):
+                    print(f"Page cache {line}")
+        if self.page_quality:
+            print(f"{self.metrics.counter('low_quality_pages_total'):.0f} pages scored under "
+                  f"{self.min_page_quality} were not tokenized")
+        if index:
+            print(f"{index.duplicates} of {index.pages} non-empty pages are near duplicates of earlier pages "
+                  f"({duplicate_tokens} tokens)")
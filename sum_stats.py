@@ -1,112 +1,215 @@
+from pathlib import Path
+
+import matplotlib
+import numpy as np
 import pandas as pd
+
+# Plots are written to files; never open a window
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 
+from stats_summary import DOC_COLUMNS, PAGE_COLUMNS, StatsSummary, histogram_edges, refresh_summary
+from stats_writer import read_stats_columns
+
+DOC_DTYPES = {
+    "doc_id": "category",
+    "title": "string",
+    "organization": "category",
+    "request_number": "string",
+    "description": "string",
+    "created_at": "string",
+    "page_count": "int32",
+    "file_size": "float32",
+    "token_total": "int32",
+    "token_avg_per_page": "float32",
+    "token_min": "int32",
+    "token_max": "int32",
+    "token_std_dev": "float32",
+}
+
+PAGE_DTYPES = {
+    "doc_id": "category",
+    "page_number": "int32",
+    # Null for pages the collector's quality scorer skipped
+    "tokens_per_page": "Int32",
+    "quality": "float32",
+}
+
 class DocumentStatsAnalyzer:
-    def __init__(self, doc_stats_path, page_tokens_path):
+    # The columns plot_all touches, for load_data calls that skip the text-heavy ones
+    PLOT_DOC_COLUMNS = ["page_count", "token_total", "token_avg_per_page"]
+    PLOT_PAGE_COLUMNS = ["page_number", "tokens_per_page"]
+
+    # With summary_path, load_summary() gives a dashboard over the collector's mergeable summaries
+    # (stats_summary.py) instead of the full tables: show_summary and plot_all then read only the
+    # summary, catching it up with any stats files it hasn't seen, in chunks.
+    def __init__(self, doc_stats_path, page_tokens_path, summary_path=None):
         self.doc_stats_path = doc_stats_path
         self.page_tokens_path = page_tokens_path
+        self.summary_path = summary_path
         self.doc_stats = None
         self.page_tokens = None
-
-    def load_data(self):
-        print("Loading document_stats.csv...")
-        self.doc_stats = pd.read_csv(
-            self.doc_stats_path,
-            dtype={
-                "doc_id": "category",
-                "title": "string",
-                "organization": "category",
-                "request_number": "string",
-                "description": "string",
-                "created_at": "string",
-                "page_count": "int16",
-                "file_size": "float32",
-                "token_total": "int32",
-                "token_avg_per_page": "float32",
-                "token_min": "int16",
-                "token_max": "int16",
-                "token_std_dev": "float32",
-            }
-        )
-
-        print("Loading page_token_counts.csv...")
-        self.page_tokens = pd.read_csv(
-            self.page_tokens_path,
-            dtype={
-                "doc_id": "category",
-                "page_number": "int16",
-                "tokens_per_page": "int16"
-            }
-        )
+        self.summary = None
+
+    # Columns default to everything; pass a subset to skip reading the rest (Parquet reads
+    # only those column chunks, CSV skips parsing them)
+    def load_data(self, doc_columns: list[str] | None = None, page_columns: list[str] | None = None):
+        print(f"Loading {self.doc_stats_path}...")
+        self.doc_stats = read_stats_columns(self.doc_stats_path, doc_columns, dtype=DOC_DTYPES)
+
+        print(f"Loading {self.page_tokens_path}...")
+        self.page_tokens = read_stats_columns(self.page_tokens_path, page_columns, dtype=PAGE_DTYPES)
+
+    # Out-of-core mode: the saved summary plus whatever parts (or CSV rows) were written after it.
+    # Without a summary file the stats are summarized in chunks of batch_rows once and saved.
+    def load_summary(self, batch_rows: int = 1 << 20) -> StatsSummary:
+        path = self.summary_path or Path(self.doc_stats_path).parent / "stats_summary.npz"
+        self.summary = StatsSummary.load_or_new(path)
+        added = refresh_summary(self.summary, self.doc_stats_path, self.page_tokens_path, batch_rows)
+        if added:
+            print(f"Summarized {added} new documents")
+            self.summary.save(path)
+        return self.summary
 
     def show_summary(self):
         pd.set_option('display.max_columns', None)
         pd.set_option('display.width', None)
 
+        if self.doc_stats is None and self.summary is not None:
+            print(f"\nDocument Stats Summary ({self.summary.documents} documents):")
+            print(self.summary.describe(DOC_COLUMNS))
+
+            print(f"\nPage Token Counts Summary ({self.summary.pages} pages):")
+            print(self.summary.describe(PAGE_COLUMNS))
+            return
+
         print("\nDocument Stats Summary:")
         print(self.doc_stats.describe(include='all'))
 
         print("\nPage Token Counts Summary:")
         print(self.page_tokens['tokens_per_page'].describe())
 
-    def plot_all(self):
-        self._plot_page_count_distribution()
-        self._plot_token_total_distribution()
-        self._plot_avg_tokens_per_page()
-        self._plot_page_token_distribution()
-        self._plot_avg_tokens_by_page_number()
-
-    def _plot_page_count_distribution(self):
-        data = self.doc_stats['page_count']
-
-        plt.figure(figsize=(10, 6))
-        plt.hist(data, bins=100, edgecolor='black')
-
-        plt.xlabel("Page Count (log scale)")
-        plt.title("Distribution of Page Counts")
-
-        plt.ylabel("Document Count")
-        plt.tight_layout()
-        plt.show()
-
-        quantiles = data.quantile([0.5, 0.9, 0.95, 0.99, 0.999])
+    # Columns of the extra token counters a collector run was configured with, by counter name
+    def token_counter_columns(self) -> dict:
+        prefix = "token_total_"
+        return {c[len(prefix):]: c for c in self.doc_stats.columns if c.startswith(prefix)}
+
+    # Side-by-side totals of every token counter, relative to the primary (token_total) column.
+    # Documents a counter didn't cover (stats written before it was configured) are left out of
+    # its comparison.
+    def compare_token_counters(self) -> pd.DataFrame:
+        columns = {"primary": "token_total", **self.token_counter_columns()}
+        if len(columns) == 1:
+            print("Only one token counter in these stats.")
+            return pd.DataFrame()
+        primary = self.doc_stats["token_total"].astype("float64")
+        rows = {}
+        for name, column in columns.items():
+            counts = self.doc_stats[column].astype("float64")
+            covered = counts.notna()
+            base = primary[covered]
+            counts = counts[covered]
+            ratios = (counts / base.where(base > 0)).dropna()
+            rows[name] = {
+                "documents": int(covered.sum()),
+                "total": counts.sum(),
+                "mean": counts.mean(),
+                "p50": counts.quantile(0.5),
+                "p99": counts.quantile(0.99),
+                "ratio_of_totals": counts.sum() / base.sum() if base.sum() else float("nan"),
+                "ratio_p50": ratios.median(),
+                "ratio_p99": ratios.quantile(0.99),
+                "corr": counts.corr(base),
+            }
+        comparison = pd.DataFrame.from_dict(rows, orient="index")
+        print("\nToken counters (document totals, ratios against the primary counter):")
+        print(comparison.to_string(float_format=lambda v: f"{v:,.3f}"))
+        return comparison
+
+    # Writes the plots as PNGs into output_dir and returns their paths. Uses the summary when the
+    # tables aren't loaded, with its log-binned histograms (hence the log x axes).
+    def plot_all(self, output_dir="data/plots") -> list[Path]:
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        return [
+            self._plot_page_count_distribution(output_dir / "page_count_distribution.png"),
+            self._plot_token_total_distribution(output_dir / "token_total_distribution.png"),
+            self._plot_avg_tokens_per_page(output_dir / "avg_tokens_per_page.png"),
+            self._plot_page_token_distribution(output_dir / "page_token_distribution.png"),
+            self._plot_avg_tokens_by_page_number(output_dir / "avg_tokens_by_page_number.png"),
+        ]
+
+    def _from_summary(self) -> bool:
+        if self.doc_stats is None and self.summary is None:
+            raise ValueError("Call load_data() or load_summary() first")
+        return self.doc_stats is None
+
+    # (bin edges, counts) of a doc or page column, with `bins` equal-width bins from the tables
+    def _histogram(self, column: str, bins: int) -> tuple[np.ndarray, np.ndarray]:
+        if self._from_summary():
+            counts = self.summary.columns[column].histogram
+            used = np.flatnonzero(counts)
+            if not len(used):
+                return np.array([0.0, 1.0]), np.zeros(1)
+            edges = histogram_edges()
+            return edges[used[0]:used[-1] + 2], counts[used[0]:used[-1] + 1]
+        table = self.page_tokens if column in PAGE_COLUMNS else self.doc_stats
+        counts, edges = np.histogram(table[column].dropna(), bins=bins)
+        return edges, counts
+
+    def _save_histogram(self, path: Path, column: str, bins: int, title: str, xlabel: str, ylabel: str) -> Path:
+        edges, counts = self._histogram(column, bins)
+        fig, ax = plt.subplots(figsize=(10, 6))
+        ax.stairs(counts, edges, fill=True, edgecolor='black')
+        if self._from_summary():
+            ax.set_xscale("symlog", linthresh=1)
+        ax.set_title(title)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        fig.tight_layout()
+        fig.savefig(path)
+        plt.close(fig)
+        return path
+
+    def _plot_page_count_distribution(self, path: Path) -> Path:
+        self._save_histogram(
+            path, "page_count", 100, "Distribution of Page Counts", "Page Count (log scale)", "Document Count"
+        )
+        levels = [0.5, 0.9, 0.95, 0.99, 0.999]
+        if self._from_summary():
+            quantiles = pd.Series(self.summary.columns["page_count"].sketch.quantiles(levels), index=levels)
+        else:
+            quantiles = self.doc_stats['page_count'].quantile(levels)
         print("\nPage Count Quantiles:")
         print(quantiles)
+        return path
 
-    def _plot_token_total_distribution(self):
-        plt.figure(figsize=(10, 6))
-        plt.hist(self.doc_stats['token_total'], bins=50, edgecolor='black')
-        plt.title("Distribution of Total Tokens per Document")
-        plt.xlabel("Total Tokens")
-        plt.ylabel("Document Count")
-        plt.tight_layout()
-        plt.show()
-
-    def _plot_avg_tokens_per_page(self):
-        plt.figure(figsize=(10, 6))
-        plt.hist(self.doc_stats['token_avg_per_page'], bins=50, edgecolor='black')
-        plt.title("Average Tokens per Page per Document")
-        plt.xlabel("Tokens per Page")
-        plt.ylabel("Document Count")
-        plt.tight_layout()
-        plt.show()
-
-    def _plot_page_token_distribution(self):
-        plt.figure(figsize=(10, 6))
-        plt.hist(self.page_tokens['tokens_per_page'], bins=50, edgecolor='black')
-        plt.title("Distribution of Tokens per Page")
-        plt.xlabel("Tokens per Page")
-        plt.ylabel("Page Count")
-        plt.tight_layout()
-        plt.show()
-
-    def _plot_avg_tokens_by_page_number(self):
-        avg_tokens_by_page = self.page_tokens.groupby("page_number")["tokens_per_page"].mean().reset_index()
-        plt.figure(figsize=(10, 6))
-        plt.plot(avg_tokens_by_page["page_number"], avg_tokens_by_page["tokens_per_page"], marker='o', linestyle='-')
-        plt.title("Average Tokens by Page Number")
-        plt.xlabel("Page Number")
-        plt.ylabel("Average Tokens")
-        plt.tight_layout()
-        plt.show()
+    def _plot_token_total_distribution(self, path: Path) -> Path:
+        return self._save_histogram(
+            path, "token_total", 50, "Distribution of Total Tokens per Document", "Total Tokens", "Document Count"
+        )
+
+    def _plot_avg_tokens_per_page(self, path: Path) -> Path:
+        return self._save_histogram(
+            path, "token_avg_per_page", 50, "Average Tokens per Page per Document", "Tokens per Page", "Document Count"
+        )
+
+    def _plot_page_token_distribution(self, path: Path) -> Path:
+        return self._save_histogram(
+            path, "tokens_per_page", 50, "Distribution of Tokens per Page", "Tokens per Page", "Page Count"
+        )
 
+    def _plot_avg_tokens_by_page_number(self, path: Path) -> Path:
+        if self._from_summary():
+            avg_tokens_by_page = self.summary.tokens_by_page_number()
+        else:
+            avg_tokens_by_page = self.page_tokens.groupby("page_number")["tokens_per_page"].mean().reset_index()
+        fig, ax = plt.subplots(figsize=(10, 6))
+        ax.plot(avg_tokens_by_page["page_number"], avg_tokens_by_page["tokens_per_page"], marker='o', linestyle='-')
+        ax.set_title("Average Tokens by Page Number")
+        ax.set_xlabel("Page Number")
+        ax.set_ylabel("Average Tokens")
+        fig.tight_layout()
+        fig.savefig(path)
+        plt.close(fig)
+        return path
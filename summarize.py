@@ -0,0 +1,375 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import time
+from datetime import datetime, timezone
+
+import pyarrow as pa
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+from chunk_planner import PageTable, input_budget, plan_chunks
+from doc_stream import in_page_order, iter_pages
+from ledger import SUMMARY_STAGE, JobLedger
+from page_cache import PageCache, page_key
+from page_quality import PageQualityScorer
+from rate_limit import AdaptiveConcurrencyLimiter, AdaptiveRateLimiter, request_json
+from stats_writer import ParquetTableWriter, read_stats_columns
+from sum_from_S3 import DocumentStatsCollector
+from token_counters import make_counter
+
+# Map-reduce summarization of the S3 corpus against any OpenAI-compatible chat completions
+# endpoint (vLLM, llama.cpp, TGI, OpenAI, ...). Configured through the environment:
+#
+#   LLM_API_URL   base URL, e.g. http://localhost:8000/v1
+#   LLM_MODEL     model name sent with each request
+#   LLM_API_KEY   bearer key, if the endpoint needs one
+#
+# Documents are chunked with the same greedy packing chunk_planner uses, so the planner's
+# map_reduce estimate is what a run costs. Summaries are written as Parquet parts under
+# data/summaries and marked summarized in the ledger once their part is on disk, so a rerun picks
+# up where the last one stopped.
+#
+# With page_cache_path, completions are cached by prompt, model and input text, so boilerplate
+# chunks repeated across documents are summarized once. With near_duplicates_from (page stats
+# written with near_duplicates=True), pages flagged as near duplicates of earlier ones are left out.
+# With min_page_quality, pages scoring below it (blank scans, OCR noise; see page_quality.py) are
+# left out too, before chunking.
+SUMMARY_SCHEMA = pa.schema([
+    ("doc_id", pa.string()),
+    ("model", pa.string()),
+    ("summary", pa.string()),
+    ("pages", pa.int32()),
+    ("chunks", pa.int32()),
+    ("llm_calls", pa.int32()),
+    ("cached_calls", pa.int32()),
+    ("prompt_tokens", pa.int64()),
+    ("completion_tokens", pa.int64()),
+    ("seconds", pa.float64()),
+    ("created_at", pa.string()),
+])
+
+MAP_PROMPT = (
+    "Summarize this excerpt of a government record released under an access to information request. "
+    "Keep the names, organizations, dates, amounts and decisions it mentions."
+)
+REDUCE_PROMPT = (
+    "These are summaries of consecutive parts of one government record released under an access to "
+    "information request. Combine them into a single summary of the whole record."
+)
+
+
+class _ApiKey:
+    # request_json's auth interface for a static bearer key; a rejected key is simply retried
+    def __init__(self, key: str | None):
+        self._headers = {"Authorization": f"Bearer {key}"} if key else {}
+
+    async def headers(self, session) -> dict:
+        return self._headers
+
+    def invalidate(self, headers: dict):
+        pass
+
+
+class _DocumentUsage:
+    def __init__(self):
+        self.llm_calls = 0
+        self.cached_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+
+class Summarizer:
+    # Up to max_documents_in_flight documents are summarized at once; every request goes through
+    # one AdaptiveConcurrencyLimiter, which finds how many concurrent requests the endpoint takes
+    # before it starts answering 429. max_rate additionally caps requests/sec.
+    def __init__(
+        self,
+        bucket_name: str,
+        prefix: str = "",
+        endpoint: str | None = None,
+        model: str | None = None,
+        api_key: str | None = None,
+        context: int = 8192,
+        prompt_tokens: int = 200,
+        summary_tokens: int = 300,
+        overlap: int = 0,
+        token_counter: str = "regex",
+        initial_concurrency: int = 4,
+        max_concurrency: int = 64,
+        max_rate: float | None = None,
+        max_documents_in_flight: int = 32,
+        max_retries: int = 5,
+        request_timeout: float = 600.0,
+        fetch_concurrency: int = 10,
+        layout: str = "objects",
+        shard_prefix: str = "shards/",
+        output_path: str = "data/summaries",
+        ledger_path: str = "data/ledger.sqlite3",
+        page_cache_path: str | None = None,
+        near_duplicates_from: str | None = None,
+        min_page_quality: float | None = None,
+    ):
+        load_dotenv()
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.endpoint = (endpoint or os.environ["LLM_API_URL"]).rstrip("/")
+        self.model = model or os.environ["LLM_MODEL"]
+        self._auth = _ApiKey(api_key or os.environ.get("LLM_API_KEY"))
+        self.context = context
+        self.prompt_tokens = prompt_tokens
+        self.summary_tokens = summary_tokens
+        self.overlap = overlap
+        self.budget = input_budget(context, prompt_tokens, summary_tokens)
+        # Same fan-in chunk_planner assumes for its reduce estimate
+        self.fan_in = max(2, self.budget // summary_tokens)
+        self._counter = make_counter(token_counter)
+        self.concurrency = AdaptiveConcurrencyLimiter(limit=initial_concurrency, max_limit=max_concurrency)
+        self.rate_limiter = AdaptiveRateLimiter(rate=max_rate, max_rate=max_rate) if max_rate else None
+        self.max_documents_in_flight = max_documents_in_flight
+        self.max_retries = max_retries
+        self.request_timeout = request_timeout
+        self.fetch_concurrency = fetch_concurrency
+        self.layout = layout
+        self.shard_prefix = shard_prefix
+        self.output_path = output_path
+        self.ledger_path = ledger_path
+        self._ledger = None
+        self._cache = PageCache(page_cache_path) if page_cache_path else None
+        self.near_duplicates_from = near_duplicates_from
+        self._skip_pages = {}
+        self.min_page_quality = min_page_quality
+        self._quality_scorer = PageQualityScorer() if min_page_quality is not None else None
+        self.low_quality_pages = 0
+
+    # Chunk texts for a document's pages (in page order). Pages are packed greedily up to the
+    # input budget; with overlap, each chunk starts with roughly the last `overlap` tokens of
+    # the one before. A single page over budget is cut into equal pieces by characters.
+    def chunk_texts(self, texts: list[str]) -> list[str]:
+        counts = self._counter.count(texts)
+        table = PageTable([0] * len(texts), range(len(texts)), counts)
+        plan = plan_chunks(
+            table, "map_reduce", self.context, self.overlap, self.prompt_tokens, self.summary_tokens
+        )
+        chunks = []
+        tail = ""
+        for first, last in zip(plan["first_page"], plan["last_page"]):
+            text = "\n\n".join(texts[first:last + 1])
+            tokens = sum(counts[first:last + 1])
+            pieces = -(-tokens // self.budget) if tokens > self.budget else 1
+            size = -(-len(text) // pieces)
+            chunks.extend(tail + text[i:i + size] for i in range(0, max(len(text), 1), size))
+            tail_chars = len(text) * self.overlap // tokens if tokens else 0
+            tail = text[-tail_chars:] + "\n\n" if tail_chars else ""
+        return chunks
+
+    # The texts whose pages score at least min_page_quality
+    def drop_low_quality(self, texts: list[str]) -> list[str]:
+        if not self._quality_scorer or not texts:
+            return texts
+        scores = self._quality_scorer.score(texts)
+        kept = [text for text, score in zip(texts, scores.tolist()) if score >= self.min_page_quality]
+        self.low_quality_pages += len(texts) - len(kept)
+        return kept
+
+    # {doc_id: page indexes} flagged as near duplicates in the page stats
+    def _load_near_duplicates(self):
+        pages = read_stats_columns(
+            self.near_duplicates_from, ["doc_id", "page_number", "near_duplicate_of"], dtype={"doc_id": str}
+        )
+        pages = pages[pages["near_duplicate_of"].notna()]
+        self._skip_pages = pages.groupby("doc_id")["page_number"].agg(set).to_dict()
+        print(f"Skipping {len(pages)} near-duplicate pages in {len(self._skip_pages)} documents")
+
+    async def _complete(self, session: ClientSession, system: str, text: str, usage: _DocumentUsage) -> str:
+        if self._cache:
+            namespace = f"summary:{self.model}:{self.summary_tokens}:{hashlib.sha256(system.encode()).hexdigest()[:12]}"
+            key = page_key(namespace, text)
+            cached = self._cache.get_many([key])
+            if cached:
+                self._cache.update({}, touched=[key], namespace=namespace, hits=1)
+                usage.cached_calls += 1
+                return cached[key]
+        start = time.perf_counter()
+        data = await request_json(
+            session,
+            f"{self.endpoint}/chat/completions",
+            limiter=self.rate_limiter,
+            auth=self._auth,
+            method="POST",
+            max_retries=self.max_retries,
+            concurrency=self.concurrency,
+            json={
+                "model": self.model,
+                "messages": [{"role": "system", "content": system}, {"role": "user", "content": text}],
+                "max_tokens": self.summary_tokens,
+                "temperature": 0,
+            },
+        )
+        reported = data.get("usage") or {}
+        usage.llm_calls += 1
+        usage.prompt_tokens += reported.get("prompt_tokens", 0)
+        usage.completion_tokens += reported.get("completion_tokens", 0)
+        content = data["choices"][0]["message"]["content"] or ""
+        if self._cache:
+            self._cache.update({key: content}, namespace=namespace, misses=1, miss_seconds=time.perf_counter() - start)
+        return content
+
+    # One summary row for a document bundle, or None if it has no text
+    async def summarize_document(self, session: ClientSession, doc_id, body: bytes) -> dict | None:
+        start = time.monotonic()
+        pages = list(iter_pages(body))
+        texts = in_page_order([page.get("page", 0) for page in pages], [page.get("contents", "") for page in pages])
+        skip = self._skip_pages.get(str(doc_id), ())
+        texts = [text for i, text in enumerate(texts) if i not in skip]
+        texts = await asyncio.to_thread(self.drop_low_quality, texts)
+        if not any(text.strip() for text in texts):
+            return None
+        chunks = await asyncio.to_thread(self.chunk_texts, texts)
+        usage = _DocumentUsage()
+        summaries = await asyncio.gather(*(self._complete(session, MAP_PROMPT, chunk, usage) for chunk in chunks))
+        while len(summaries) > 1:
+            groups = [summaries[i:i + self.fan_in] for i in range(0, len(summaries), self.fan_in)]
+            summaries = await asyncio.gather(
+                *(self._complete(session, REDUCE_PROMPT, "\n\n".join(group), usage) for group in groups)
+            )
+        return {
+            "doc_id": str(doc_id),
+            "model": self.model,
+            "summary": summaries[0],
+            "pages": len(texts),
+            "chunks": len(chunks),
+            "llm_calls": usage.llm_calls,
+            "cached_calls": usage.cached_calls,
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "seconds": time.monotonic() - start,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    # Writer callback: the flushed summaries are on disk, so commit them to the ledger
+    def _commit_flushed(self, doc_ids, part_name):
+        self._ledger.record_many(doc_ids, SUMMARY_STAGE, "summarized")
+        self._ledger.flush()
+
+    def _finish(self, task: asyncio.Task, doc_id, writer: ParquetTableWriter, counts: dict):
+        try:
+            row = task.result()
+        except Exception as e:
+            counts["failed"] += 1
+            self._ledger.record(doc_id, SUMMARY_STAGE, "failed", error=repr(e))
+            print(f"Failed to summarize {doc_id}: {e!r}")
+            return
+        if row is None:
+            counts["empty"] += 1
+            self._ledger.record(doc_id, SUMMARY_STAGE, "empty")
+            return
+        counts["summarized"] += 1
+        counts["llm_calls"] += row["llm_calls"]
+        counts["cached_calls"] += row["cached_calls"]
+        writer.write(row)
+
+    # Summarize every document the ledger doesn't have as summarized (or empty); stops pulling new
+    # documents after max_documents and finishes the ones in flight
+    async def summarize_async(self, max_documents: int | None = None) -> dict:
+        self._ledger = JobLedger(self.ledger_path)
+        if self.near_duplicates_from:
+            self._load_near_duplicates()
+        source = DocumentStatsCollector(
+            bucket_name=self.bucket_name,
+            prefix=self.prefix,
+            fetch_concurrency=self.fetch_concurrency,
+            layout=self.layout,
+            shard_prefix=self.shard_prefix,
+            ledger_path=self.ledger_path,
+        )
+        counts = {"summarized": 0, "empty": 0, "failed": 0, "llm_calls": 0, "cached_calls": 0}
+        tasks = {}
+        started = 0
+        progress = tqdm(desc="Summarizing docs", unit="doc")
+
+        def collect(done):
+            for task in done:
+                self._finish(task, tasks.pop(task), writer, counts)
+                progress.update(1)
+            progress.set_postfix(
+                documents=len(tasks), requests=self.concurrency.in_flight, limit=int(self.concurrency.limit), refresh=False
+            )
+
+        connector = TCPConnector(limit=int(self.concurrency.max_limit), keepalive_timeout=60)
+        async with ClientSession(
+            connector=connector, timeout=ClientTimeout(total=self.request_timeout)
+        ) as session:
+            with ParquetTableWriter(self.output_path, SUMMARY_SCHEMA, on_flush=self._commit_flushed) as writer:
+                try:
+                    async for doc_id, body in source.stream_docs(stage=SUMMARY_STAGE):
+                        tasks[asyncio.create_task(self.summarize_document(session, doc_id, body))] = doc_id
+                        started += 1
+                        while len(tasks) >= self.max_documents_in_flight:
+                            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                            collect(done)
+                        if max_documents and started >= max_documents:
+                            break
+                    while tasks:
+                        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                        collect(done)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                    progress.close()
+        self._ledger.close()
+        counts.update(
+            low_quality_pages=self.low_quality_pages,
+            throttled=self.concurrency.throttled,
+            peak_requests_in_flight=self.concurrency.peak_in_flight,
+            concurrency_limit=round(self.concurrency.limit, 1),
+        )
+        print(f"Summarized {counts['summarized']} documents with {counts['llm_calls']} LLM calls "
+              f"and {counts['cached_calls']} cached ones "
+              f"({counts['empty']} empty, {counts['failed']} failed, {counts['throttled']} throttled)")
+        if self._quality_scorer:
+            print(f"Left out {self.low_quality_pages} pages scored under {self.min_page_quality}")
+        return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the S3 corpus with an OpenAI-compatible endpoint")
+    parser.add_argument("bucket")
+    parser.add_argument("--prefix", default="")
+    parser.add_argument("--endpoint", help="defaults to $LLM_API_URL")
+    parser.add_argument("--model", help="defaults to $LLM_MODEL")
+    parser.add_argument("--context", type=int, default=8192)
+    parser.add_argument("--summary-tokens", type=int, default=300)
+    parser.add_argument("--overlap", type=int, default=0)
+    parser.add_argument("--token-counter", default="regex", help="token_counters spec used for chunking")
+    parser.add_argument("--max-concurrency", type=int, default=64)
+    parser.add_argument("--max-rate", type=float, help="requests/sec cap")
+    parser.add_argument("--layout", choices=("objects", "shards"), default="objects")
+    parser.add_argument("--max-documents", type=int)
+    parser.add_argument("--page-cache", help="SQLite file caching completions, e.g. data/page_cache.sqlite3")
+    parser.add_argument("--skip-near-duplicates", metavar="PAGE_STATS", help="page stats with near_duplicate_of")
+    parser.add_argument("--min-page-quality", type=float, help="leave out pages scoring below this, e.g. 0.3")
+    args = parser.parse_args()
+    summarizer = Summarizer(
+        args.bucket,
+        prefix=args.prefix,
+        endpoint=args.endpoint,
+        model=args.model,
+        context=args.context,
+        summary_tokens=args.summary_tokens,
+        overlap=args.overlap,
+        token_counter=args.token_counter,
+        max_concurrency=args.max_concurrency,
+        max_rate=args.max_rate,
+        layout=args.layout,
+        page_cache_path=args.page_cache,
+        near_duplicates_from=args.skip_near_duplicates,
+        min_page_quality=args.min_page_quality,
+    )
+    asyncio.run(summarizer.summarize_async(args.max_documents))
+
+
+if __name__ == "__main__":
+    main()
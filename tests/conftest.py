@@ -0,0 +1,70 @@
+import logging
+import os
+import socket
+
+import boto3
+import pytest
+from moto.server import ThreadedMotoServer
+
+import dc_to_s3
+from benchmarks.local_s3 import empty_bucket
+
+BUCKET = "obd-sum-stats"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# The fakes point clients at themselves through os.environ; put it back after every test
+@pytest.fixture(autouse=True)
+def restore_environ():
+    saved = dict(os.environ)
+    yield
+    os.environ.clear()
+    os.environ.update(saved)
+
+
+# DCToken is a process-wide singleton; every test gets one bound to its own fake server
+@pytest.fixture(autouse=True)
+def fresh_token():
+    dc_to_s3.DCToken._instance = None
+    yield
+    dc_to_s3.DCToken._instance = None
+
+
+@pytest.fixture
+def free_port() -> int:
+    return _free_port()
+
+
+# One moto S3 server for the session; the pipelines find it through AWS_ENDPOINT_URL
+@pytest.fixture(scope="session")
+def moto_endpoint():
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    port = _free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    yield f"http://127.0.0.1:{port}"
+    server.stop()
+
+
+# A boto3 client for moto with an empty obd-sum-stats bucket (and every other bucket emptied);
+# every S3 client the test creates is pointed at moto too
+@pytest.fixture
+def s3(moto_endpoint):
+    os.environ.update(
+        AWS_ACCESS_KEY_ID="testing",
+        AWS_SECRET_ACCESS_KEY="testing",
+        AWS_REGION="us-east-1",
+        AWS_ENDPOINT_URL=moto_endpoint,
+    )
+    client = boto3.client("s3", region_name="us-east-1")
+    existing = {bucket["Name"] for bucket in client.list_buckets()["Buckets"]}
+    for bucket in existing:
+        empty_bucket(bucket)
+    if BUCKET not in existing:
+        client.create_bucket(Bucket=BUCKET)
+    return client
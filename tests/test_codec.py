@@ -0,0 +1,32 @@
+import pytest
+
+import codec
+import dc_to_s3
+import shards
+from codec import COMPRESSIONS, decode_body, encode_document, serialize_document
+
+BUNDLE = {"doc_id": 7, "metadata": {"title": "Note"}, "text_json": {"pages": [{"page": 0, "contents": "été"}]}}
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_round_trip(compression):
+    body, encoding = encode_document(BUNDLE, compression)
+    assert encoding == compression
+    assert decode_body(body) == serialize_document(BUNDLE)
+
+
+# Without zstd support, asking for it fails when the exporter or shard writer is built rather
+# than at the first upload
+def test_zstd_unavailable_fails_up_front(monkeypatch, s3, tmp_path):
+    monkeypatch.setattr(dc_to_s3, "zstd_available", lambda: False)
+    monkeypatch.setattr(shards, "zstd_available", lambda: False)
+    with pytest.raises(ImportError, match="zstandard"):
+        dc_to_s3.dc_to_s3(project_id=1, max_documents=1, num_consumers=1, compression="zstd",
+                          ledger_path=str(tmp_path / "ledger.sqlite3"))
+    with pytest.raises(ImportError, match="zstandard"):
+        shards.ShardWriter(None, "obd-sum-stats", compression="zstd")
+    shards.ShardWriter(None, "obd-sum-stats", compression="gzip")
+
+
+def test_zstd_available():
+    assert codec.zstd_available()
@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+from codec import serialize_document
+from doc_stream import iter_pages, read_header
+
+BUNDLE = {
+    "doc_id": 1234,
+    "metadata": {"title": "Note de breffage – ministère", "data": {"file_size": ["123"]}},
+    "text_json": {
+        "title": "x",
+        "pages": [{"page": i, "contents": f"Page {i}: été, naïve — {'mot ' * i}"} for i in range(4)],
+    },
+}
+
+
+def layouts():
+    text_first = {"text_json": BUNDLE["text_json"], "doc_id": BUNDLE["doc_id"], "metadata": BUNDLE["metadata"]}
+    yield "compact", serialize_document(BUNDLE)
+    yield "indent", json.dumps(BUNDLE, indent=2, ensure_ascii=False).encode("utf-8")
+    yield "text_json first", serialize_document(text_first)
+    yield "text_json first, indent", json.dumps(text_first, indent=2).encode("utf-8")
+    yield "no pages", serialize_document({**BUNDLE, "text_json": {"title": "x"}})
+    yield "text_json null", serialize_document({**BUNDLE, "text_json": None})
+
+
+# A prefix can end anywhere, including right after "text_json": or inside a multi-byte
+# character; every cut has to come out the same as decoding the whole body
+@pytest.mark.parametrize("name,body", list(layouts()), ids=[name for name, _ in layouts()])
+def test_every_prefix_boundary(name, body):
+    bundle = json.loads(body)
+    pages = (bundle["text_json"] or {}).get("pages", [])
+    for prefix_bytes in range(1, len(body) + 1):
+        assert list(iter_pages(body, prefix_bytes=prefix_bytes)) == pages, prefix_bytes
+        assert read_header(body, prefix_bytes=prefix_bytes) == (bundle["doc_id"], bundle["metadata"]), prefix_bytes
+
+
+def test_prefix_ending_after_text_json_key():
+    body = serialize_document(BUNDLE)
+    cut = body.index(b'"text_json":') + len(b'"text_json":')
+    assert list(iter_pages(body, prefix_bytes=cut)) == BUNDLE["text_json"]["pages"]
+
+
+def test_small_windows():
+    body = serialize_document(BUNDLE)
+    for window in (1, 2, 7, 64):
+        assert list(iter_pages(body, window=window, prefix_bytes=8)) == BUNDLE["text_json"]["pages"]
@@ -0,0 +1,173 @@
+import asyncio
+import random
+from datetime import timedelta
+
+import pytest
+
+from benchmarks.fake_documentcloud import FakeDocumentCloud
+from benchmarks.synthetic import make_page_text
+from dc_to_s3 import dc_to_s3
+from leases import S3LeaseStore, SQLiteLeaseStore, bucket_of
+from ledger import EXPORT_STAGE
+
+BUCKET = "obd-sum-stats"
+LEASE_BUCKET = "obd-sum-stats-leases"
+NUM_BUCKETS = 8
+
+
+def make_fake(docs: int) -> FakeDocumentCloud:
+    rng = random.Random(0)
+    fake = FakeDocumentCloud(project_id=216694)
+    for doc_id in range(1, docs + 1):
+        fake.add_document(doc_id, [make_page_text(rng, 20)])
+    return fake
+
+
+def make_exporter(tmp_path, name: str) -> dc_to_s3:
+    return dc_to_s3(
+        project_id=216694, max_documents=10_000, num_consumers=4, ledger_path=str(tmp_path / name / "ledger.sqlite3"),
+        api_rate=200.0, api_max_rate=400.0, metrics_path=None,
+    )
+
+
+@pytest.fixture(params=["sqlite", "s3"])
+def lease_store(request, s3, tmp_path):
+    if request.param == "sqlite":
+        store = SQLiteLeaseStore(tmp_path / "leases.sqlite3")
+    else:
+        s3.create_bucket(Bucket=LEASE_BUCKET)
+        store = S3LeaseStore(LEASE_BUCKET)
+    yield store
+    store.close()
+
+
+def exported_ids(s3) -> list[int]:
+    keys = [obj["Key"] for page in s3.get_paginator("list_objects_v2").paginate(Bucket=BUCKET)
+            for obj in page.get("Contents", [])]
+    return sorted(int(key.removesuffix(".json")) for key in keys)
+
+
+def test_nodes_split_the_project_without_overlap(s3, tmp_path, free_port, lease_store):
+    fake = make_fake(60)
+
+    async def run():
+        async with fake.serve(free_port):
+            await asyncio.gather(*(
+                make_exporter(tmp_path, name).export_sharded(lease_store, owner=name, num_buckets=NUM_BUCKETS,
+                                                             lease_ttl=5.0)
+                for name in ("node-a", "node-b")
+            ))
+
+    asyncio.run(run())
+    assert exported_ids(s3) == list(range(1, 61))
+    assert set(fake.text_served.values()) == {1}
+    assert lease_store.done_buckets() == set(range(NUM_BUCKETS))
+
+
+# A node killed mid-run leaves unexpired leases behind, one of them on a bucket it had half
+# exported; the surviving node waits the leases out, takes the buckets over and exports the rest
+def test_killed_node_leases_are_taken_over(s3, tmp_path, free_port, lease_store):
+    fake = make_fake(40)
+    dead_buckets = {0, 3, 5}
+    for bucket in dead_buckets:
+        assert lease_store.acquire(bucket, "dead-node", 1.0)
+    half_done = [doc_id for doc_id in range(1, 41) if bucket_of(doc_id, NUM_BUCKETS) == 3][::2]
+    for doc_id in half_done:
+        s3.put_object(Bucket=BUCKET, Key=f"{doc_id}.json", Body=b'{"doc_id": %d}' % doc_id)
+
+    async def run():
+        async with fake.serve(free_port):
+            await make_exporter(tmp_path, "survivor").export_sharded(
+                lease_store, owner="survivor", num_buckets=NUM_BUCKETS, lease_ttl=2.0
+            )
+
+    asyncio.run(run())
+    assert exported_ids(s3) == list(range(1, 41))
+    # What the dead node uploaded is not downloaded again
+    assert set(fake.text_served) == set(range(1, 41)) - set(half_done)
+    assert set(fake.text_served.values()) == {1}
+    assert lease_store.done_buckets() == set(range(NUM_BUCKETS))
+    # The dead node can't complete a bucket that was taken over
+    assert not lease_store.complete(3, "dead-node")
+
+
+# Completed buckets only stay closed within an epoch: a later run exports what was added since,
+# and each node learns from the bucket listing what the others exported before
+def test_new_epoch_exports_documents_added_since(s3, tmp_path, free_port):
+    fake = make_fake(30)
+    store_path = tmp_path / "leases.sqlite3"
+
+    async def run(epoch):
+        store = SQLiteLeaseStore(store_path, epoch=epoch)
+        async with fake.serve(free_port):
+            exporters = [make_exporter(tmp_path, name) for name in ("node-a", "node-b")]
+            for exporter in exporters:
+                exporter._listing_max_age = timedelta(0)
+            await asyncio.gather(*(
+                exporter.export_sharded(store, owner=name, num_buckets=NUM_BUCKETS, lease_ttl=5.0)
+                for exporter, name in zip(exporters, ("node-a", "node-b"))
+            ))
+        return store
+
+    asyncio.run(run("run-1"))
+    for doc_id in range(31, 41):
+        fake.add_document(doc_id, [f"Added after the first run: {doc_id}"])
+    store = asyncio.run(run("run-2"))
+    assert exported_ids(s3) == list(range(1, 41))
+    assert set(fake.text_served) == set(range(1, 41))
+    assert set(fake.text_served.values()) == {1}
+    assert store.done_buckets() == set(range(NUM_BUCKETS))
+
+
+# Every run checks the bucket listing against the ledger, not just the first; documents marked
+# changed stay pending for re-export even though their old object is still listed
+def test_resync_records_objects_uploaded_elsewhere(s3, tmp_path):
+    exporter = make_exporter(tmp_path, "node-a")
+    exporter._listing_max_age = timedelta(0)
+
+    async def sync():
+        async with exporter.open_async_s3():
+            return await exporter.sync_uploaded_ids_from_s3()
+
+    for doc_id in (1, 2):
+        s3.put_object(Bucket=BUCKET, Key=f"{doc_id}.json", Body=b"{}")
+    assert asyncio.run(sync()) == 2
+
+    exporter._ledger.record(2, EXPORT_STAGE, "changed")
+    for doc_id in (3, 4):
+        s3.put_object(Bucket=BUCKET, Key=f"{doc_id}.json", Body=b"{}")
+    assert asyncio.run(sync()) == 3
+    assert [exporter._ledger.state(doc_id, EXPORT_STAGE) for doc_id in range(1, 5)] == [
+        "uploaded", "changed", "uploaded", "uploaded"
+    ]
+
+
+# A bucket with a document that failed to export is released instead of completed, so it can be
+# retried within the epoch: the rerun exports just that document and completes the bucket
+def test_bucket_with_failures_is_not_completed(s3, tmp_path, free_port, lease_store):
+    fake = make_fake(20)
+    failing = 7
+
+    async def run(fail: bool):
+        async with fake.serve(free_port):
+            exporter = make_exporter(tmp_path, "node-a")
+            if fail:
+                upload = exporter.upload_document_to_s3
+
+                async def flaky_upload(bundle):
+                    if bundle["doc_id"] == failing:
+                        raise ConnectionError("S3 unavailable")
+                    return await upload(bundle)
+
+                exporter.upload_document_to_s3 = flaky_upload
+            await exporter.export_sharded(lease_store, owner="node-a", num_buckets=NUM_BUCKETS, lease_ttl=5.0)
+
+    asyncio.run(run(fail=True))
+    assert exported_ids(s3) == [doc_id for doc_id in range(1, 21) if doc_id != failing]
+    assert lease_store.done_buckets() == set(range(NUM_BUCKETS)) - {bucket_of(failing, NUM_BUCKETS)}
+
+    asyncio.run(run(fail=False))
+    assert exported_ids(s3) == list(range(1, 21))
+    assert lease_store.done_buckets() == set(range(NUM_BUCKETS))
+    assert fake.text_served[failing] == 2
+    assert sum(fake.text_served.values()) == 21
@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+from ingest import export_and_collect
+
+
+class FailingExporter:
+    tee = None
+
+    def __init__(self, failed: asyncio.Event):
+        self.failed = failed
+
+    async def export_with_queue(self):
+        self.failed.set()
+        raise ValueError("export failed")
+
+
+class CancelledCollector:
+    def __init__(self, failed: asyncio.Event):
+        self.failed = failed
+
+    async def process_documents_async(self, docs):
+        await self.failed.wait()
+        raise asyncio.CancelledError
+
+
+# The stats task ending up cancelled as the export fails doesn't hide the export's error
+def test_export_error_is_raised_over_cancelled_stats():
+    async def run():
+        failed = asyncio.Event()
+        await export_and_collect(FailingExporter(failed), CancelledCollector(failed))
+
+    with pytest.raises(ValueError, match="export failed"):
+        asyncio.run(run())
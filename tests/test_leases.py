@@ -0,0 +1,24 @@
+from leases import SQLiteLeaseStore, open_lease_store
+
+
+def test_epochs_are_independent(tmp_path):
+    first = SQLiteLeaseStore(tmp_path / "leases.sqlite3", epoch="run-1")
+    assert first.acquire(0, "a", 60.0)
+    assert first.complete(0, "a")
+    assert not first.acquire(0, "b", 60.0)
+
+    second = open_lease_store(f"sqlite:///{tmp_path}/leases.sqlite3", epoch="run-2")
+    assert second.done_buckets() == set()
+    assert second.acquire(0, "b", 60.0)
+    assert first.done_buckets() == {0}
+
+
+def test_s3_epochs_are_independent(s3):
+    s3.create_bucket(Bucket="obd-sum-stats-leases")
+    first = open_lease_store("s3://obd-sum-stats-leases/leases", epoch="run-1")
+    assert first.acquire(0, "a", 60.0)
+    assert first.complete(0, "a")
+    assert first.done_buckets() == {0}
+    second = open_lease_store("s3://obd-sum-stats-leases/leases", epoch="run-2")
+    assert second.done_buckets() == set()
+    assert second.acquire(0, "b", 60.0)
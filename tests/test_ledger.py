@@ -0,0 +1,28 @@
+import sqlite3
+
+from ledger import EXPORT_STAGE, STATS_STAGE, JobLedger
+
+
+# Lookups read through the unflushed buffer without committing it
+def test_state_reads_unflushed_records(tmp_path):
+    ledger = JobLedger(tmp_path / "ledger.sqlite3", flush_interval=3600)
+    ledger.record(1, EXPORT_STAGE, "uploaded")
+    ledger.flush()
+    ledger.record(1, EXPORT_STAGE, "listed")
+    ledger.record(2, EXPORT_STAGE, "listed")
+    ledger.record(3, EXPORT_STAGE, "fetched")
+    ledger.record(3, EXPORT_STAGE, "empty")
+
+    # "listed" never overwrites a state the table already has
+    assert ledger.state(1, EXPORT_STAGE) == "uploaded"
+    assert ledger.state(2, EXPORT_STAGE) == "listed"
+    assert ledger.state("3", EXPORT_STAGE) == "empty" and ledger.is_done(3, EXPORT_STAGE)
+    assert ledger.state(3, STATS_STAGE) is None
+    other = sqlite3.connect(tmp_path / "ledger.sqlite3")
+    assert other.execute("SELECT COUNT(*) FROM doc_state").fetchone()[0] == 1
+
+    ledger.flush()
+    assert [ledger.state(doc_id, EXPORT_STAGE) for doc_id in (1, 2, 3)] == ["uploaded", "listed", "empty"]
+    assert ledger.ids_in_state(EXPORT_STAGE, "listed") == {"2"}
+    other.close()
+    ledger.close()
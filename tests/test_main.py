@@ -0,0 +1,23 @@
+import pytest
+
+from main import parse_args
+
+
+def test_stages_default_to_analyze():
+    assert parse_args([]).stages == ["analyze"]
+    assert parse_args(["export", "stats"]).stages == ["export", "stats"]
+
+
+def test_unknown_stage_is_rejected(capsys):
+    with pytest.raises(SystemExit):
+        parse_args(["export", "tokenize"])
+    assert "invalid stage: 'tokenize'" in capsys.readouterr().err
+
+
+# The epoch isn't taken from the clock, so nodes can't end up in different ones
+def test_lease_store_needs_an_epoch(capsys):
+    with pytest.raises(SystemExit):
+        parse_args(["export", "--lease-store", "data/leases.sqlite3"])
+    assert "--lease-epoch" in capsys.readouterr().err
+    args = parse_args(["export", "--lease-store", "data/leases.sqlite3", "--lease-epoch", "2026-10"])
+    assert args.lease_epoch == "2026-10"
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+from aiohttp import ClientSession
+
+from benchmarks.fake_documentcloud import FakeDocumentCloud
+from dc_to_s3 import DCToken
+from rate_limit import AdaptiveRateLimiter, request_json
+
+
+def make_fake(docs: int, **kwargs) -> FakeDocumentCloud:
+    fake = FakeDocumentCloud(**kwargs)
+    for doc_id in range(1, docs + 1):
+        fake.add_document(doc_id, [f"Page text for document {doc_id}."])
+    return fake
+
+
+async def get_documents(session, fake, doc_ids, limiter=None) -> list[dict]:
+    return await asyncio.gather(*(
+        request_json(session, f"{fake.base_url}/api/documents/{doc_id}/", limiter=limiter, auth=DCToken(),
+                     max_retries=20)
+        for doc_id in doc_ids
+    ))
+
+
+def test_limiter_backs_off_and_no_request_is_lost(free_port):
+    fake = make_fake(80, rate_limit=20.0)
+    limiter = AdaptiveRateLimiter(rate=60.0, max_rate=100.0, cooldown=0.2)
+
+    async def run():
+        async with fake.serve(free_port), ClientSession() as session:
+            return await get_documents(session, fake, range(1, 81), limiter)
+
+    documents = asyncio.run(run())
+    assert [doc["id"] for doc in documents] == list(range(1, 81))
+    assert fake.requests["throttled"] > 0
+    assert limiter.throttled == fake.requests["throttled"]
+    # Multiplicative decrease took it well under where it started, and it left slow start
+    assert limiter.rate < 60.0
+    assert not limiter._slow_start
+    assert len(fake.api_successes) == 80
+
+
+def test_retry_after_pauses_every_caller(free_port):
+    fake = make_fake(5)
+    fake.throttle_next(1, retry_after="1")
+    limiter = AdaptiveRateLimiter(rate=5.0, max_rate=5.0)
+
+    async def run():
+        async with fake.serve(free_port), ClientSession() as session:
+            start = time.monotonic()
+            documents = await get_documents(session, fake, range(1, 6), limiter)
+            return documents, start
+
+    documents, start = asyncio.run(run())
+    assert [doc["id"] for doc in documents] == [1, 2, 3, 4, 5]
+    assert fake.requests["throttled"] == limiter.throttled == 1
+    assert limiter.rate < 5.0
+    # No caller got through while the bucket was paused
+    assert min(fake.api_successes) - start >= 0.95
+
+
+def test_retry_after_as_http_date(free_port):
+    fake = make_fake(1)
+    fake.throttle_next(2, retry_after="Wed, 21 Oct 2015 07:28:00 GMT")
+    fake.throttle_next(1, retry_after=None)
+    limiter = AdaptiveRateLimiter(rate=50.0, max_rate=50.0, cooldown=0.0)
+
+    async def run():
+        async with fake.serve(free_port), ClientSession() as session:
+            return await get_documents(session, fake, [1], limiter)
+
+    assert asyncio.run(run())[0]["id"] == 1
+    assert limiter.throttled == 3
+
+
+def test_token_refreshed_once_under_concurrent_401s(free_port):
+    fake = make_fake(20, reject_status=401)
+
+    async def run():
+        async with fake.serve(free_port), ClientSession() as session:
+            await get_documents(session, fake, [1])
+            fake.expire_tokens()
+            return await get_documents(session, fake, range(1, 21))
+
+    documents = asyncio.run(run())
+    assert [doc["id"] for doc in documents] == list(range(1, 21))
+    assert fake.requests["rejected_token"] == 20
+    assert fake.requests["token"] == 2
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+
+import s3_listing
+from s3_listing import S3Manifest
+from shards import open_s3_client
+
+BUCKET = "obd-sum-stats"
+
+
+async def refresh(manifest: S3Manifest, max_age: float) -> dict:
+    async with open_s3_client() as s3:
+        return await manifest.refresh(s3, max_age)
+
+
+# Another instance on the same files (the exporter next to the collector) records a PUT, then
+# lists again; a fresh manifest still sees both on its next refresh, without listing
+def test_refresh_reads_what_other_instances_wrote(s3, tmp_path):
+    path = tmp_path / "manifest.parquet"
+    s3.put_object(Bucket=BUCKET, Key="1.json", Body=b"{}")
+    first = S3Manifest(BUCKET, path=path)
+    asyncio.run(refresh(first, 0))
+    assert first.keys() == ["1.json"]
+
+    second = S3Manifest(BUCKET, path=path)
+    second.record("2.json", 2, '"etag-2"')
+    asyncio.run(refresh(first, 3600))
+    assert first.keys() == ["1.json", "2.json"]
+
+    s3.put_object(Bucket=BUCKET, Key="3.json", Body=b"{}")
+    asyncio.run(refresh(second, 0))
+    asyncio.run(refresh(first, 3600))
+    assert first.keys() == ["1.json", "3.json"]
+    assert first.listed_at == second.listed_at
+
+
+# An object recorded (by another process) while a listing rewrites the log waits for the
+# rewrite to finish instead of being truncated away
+def test_record_during_log_rewrite_is_kept(s3, tmp_path, monkeypatch):
+    path = tmp_path / "manifest.parquet"
+    s3.put_object(Bucket=BUCKET, Key="1.json", Body=b"{}")
+    lister = S3Manifest(BUCKET, path=path)
+    writer = S3Manifest(BUCKET, path=path)
+    read_log = s3_listing._read_log
+    recorders = []
+
+    # Between reading the log and rewriting it
+    def read_log_racing_a_record(f):
+        entries = read_log(f)
+        if f.mode == "a+" and not recorders:
+            recorders.append(threading.Thread(target=writer.record, args=("2.json", 2, "etag-2")))
+            recorders[0].start()
+            recorders[0].join(0.2)
+        return entries
+
+    monkeypatch.setattr(s3_listing, "_read_log", read_log_racing_a_record)
+    asyncio.run(refresh(lister, 0))
+    recorders[0].join()
+    assert S3Manifest(BUCKET, path=path).keys() == ["1.json", "2.json"]
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import make_document, make_page_text
+import sum_from_S3
+from codec import encode_document, serialize_document
+from ledger import STATS_STAGE
+from sum_from_S3 import DocumentScheduler, DocumentStatsCollector, init_stats_worker
+from sum_stats import DocumentStatsAnalyzer
+
+BUCKET = "obd-sum-stats"
+
+
+def upload(s3, doc_ids, compressions=(None, "gzip", "zstd")) -> dict:
+    rng = random.Random(0)
+    bundles = {}
+    for doc_id in doc_ids:
+        bundle = make_document(doc_id, rng.randint(1, 4), 40, rng)
+        body, _ = encode_document(bundle, compressions[doc_id % len(compressions)])
+        s3.put_object(Bucket=BUCKET, Key=f"{doc_id}.json", Body=body)
+        bundles[doc_id] = bundle
+    return bundles
+
+
+@pytest.fixture
+def make_collector(tmp_path, monkeypatch):
+    # The stats files go under data/ in the working directory
+    monkeypatch.chdir(tmp_path)
+
+    def make(**kwargs):
+        kwargs = {"workers": 1, "token_counters": ["regex"], "metrics_path": None, "listing_max_age": 0, **kwargs}
+        return DocumentStatsCollector(BUCKET, ledger_path=str(tmp_path / "ledger.sqlite3"), **kwargs)
+
+    return make
+
+
+async def collect(stream) -> list:
+    return [item async for item in stream]
+
+
+def test_stream_docs_yields_each_pending_document_once(s3, make_collector):
+    bundles = upload(s3, range(1, 31))
+    collector = make_collector()
+    collector._ledger.record_many([str(i) for i in range(1, 6)], STATS_STAGE, "tokenized")
+    collector._ledger.flush()
+
+    # Few fetchers and a tiny queue, so the fetchers block on backpressure
+    docs = asyncio.run(collect(collector.stream_docs(fetch_concurrency=3, queue_size=2)))
+    assert sorted(doc_id for doc_id, _ in docs) == list(range(6, 31))
+    for doc_id, body in docs:
+        assert json.loads(body) == json.loads(json.dumps(bundles[doc_id]))
+    assert collector.prefetch_status()["failed"] == 0
+
+
+def test_stream_docs_skips_undecodable_objects(s3, make_collector):
+    upload(s3, range(1, 6))
+    s3.put_object(Bucket=BUCKET, Key="999.json", Body=b"not a document")
+    collector = make_collector()
+    docs = asyncio.run(collect(collector.stream_docs()))
+    assert sorted(doc_id for doc_id, _ in docs) == [1, 2, 3, 4, 5]
+    assert collector.prefetch_status()["failed"] == 1
+
+
+# Documents that failed max_errors times are no longer fetched, like on the export side
+def test_stream_docs_gives_up_after_max_errors(s3, make_collector):
+    upload(s3, range(1, 6))
+    collector = make_collector(max_errors=2)
+    for _ in range(2):
+        collector._ledger.record(2, STATS_STAGE, "failed", error="ValueError()")
+    collector._ledger.record(3, STATS_STAGE, "failed", error="ValueError()")
+    docs = asyncio.run(collect(collector.stream_docs()))
+    assert sorted(doc_id for doc_id, _ in docs) == [1, 3, 4, 5]
+
+
+def test_process_documents_writes_stats_and_resumes(s3, make_collector):
+    bundles = upload(s3, range(1, 21))
+    asyncio.run(make_collector().process_documents_async())
+    docs = pd.read_parquet("data/document_stats")
+    pages = pd.read_parquet("data/page_token_counts")
+    assert sorted(docs["doc_id"].astype(int)) == list(range(1, 21))
+    assert len(pages) == sum(len(bundle["text_json"]["pages"]) for bundle in bundles.values())
+    assert (docs["token_total"] > 0).all()
+
+    # A rerun only picks up the document added since
+    upload(s3, [21])
+    collector = make_collector()
+    asyncio.run(collector.process_documents_async())
+    docs = pd.read_parquet("data/document_stats")
+    assert sorted(docs["doc_id"].astype(int)) == list(range(1, 22))
+    assert collector._ledger.count(STATS_STAGE, ("tokenized",)) == 21
+
+
+# Pages under min_page_quality are not tokenized: null tokens, and left out of the document stats
+def test_skipped_pages_are_null_and_excluded(s3, make_collector):
+    rng = random.Random(0)
+    texts = [make_page_text(rng, 80), "", make_page_text(rng, 40), "~|_=+*^#@%&<>{}[]\\/;:" * 8]
+    pages = [{"page": i, "contents": text} for i, text in enumerate(texts)]
+    bundle = {"doc_id": 1, "metadata": {}, "text_json": {"pages": pages}}
+    s3.put_object(Bucket=BUCKET, Key="1.json", Body=encode_document(bundle)[0])
+    asyncio.run(make_collector(page_quality=True).process_documents_async())
+
+    pages = pd.read_parquet("data/page_token_counts").sort_values("page_number")
+    tokens = pages["tokens_per_page"].tolist()
+    assert pd.isna(tokens[1]) and pd.isna(tokens[3])
+    kept = [tokens[0], tokens[2]]
+    doc = pd.read_parquet("data/document_stats").iloc[0]
+    assert doc["token_total"] == sum(kept)
+    assert doc["token_min"] == min(kept) > 0
+    assert doc["token_avg_per_page"] == pytest.approx(sum(kept) / 2)
+
+    analyzer = DocumentStatsAnalyzer("data/document_stats", "data/page_token_counts")
+    analyzer.load_data()
+    assert analyzer.page_tokens["tokens_per_page"].count() == 2
+    assert len(analyzer.plot_all()) > 0
+    analyzer.load_summary()
+    assert analyzer.summary.columns["tokens_per_page"].describe()["count"] == 2
+
+
+# The near-duplicate index is saved with the stats, so a later run flags pages that repeat one
+# tokenized in an earlier run; a document indexed but not recorded as tokenized doesn't match itself
+def test_near_duplicates_across_runs(s3, make_collector):
+    rng = random.Random(0)
+    cover = make_page_text(rng, 80)
+
+    def put(doc_id, texts):
+        pages = [{"page": i, "contents": text} for i, text in enumerate(texts)]
+        bundle = {"doc_id": doc_id, "metadata": {}, "text_json": {"pages": pages}}
+        s3.put_object(Bucket=BUCKET, Key=f"{doc_id}.json", Body=encode_document(bundle)[0])
+
+    put(1, [cover, make_page_text(rng, 80)])
+    asyncio.run(make_collector(near_duplicates=True).process_documents_async())
+
+    put(2, [make_page_text(rng, 80), cover + " Attachment 2."])
+    collector = make_collector(near_duplicates=True)
+    asyncio.run(collector.process_documents_async())
+    pages = pd.read_parquet("data/page_token_counts").set_index(["doc_id", "page_number"])["near_duplicate_of"]
+    assert pages.fillna("").to_dict() == {("1", 0): "", ("1", 1): "", ("2", 0): "", ("2", 1): "1:0"}
+
+    # As after a crash between saving the index and committing the stats
+    collector._ledger.record(2, STATS_STAGE, "failed", error="interrupted")
+    collector._ledger.flush()
+    asyncio.run(make_collector(near_duplicates=True).process_documents_async())
+    pages = pd.read_parquet("data/page_token_counts")
+    assert pages[pages["doc_id"] == "2"]["near_duplicate_of"].fillna("").tolist() == ["", "1:0"] * 2
+
+
+# Documents over split_bytes are parsed in a thread, so the event loop (the fetchers) keeps
+# running while a large one is read, and their rows match an unsplit run
+def test_split_documents_are_parsed_off_the_event_loop(monkeypatch):
+    rng = random.Random(0)
+    corpus = [(doc_id, serialize_document(make_document(doc_id, 12, 40, rng))) for doc_id in range(1, 4)]
+
+    async def docs():
+        for item in corpus:
+            yield item
+
+    async def run(pool, **kwargs) -> tuple[dict, int]:
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.001)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        scheduler = DocumentScheduler(pool, workers=2, **kwargs)
+        rows = {doc_id: result async for doc_id, result, error in scheduler.run(docs())}
+        ticker.cancel()
+        return rows, ticks
+
+    with ProcessPoolExecutor(max_workers=2, initializer=init_stats_worker, initargs=(["regex"],)) as pool:
+        whole, _ = asyncio.run(run(pool))
+        iter_pages = sum_from_S3.iter_pages
+
+        def slow_iter_pages(body):
+            for page in iter_pages(body):
+                time.sleep(0.005)
+                yield page
+
+        monkeypatch.setattr(sum_from_S3, "iter_pages", slow_iter_pages)
+        split, ticks = asyncio.run(run(pool, split_bytes=1, pages_per_task=5))
+    assert split == whole
+    # 36 pages at 5ms each: the loop kept ticking through most of it
+    assert ticks > 50
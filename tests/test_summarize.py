@@ -0,0 +1,125 @@
+import asyncio
+import random
+
+import pandas as pd
+import pytest
+
+from benchmarks.fake_llm import FakeLLM
+from benchmarks.synthetic import make_document
+from chunk_planner import PageTable, plan_documents
+from codec import encode_document
+from summarize import Summarizer
+from token_counters import make_counter
+
+BUCKET = "obd-sum-stats"
+CONTEXT = 1024
+SUMMARY_TOKENS = 100
+
+
+# Short documents and one, 2.json (listed after 1, 10, 11 and 12), long enough for several map
+# chunks and a reduce; returns each document's page texts
+@pytest.fixture
+def corpus(s3, tmp_path, monkeypatch) -> dict[int, list[str]]:
+    monkeypatch.chdir(tmp_path)
+    rng = random.Random(0)
+    texts = {}
+    for doc_id in range(1, 13):
+        bundle = make_document(doc_id, 30 if doc_id == 2 else rng.randint(1, 3), 150, rng)
+        s3.put_object(Bucket=BUCKET, Key=f"{doc_id}.json", Body=encode_document(bundle, "gzip")[0])
+        texts[doc_id] = [page["contents"] for page in bundle["text_json"]["pages"]]
+    return texts
+
+
+# LLM calls per document by chunk_planner's estimate for the same token counts
+def planned_calls(corpus: dict) -> dict[str, int]:
+    counter = make_counter("regex")
+    doc_ids, page_numbers, tokens = [], [], []
+    for doc_id, texts in corpus.items():
+        doc_ids += [doc_id] * len(texts)
+        page_numbers += range(len(texts))
+        tokens += counter.count(texts)
+    plan = plan_documents(PageTable(doc_ids, page_numbers, tokens), "map_reduce", CONTEXT,
+                          summary_tokens=SUMMARY_TOKENS)
+    return dict(zip(plan["doc_id"].astype(str), plan["llm_calls"]))
+
+
+# For a FakeLLM served on port
+def make_summarizer(port: int, tmp_path, **kwargs) -> Summarizer:
+    return Summarizer(
+        BUCKET, endpoint=f"http://127.0.0.1:{port}/v1", model="fake", context=CONTEXT, summary_tokens=SUMMARY_TOKENS,
+        output_path=str(tmp_path / "summaries"), ledger_path=str(tmp_path / "ledger.sqlite3"), **kwargs,
+    )
+
+
+def run(fake: FakeLLM, port: int, *summarizers, max_documents=None) -> list[dict]:
+    async def go():
+        async with fake.serve(port):
+            return [await summarizer.summarize_async(max_documents) for summarizer in summarizers]
+
+    return asyncio.run(go())
+
+
+def test_map_reduce_summaries(corpus, tmp_path, free_port):
+    fake = FakeLLM(latency=0.01)
+    counts, = run(fake, free_port, make_summarizer(free_port, tmp_path))
+    summaries = pd.read_parquet(tmp_path / "summaries").set_index("doc_id")
+    assert sorted(summaries.index.astype(int)) == sorted(corpus)
+    assert counts["summarized"] == len(corpus) and counts["failed"] == 0
+    assert summaries["llm_calls"].to_dict() == planned_calls(corpus)
+    assert fake.max_prompt_words <= CONTEXT
+
+    long = summaries.loc["2"]
+    assert long["chunks"] > 1 and long["llm_calls"] > long["chunks"]
+    # The fake answers with the prompt's last words, so mapping then reducing ends with the
+    # document's last words
+    assert long["summary"].split() == " ".join(corpus[2]).split()[-SUMMARY_TOKENS:]
+
+
+# Stopped after three documents, then killed partway through the long one: the rerun skips the
+# documents already written and gets the chunks mapped before the kill from the page cache
+def test_resume_after_interruption(corpus, tmp_path, free_port):
+    fake = FakeLLM(latency=0.02)
+    cache = str(tmp_path / "page_cache.sqlite3")
+    # One fetcher, so documents come in listing order
+    first, = run(fake, free_port, make_summarizer(free_port, tmp_path, page_cache_path=cache, fetch_concurrency=1),
+                 max_documents=3)
+    assert first["summarized"] == 3
+
+    async def interrupted():
+        async with fake.serve(free_port):
+            summarizer = make_summarizer(free_port, tmp_path, page_cache_path=cache, initial_concurrency=2,
+                                         max_concurrency=2, max_documents_in_flight=1, fetch_concurrency=1)
+            task = asyncio.create_task(summarizer.summarize_async())
+            while fake.requests["completed"] < first["llm_calls"] + 4:
+                await asyncio.sleep(0.005)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(interrupted())
+    completed_before = fake.requests["completed"]
+    last, = run(fake, free_port, make_summarizer(free_port, tmp_path, page_cache_path=cache))
+
+    summaries = pd.read_parquet(tmp_path / "summaries")
+    assert sorted(summaries["doc_id"].astype(int)) == sorted(corpus)
+    planned = sum(planned_calls(corpus).values())
+    assert last["cached_calls"] > 0
+    # At most the two requests in flight when it was killed are sent again
+    assert planned <= fake.requests["completed"] <= planned + 2
+    assert last["llm_calls"] == fake.requests["completed"] - completed_before
+
+
+# 429s for too many requests in flight (no Retry-After) and 500s, then 429s with Retry-After
+@pytest.mark.parametrize("server,rejections", [
+    ({"max_concurrency": 2, "failure_rate": 0.3}, ("overloaded", "failed")),
+    ({"rate_limit": 50.0}, ("rate_limited",)),
+], ids=["overloaded", "rate_limited"])
+def test_retries_throttling_and_server_errors(corpus, tmp_path, free_port, server, rejections):
+    fake = FakeLLM(latency=0.02, **server)
+    counts, = run(fake, free_port, make_summarizer(free_port, tmp_path, initial_concurrency=8, max_retries=12))
+    assert counts["summarized"] == len(corpus) and counts["failed"] == 0
+    assert all(fake.requests[reason] > 0 for reason in rejections)
+    assert counts["throttled"] == fake.requests["overloaded"] + fake.requests["rate_limited"]
+    if "max_concurrency" in server:
+        assert fake.peak_in_flight <= server["max_concurrency"]
+    summaries = pd.read_parquet(tmp_path / "summaries")
+    assert summaries["doc_id"].is_unique and len(summaries) == len(corpus)
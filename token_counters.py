@@ -0,0 +1,178 @@
+import hashlib
+import re
+from collections.abc import Iterable
+
+from token_engine import TokenizationEngine, get_engine
+
+# Token counters share one interface: a `name` (used in column names) and count(texts), which
+# returns one count per text. Specs pick a backend and its argument, optionally with a column
+# name in front, so several tokenizers of the same kind can run side by side:
+#
+#   regex                               \w+ runs and single punctuation marks
+#   whitespace                          str.split()
+#   spacy:en_core_web_sm                spaCy tokenizer (the original stats)
+#   hf:/models/llama3/tokenizer.json    Hugging Face `tokenizers` file (BPE, WordPiece, Unigram)
+#   sentencepiece:/models/mistral.model SentencePiece model file
+#   tiktoken:cl100k_base                tiktoken encoding (set TIKTOKEN_CACHE_DIR to run offline)
+#   llama3=hf:/models/llama3/tokenizer.json
+#
+# The LLM tokenizer backends are optional dependencies, imported only when used. Each counter
+# also has a `version` identifying exactly what it counts with (package version plus pattern,
+# model or a digest of the vocab file), which page_cache.py keys cached counts on.
+
+_COLUMN_NAME = re.compile(r"^[a-z][a-z0-9_]*$")
+
+
+def _file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()[:16]
+
+
+class RegexCounter:
+    def __init__(self, pattern: str = r"\w+|[^\w\s]", name: str = "regex"):
+        self.name = name
+        self._pattern = re.compile(pattern)
+        self.version = f"regex:{pattern}"
+
+    def count(self, texts: Iterable[str]) -> list[int]:
+        return [sum(1 for _ in self._pattern.finditer(text)) for text in texts]
+
+
+class WhitespaceCounter:
+    def __init__(self, name: str = "whitespace"):
+        self.name = name
+        self.version = "whitespace"
+
+    def count(self, texts: Iterable[str]) -> list[int]:
+        return [len(text.split()) for text in texts]
+
+
+class SpacyCounter:
+    def __init__(self, model_name: str = "en_core_web_sm", batch_size: int = 64, name: str = "spacy", engine=None):
+        self.name = name
+        self._engine = engine or TokenizationEngine(model_name, batch_size)
+        self.version = self._engine.version
+
+    def count(self, texts: Iterable[str]) -> list[int]:
+        return self._engine.count_tokens(texts)
+
+
+class HFTokenizerCounter:
+    # Counts exclude special tokens: they're per request, not per page
+    def __init__(self, path: str, name: str = "hf"):
+        try:
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("hf token counters need the tokenizers package") from e
+        self.name = name
+        self._tokenizer = Tokenizer.from_file(path)
+        self.version = f"hf:{_file_digest(path)}"
+
+    def count(self, texts: Iterable[str]) -> list[int]:
+        encodings = self._tokenizer.encode_batch(list(texts), add_special_tokens=False)
+        return [len(encoding.ids) for encoding in encodings]
+
+
+class SentencePieceCounter:
+    def __init__(self, path: str, name: str = "sentencepiece"):
+        try:
+            import sentencepiece
+        except ImportError as e:
+            raise ImportError("sentencepiece token counters need the sentencepiece package") from e
+        self.name = name
+        self._processor = sentencepiece.SentencePieceProcessor(model_file=path)
+        self.version = f"sentencepiece:{_file_digest(path)}"
+
+    def count(self, texts: Iterable[str]) -> list[int]:
+        return [len(ids) for ids in self._processor.encode(list(texts))]
+
+
+class TiktokenCounter:
+    def __init__(self, encoding_name: str = "cl100k_base", name: str = "tiktoken"):
+        try:
+            import tiktoken
+        except ImportError as e:
+            raise ImportError("tiktoken token counters need the tiktoken package") from e
+        self.name = name
+        self._encoding = tiktoken.get_encoding(encoding_name)
+        self.version = f"tiktoken-{tiktoken.__version__}:{encoding_name}"
+
+    def count(self, texts: Iterable[str]) -> list[int]:
+        return [len(ids) for ids in self._encoding.encode_ordinary_batch(list(texts))]
+
+
+# The constructor argument each backend's ":arg" fills
+_BACKEND_ARGS = {
+    "regex": "pattern",
+    "spacy": "model_name",
+    "hf": "path",
+    "sentencepiece": "path",
+    "tiktoken": "encoding_name",
+}
+
+COUNTER_BACKENDS = {
+    "regex": RegexCounter,
+    "whitespace": WhitespaceCounter,
+    "spacy": SpacyCounter,
+    "hf": HFTokenizerCounter,
+    "sentencepiece": SentencePieceCounter,
+    "tiktoken": TiktokenCounter,
+}
+
+
+# "name=backend:arg" -> (name, backend, arg); a "=" after the backend belongs to the argument
+def _split_spec(spec: str) -> tuple[str, str, str]:
+    name, sep, rest = spec.partition("=")
+    if not sep or ":" in name:
+        name, rest = "", spec
+    backend, _, arg = rest.partition(":")
+    if backend not in COUNTER_BACKENDS:
+        raise ValueError(f"Unknown token counter: {spec}")
+    name = name or backend
+    if not _COLUMN_NAME.match(name):
+        raise ValueError(f"Token counter name {name!r} must be lowercase letters, digits and underscores")
+    return name, backend, arg
+
+
+def make_counter(spec: str, batch_size: int = 64):
+    name, backend, arg = _split_spec(spec)
+    kwargs = {"name": name}
+    if arg:
+        if backend not in _BACKEND_ARGS:
+            raise ValueError(f"{backend} token counters take no argument: {spec}")
+        kwargs[_BACKEND_ARGS[backend]] = arg
+    elif backend in ("hf", "sentencepiece"):
+        raise ValueError(f"{backend} token counters need a tokenizer file: {backend}:/path/to/file")
+    if backend == "spacy":
+        kwargs["batch_size"] = batch_size
+    return COUNTER_BACKENDS[backend](**kwargs)
+
+
+# Column names in spec order, validated without loading any tokenizer (the parent process needs
+# them for the output schema)
+def counter_names(specs: list[str]) -> list[str]:
+    names = []
+    for spec in specs:
+        name = _split_spec(spec)[0]
+        if name in names:
+            raise ValueError(f"Two token counters are named {name!r}; name them with name=spec")
+        names.append(name)
+    return names
+
+
+_counters: list | None = None
+
+
+# ProcessPoolExecutor initializer: load every tokenizer once per worker. The first counter fills
+# the token_* / tokens_per_page columns, the others get columns suffixed with their names.
+def init_counters(specs: list[str], batch_size: int = 64):
+    global _counters
+    counter_names(specs)
+    _counters = [make_counter(spec, batch_size) for spec in specs]
+
+
+# Falls back to the spaCy engine alone when called outside an initialized pool (serial runs)
+def get_counters() -> list:
+    if _counters is None:
+        return [SpacyCounter(engine=get_engine())]
+    return _counters
@@ -0,0 +1,47 @@
+from collections.abc import Iterable
+
+import spacy
+
+# Token counts only depend on the tokenizer; none of these components merge or split tokens,
+# so excluding them keeps len(doc) identical while skipping their load and inference cost.
+COUNTING_EXCLUDES = [
+    "tok2vec",
+    "tagger",
+    "morphologizer",
+    "parser",
+    "senter",
+    "attribute_ruler",
+    "lemmatizer",
+    "ner",
+]
+
+
+class TokenizationEngine:
+    def __init__(self, model_name: str = "en_core_web_sm", batch_size: int = 64):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._nlp = spacy.load(model_name, exclude=COUNTING_EXCLUDES)
+        # Changes whenever spaCy or the model package does, so cached counts go stale with them
+        self.version = f"spacy-{spacy.__version__}:{self._nlp.meta.get('name')}-{self._nlp.meta.get('version')}"
+
+    # Stream pages through the pipeline in batches and keep only the counts; texts may be a
+    # generator, so pages can be decoded lazily as the pipeline consumes them
+    def count_tokens(self, texts: Iterable[str]) -> list[int]:
+        return [len(doc) for doc in self._nlp.pipe(texts, batch_size=self.batch_size)]
+
+
+_engine: TokenizationEngine | None = None
+
+
+# ProcessPoolExecutor initializer: load the model once per worker process
+def init_worker(model_name: str = "en_core_web_sm", batch_size: int = 64):
+    global _engine
+    _engine = TokenizationEngine(model_name, batch_size)
+
+
+# Falls back to a default engine when called outside an initialized pool (e.g. serial runs)
+def get_engine() -> TokenizationEngine:
+    global _engine
+    if _engine is None:
+        _engine = TokenizationEngine()
+    return _engine